@@ -1,4 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
 from .models import Post
+from .visibility import get_visibility_index
+from . import bus, caching
+
+GROUP_IDS_KEY = 'story:group_ids:%d'
+
+def invalidate_group_ids(user_ids):
+  """
+  Drops the cached group ids of the given users, in this process and through
+  the invalidation bus in the others.
+  """
+  user_ids = list(user_ids)
+  drop_group_ids(user_ids)
+  if transaction.get_connection().in_atomic_block:
+    # Group ids read before the change commits would be cached until the
+    # timeout, so they are dropped again after it.
+    transaction.on_commit(lambda: drop_group_ids(user_ids))
+  cached = getattr(settings, 'STORY_GROUP_IDS_TIMEOUT', None) is not None
+  if cached and caching.is_local():
+    bus.send('group_ids', user_ids=user_ids)
+
+def drop_group_ids(user_ids):
+  cache.delete_many([GROUP_IDS_KEY % user_id for user_id in user_ids])
+
+bus.register('group_ids', drop_group_ids)
 
 class ObjectPermissionsBackend:
   def has_perm(self, user_obj, perm, obj=None):
@@ -10,21 +38,101 @@ class ObjectPermissionsBackend:
       return self.has_view_perm(user_obj, obj)
     elif perm == 'story.change_post' or perm == 'story.delete_post':
       return self.has_change_perm(user_obj, obj)
+    elif perm == 'auth.change_group':
+      return self.has_group_perm(user_obj, obj)
 
   def has_view_perm(self, user_obj, obj):
-    if obj.viewed_by == 'all':
-      return True
-    elif obj.viewers.intersection(user_obj.groups.all()):
-        return True
-    return False
+    return bool(self.filter_viewable(user_obj, [obj]))
 
   def has_change_perm(self, user_obj, obj):
-    return user_obj.groups.all().filter(id=obj.knower.id).exists()
+    return bool(self.filter_changeable(user_obj, [obj]))
+
+  def has_group_perm(self, user_obj, group):
+    """
+    Members of a group manage its members.
+    """
+    return group.id in self.get_group_ids(user_obj)
+
+  def get_group_ids(self, user_obj):
+    """
+    Returns the set of ids of the groups the user belongs to.
+
+    The set is kept on the user object for the rest of the request, like the
+    permission cache of ModelBackend. If STORY_GROUP_IDS_TIMEOUT is set, it is
+    also kept in the cache between requests until the user's memberships
+    change.
+    """
+    if not user_obj.is_authenticated:
+      return frozenset()
+    if hasattr(user_obj, '_group_ids_cache'):
+      return user_obj._group_ids_cache
+
+    timeout = getattr(settings, 'STORY_GROUP_IDS_TIMEOUT', None)
+    group_ids = None
+    if timeout:
+      group_ids = cache.get(GROUP_IDS_KEY % user_obj.pk)
+    if group_ids is None:
+      group_ids = frozenset(user_obj.groups.values_list('id', flat=True))
+      if timeout:
+        cache.set(GROUP_IDS_KEY % user_obj.pk, group_ids, timeout)
+    user_obj._group_ids_cache = group_ids
+    return group_ids
+
+  def filter_viewable(self, user_obj, posts):
+    """
+    Returns the posts that the user can view, in the order given.
+
+    Public posts need no query. Private posts are resolved together with at
+    most one query for the user's groups and one for their viewers, or from the
+    visibility index without the viewers query when it is enabled and warm.
+    Posts from the object cache carry their viewers, so they need no viewers
+    query either.
+    """
+    posts = list(posts)
+    private = [post for post in posts if post.viewed_by != 'all']
+    if not private:
+      return posts
+
+    if all(hasattr(post, '_viewer_ids_cache') for post in private):
+      group_ids = self.get_group_ids(user_obj)
+      return [
+        post for post in posts
+        if post.viewed_by == 'all' or post._viewer_ids_cache & group_ids
+      ]
+    private = [post.id for post in private]
+
+    index = get_visibility_index()
+    if index is not None:
+      if index.warm:
+        return index.filter_viewable(self.get_group_ids(user_obj), posts)
+      index.load_async()
+
+    viewers = Post.viewers.through.objects.filter(
+      post_id__in=private,
+      group_id__in=self.get_group_ids(user_obj)
+    )
+    viewable = set(viewers.values_list('post_id', flat=True))
+    return [
+      post for post in posts
+      if post.viewed_by == 'all' or post.id in viewable
+    ]
+
+  def filter_changeable(self, user_obj, posts):
+    """
+    Returns the posts that the user can change, in the order given, with at
+    most one query for the user's groups.
+    """
+    posts = list(posts)
+    if not posts:
+      return posts
+
+    group_ids = self.get_group_ids(user_obj)
+    return [post for post in posts if post.knower_id in group_ids]
 
   def get_viewable_posts(self, user_obj=None):
     public = Post.objects.filter(viewed_by__exact='all')
     if user_obj is None: return public
 
-    groups = user_obj.groups.all()
+    groups = self.get_group_ids(user_obj)
     private = Post.objects.filter(viewed_by__exact='some', viewers__in=groups)
     return public.union(private)
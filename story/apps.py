@@ -2,3 +2,6 @@ from django.apps import AppConfig
 
 class StoryConfig(AppConfig):
     name = 'story'
+
+    def ready(self):
+        from . import signals, tasks
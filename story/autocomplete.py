@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.db.models.functions import Lower
+
+from .models import UserProfile
+
+LIMIT = 10
+
+# The last character, so that every string starting with a prefix sorts
+# below the prefix followed by it.
+MAX_CHAR = '\U0010ffff'
+
+def prefix_range(field, prefix):
+  """
+  Returns a filter matching the rows where the lower case of the field starts
+  with the prefix, as a range that an index on lower(field) can serve.
+  """
+  prefix = prefix.lower()
+  return {field + '__gte': prefix, field + '__lt': prefix + MAX_CHAR}
+
+def find_users(prefix, exclude_group=None, limit=LIMIT):
+  """
+  Returns the users whose username or profile name starts with the prefix,
+  ignoring case, by username.
+
+  Arguments:
+  exclude_group : a group whose members are left out
+  limit : the most users to return
+  """
+  prefix = prefix.strip()
+  if not prefix:
+    return []
+  users = User.objects.select_related('userprofile')
+  profiles = UserProfile.objects.select_related('user')
+  if exclude_group is not None:
+    users = users.exclude(groups=exclude_group)
+    profiles = profiles.exclude(user__groups=exclude_group)
+
+  # Each name is matched in its own query so that each uses its own index.
+  found = {}
+  users = users.annotate(match=Lower('username')) \
+               .filter(**prefix_range('match', prefix))
+  for user in users.order_by('match')[:limit]:
+    found[user.id] = user
+  profiles = profiles.annotate(match=Lower('name')) \
+                     .filter(**prefix_range('match', prefix))
+  for profile in profiles.order_by('match')[:limit]:
+    profile.user.userprofile = profile
+    found.setdefault(profile.user_id, profile.user)
+  return sorted(found.values(), key=lambda user: user.username)[:limit]
+
+def display_name(user):
+  """
+  Returns the profile name of a user, or their username if they have no
+  profile.
+  """
+  try:
+    return user.userprofile.name
+  except AttributeError:
+    return user.username
@@ -0,0 +1,9 @@
+"""
+Benchmarks of the permission backend and the main views on generated data.
+
+The data is made by data.generate from a seed, so that runs on different
+commits measure the same rows. scenarios.run times each scenario and
+reports latency percentiles and query counts, which the benchmark command
+saves as JSON. visibility holds the permission checks timed both by the
+scenarios and by the bench_visibility command.
+"""
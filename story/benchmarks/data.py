@@ -0,0 +1,66 @@
+import datetime
+import json
+import random
+
+from django.utils import timezone
+
+from story import imports
+
+DEFAULTS = {
+  'seed': 0,
+  'users': 200,
+  'groups': 20,
+  'memberships': 3,
+  'posts': 2000,
+  'private_ratio': 0.5,
+  'viewers': 2,
+}
+
+START = datetime.datetime(2019, 1, 1, tzinfo=timezone.utc)
+
+def records(config):
+  """
+  Yields the import records of a synthetic community.
+
+  Arguments:
+  config : a dict with the keys of DEFAULTS
+    seed : the seed of the generator; the same seed gives the same records
+    users, groups, posts : the number of each
+    memberships : the number of groups each user belongs to
+    private_ratio : the share of posts viewed by some groups only
+    viewers : the number of groups that view each private post
+  """
+  rng = random.Random(config['seed'])
+  groups = ['group%d' % i for i in range(config['groups'])]
+  users = ['user%d' % i for i in range(config['users'])]
+
+  for name in groups:
+    yield {'model': 'group', 'name': name}
+  for name in users:
+    yield {
+      'model': 'user',
+      'username': name,
+      'groups': rng.sample(groups, min(config['memberships'], len(groups))),
+    }
+  for i in range(config['posts']):
+    private = rng.random() < config['private_ratio']
+    yield {
+      'model': 'post',
+      'description': 'Story %d' % i,
+      'date_posted': (START + datetime.timedelta(minutes=i)).isoformat(),
+      'poster': rng.choice(users),
+      'knower': rng.choice(groups),
+      'viewed_by': 'some' if private else 'all',
+      'viewers': rng.sample(groups, min(config['viewers'], len(groups)))
+                 if private else [],
+    }
+
+def generate(config):
+  """
+  Writes a synthetic community to the database.
+
+  Returns:
+  {model: number of rows created}
+  """
+  lines = (json.dumps(record) for record in records(config))
+  return imports.import_records(lines)
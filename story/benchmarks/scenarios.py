@@ -0,0 +1,174 @@
+import math
+import random
+import time
+
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from story.access import ObjectPermissionsBackend
+from story.models import Post
+from story.benchmarks import visibility
+
+# The scenarios run with a cache of their own, so that the cache of the site
+# is never read, written or cleared.
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'story-benchmark',
+  },
+}
+
+# The number of recent posts whose visibility is checked.
+RECENT_POSTS = 100
+
+def percentile(samples, p):
+  """
+  Returns the p-th percentile of the samples by the nearest-rank method.
+  """
+  ordered = sorted(samples)
+  rank = max(int(math.ceil(p / 100.0 * len(ordered))), 1)
+  return ordered[rank - 1]
+
+def summarize(times, queries):
+  return {
+    'samples': len(times),
+    'p50_ms': percentile(times, 50) * 1000,
+    'p95_ms': percentile(times, 95) * 1000,
+    'p99_ms': percentile(times, 99) * 1000,
+    'mean_ms': sum(times) / len(times) * 1000,
+    'queries_mean': sum(queries) / len(queries),
+    'queries_max': max(queries),
+  }
+
+class Fixtures:
+  """
+  The rows that scenarios pick from, chosen with a seeded generator.
+  """
+  def __init__(self, seed):
+    self.rng = random.Random(seed)
+    self.user_ids = self.ids(User)
+    self.post_ids = self.ids(Post)
+    self.group_ids = self.ids(Group)
+    self.clients = {}
+    self.recent_posts = list(
+      Post.objects.order_by('-date_posted')[:RECENT_POSTS]
+    )
+    self.index = None
+
+  def ids(self, model):
+    return list(model.objects.order_by('id').values_list('id', flat=True))
+
+  def user(self):
+    # A fresh object, so that nothing is memoized between samples.
+    return User.objects.get(pk=self.rng.choice(self.user_ids))
+
+  def post(self):
+    return Post.objects.get(pk=self.rng.choice(self.post_ids))
+
+  def visibility_index(self):
+    if self.index is None:
+      self.index = visibility.load_index()
+    return self.index
+
+  def client(self):
+    """
+    Returns a client logged in as a random user.
+    """
+    user_id = self.rng.choice(self.user_ids)
+    if user_id not in self.clients:
+      client = Client()
+      client.force_login(User.objects.get(pk=user_id))
+      self.clients[user_id] = client
+    return self.clients[user_id]
+
+def get(client, url):
+  response = client.get(url)
+  if response.status_code != 200:
+    raise AssertionError('%s returned %d' % (url, response.status_code))
+
+# Each scenario takes the fixtures and returns the function to time.
+
+def get_viewable_posts(fixtures):
+  user = fixtures.user()
+  return lambda: visibility.by_union(
+    ObjectPermissionsBackend(),
+    user,
+    fixtures.recent_posts
+  )
+
+def visibility_index(fixtures):
+  user, index = fixtures.user(), fixtures.visibility_index()
+  return lambda: visibility.by_index(
+    ObjectPermissionsBackend(),
+    index,
+    user,
+    fixtures.recent_posts
+  )
+
+def has_view_perm(fixtures):
+  user, post = fixtures.user(), fixtures.post()
+  return lambda: ObjectPermissionsBackend().has_view_perm(user, post)
+
+def index_view(fixtures):
+  client = fixtures.client()
+  return lambda: get(client, reverse('story:index'))
+
+def post_view(fixtures):
+  client = fixtures.client()
+  url = reverse(
+    'story:post',
+    kwargs={'pk': fixtures.rng.choice(fixtures.post_ids)}
+  )
+  return lambda: get(client, url)
+
+def group_profile_view(fixtures):
+  client = fixtures.client()
+  url = reverse(
+    'story:group_profile',
+    kwargs={'pk': fixtures.rng.choice(fixtures.group_ids)}
+  )
+  return lambda: get(client, url)
+
+SCENARIOS = {
+  'get_viewable_posts': get_viewable_posts,
+  'visibility_index': visibility_index,
+  'has_view_perm': has_view_perm,
+  'IndexView': index_view,
+  'PostView': post_view,
+  'GroupProfileView': group_profile_view,
+}
+
+def run(names=None, samples=100, seed=0, cold_cache=False):
+  """
+  Times the given scenarios, or all of them, with a local memory cache of
+  their own.
+
+  Arguments:
+  samples : the number of times each scenario is timed
+  seed : the seed that picks the users and posts of each sample
+  cold_cache : whether the cache is cleared before each sample
+
+  Returns:
+  {scenario: {samples, p50_ms, p95_ms, p99_ms, mean_ms, queries_mean,
+              queries_max}}
+  """
+  with override_settings(CACHES=CACHES):
+    fixtures = Fixtures(seed)
+    results = {}
+    for name in names or SCENARIOS:
+      times, queries = [], []
+      for i in range(samples):
+        function = SCENARIOS[name](fixtures)
+        if cold_cache:
+          cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+          start = time.perf_counter()
+          function()
+          times.append(time.perf_counter() - start)
+        queries.append(len(captured))
+      results[name] = summarize(times, queries)
+  return results
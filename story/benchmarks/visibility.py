@@ -0,0 +1,21 @@
+from story.visibility import VisibilityIndex
+
+def by_union(backend, user, posts):
+  """
+  Returns the given posts that the user can view, by get_viewable_posts.
+  """
+  viewable = set(
+    backend.get_viewable_posts(user).values_list('id', flat=True)
+  )
+  return [post for post in posts if post.id in viewable]
+
+def by_index(backend, index, user, posts):
+  """
+  Returns the given posts that the user can view, by the visibility index.
+  """
+  return index.filter_viewable(backend.get_group_ids(user), posts)
+
+def load_index():
+  index = VisibilityIndex()
+  index.load()
+  return index
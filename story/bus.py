@@ -0,0 +1,184 @@
+import datetime
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Invalidation
+
+logger = logging.getLogger(__name__)
+
+handlers = {}
+resets = []
+
+def is_enabled():
+  return getattr(settings, 'STORY_INVALIDATION_BUS', False)
+
+def get_interval():
+  return getattr(settings, 'STORY_INVALIDATION_INTERVAL', 1)
+
+def get_retention():
+  return getattr(settings, 'STORY_INVALIDATION_RETENTION', 3600)
+
+def get_window():
+  return getattr(settings, 'STORY_INVALIDATION_WINDOW', 10)
+
+def register(kind, handler):
+  """
+  Sets the function that drops the caches of this process for changes of the
+  given kind sent by other processes. It is called with the arguments given
+  to send.
+  """
+  handlers[kind] = handler
+
+def on_reset(function):
+  """
+  Registers a function that drops all the caches of a module, for when this
+  process may have missed changes.
+  """
+  resets.append(function)
+  return function
+
+class State:
+  def __init__(self):
+    self.lock = threading.Lock()
+    # The highest id of the changes applied, None until the first check.
+    self.last_id = None
+    self.last_check = None
+    self.last_prune = None
+    # The ids of the changes of the last STORY_INVALIDATION_WINDOW seconds
+    # that were already applied.
+    self.seen = set()
+    # The ids of changes sent by this process, which it already applied, with
+    # the times they were sent.
+    self.sent = {}
+
+state = State()
+
+def send(kind, **kwargs):
+  """
+  Records a change for the other processes. The caller has already applied
+  it to the caches of this process, or will once the current transaction
+  commits.
+
+  The change is written once the current transaction commits, in its own
+  transaction, so that other processes only see it once the data it refers
+  to is committed, and so that it is visible soon after its id is assigned.
+  """
+  if is_enabled():
+    transaction.on_commit(lambda: write(kind, kwargs))
+
+def write(kind, kwargs):
+  invalidation = Invalidation.objects.create(
+    kind=kind,
+    args=json.dumps(kwargs)
+  )
+  with state.lock:
+    state.sent[invalidation.id] = time.monotonic()
+
+def reset():
+  for function in resets:
+    function()
+
+def check(force=False):
+  """
+  Applies the changes that other processes sent since the last check.
+
+  Checks at most once every STORY_INVALIDATION_INTERVAL seconds, with a
+  single query, so that caches are at most that stale without a query per
+  request. A process that has not checked for longer than the changes are
+  kept drops all its caches instead.
+
+  Ids are assigned when changes are written, not when they commit, so a
+  change can become visible after changes with higher ids. Each check reads
+  again the changes of the last STORY_INVALIDATION_WINDOW seconds, and
+  applies those it has not seen.
+  """
+  if not is_enabled():
+    return
+  now = time.monotonic()
+  with state.lock:
+    if not force and state.last_check is not None \
+       and now - state.last_check < get_interval():
+      return
+    missed = state.last_check is not None \
+             and now - state.last_check > get_retention()
+    state.last_check = now
+    last_id = state.last_id
+
+  invalidations = Invalidation.objects.using(DEFAULT_DB_ALIAS)
+  cutoff = timezone.now() - datetime.timedelta(seconds=get_window())
+  if last_id is None or missed:
+    # The caches of a new process hold nothing older than now.
+    recent = invalidations.filter(date_created__gte=cutoff)
+    seen = set(recent.values_list('id', flat=True))
+    latest = invalidations.order_by('-id').values_list('id', flat=True)
+    with state.lock:
+      state.last_id = latest.first() or 0
+      state.seen = seen
+      state.sent.clear()
+    if missed:
+      reset()
+    return
+
+  changes = invalidations.filter(
+    Q(id__gt=last_id) | Q(date_created__gte=cutoff)
+  ).order_by('id')
+  seen = set()
+  for change_id, kind, args, date_created in changes.values_list(
+    'id', 'kind', 'args', 'date_created'
+  ):
+    if date_created >= cutoff:
+      seen.add(change_id)
+    with state.lock:
+      state.last_id = max(state.last_id, change_id)
+      if change_id in state.seen \
+         or state.sent.pop(change_id, None) is not None:
+        continue
+    handler = handlers.get(kind)
+    if handler is None:
+      logger.warning('No handler for invalidation %d (%s)', change_id, kind)
+      continue
+    handler(**json.loads(args))
+
+  with state.lock:
+    state.seen = seen
+    # Changes of this process are read within the window after they were
+    # written.
+    state.sent = dict(
+      (i, sent) for i, sent in state.sent.items()
+      if now - sent < 2 * get_window()
+    )
+
+  if state.last_prune is None or now - state.last_prune > get_retention() / 2:
+    state.last_prune = now
+    prune()
+
+def prune():
+  """
+  Deletes the changes older than STORY_INVALIDATION_RETENTION seconds.
+  """
+  cutoff = timezone.now() - datetime.timedelta(seconds=get_retention())
+  # The latest change is kept, so that ids keep increasing.
+  latest = Invalidation.objects.order_by('-id').values_list('id', flat=True)
+  return Invalidation.objects.filter(
+    date_created__lt=cutoff,
+    id__lt=latest.first() or 0
+  ).delete()[0]
+
+class InvalidationMiddleware:
+  """
+  Catches up with the changes sent by other processes before each request,
+  at most once every STORY_INVALIDATION_INTERVAL seconds.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    check()
+    return self.get_response(request)
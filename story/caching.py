@@ -0,0 +1,124 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from . import bus
+
+PUBLIC_VERSION_KEY = 'story:version:public'
+PROFILES_VERSION_KEY = 'story:version:profiles'
+GROUP_VERSION_KEY = 'story:version:group:%d'
+POST_VERSION_KEY = 'story:version:post:%d'
+
+FEED_KEY = 'story:feed:%s:%s'
+POST_KEY = 'story:post:%d:%s:%s'
+
+def get_timeout():
+  return getattr(settings, 'STORY_FRAGMENT_CACHE_TIMEOUT', 600)
+
+def new_version():
+  # Versions are unique tokens rather than counters, so that a version that
+  # was evicted from the cache can never come back with an old value.
+  return uuid.uuid4().hex
+
+def get_versions(keys):
+  """
+  Returns the current version of each of the given keys.
+  """
+  versions = cache.get_many(keys)
+  for key in keys:
+    if key not in versions:
+      cache.add(key, new_version(), None)
+      versions[key] = cache.get(key)
+  return versions
+
+def bump_versions(keys):
+  """
+  Gives each of the given keys a new version.
+  """
+  cache.set_many({key: new_version() for key in keys}, None)
+
+def is_local():
+  """
+  Whether each process has its own cache, as with the default LocMemCache,
+  so that changes must be sent to the other processes.
+  """
+  return isinstance(caches['default'], LocMemCache)
+
+def changed(keys):
+  """
+  Bumps the versions of the given keys in this process, and in the others
+  through the invalidation bus.
+  """
+  bump_versions(keys)
+  if transaction.get_connection().in_atomic_block:
+    # Pages rendered from data read before the change commits would be
+    # cached under the new versions, so they are bumped again after it.
+    transaction.on_commit(lambda: bump_versions(keys))
+  if is_local():
+    bus.send('fragments', keys=keys)
+
+bus.register('fragments', bump_versions)
+
+@bus.on_reset
+def clear():
+  if is_local():
+    cache.clear()
+
+def audience_key(group_ids):
+  """
+  Returns a key shared by every user in exactly the given groups.
+
+  Users with the same groups can view, and change, the same posts. The key
+  changes when any post visible to the groups, or the public posts, change.
+  """
+  group_ids = sorted(group_ids)
+  keys = [PUBLIC_VERSION_KEY, PROFILES_VERSION_KEY] \
+         + [GROUP_VERSION_KEY % g for g in group_ids]
+  versions = get_versions(keys)
+  audience = ','.join(str(g) for g in group_ids) \
+             + '|' + ','.join(versions[key] for key in keys)
+  return hashlib.md5(audience.encode()).hexdigest()
+
+def post_version(post_id):
+  key = POST_VERSION_KEY % post_id
+  versions = get_versions([key, PROFILES_VERSION_KEY])
+  return versions[key] + versions[PROFILES_VERSION_KEY]
+
+def feed_key(audience, cursor):
+  return FEED_KEY % (audience, cursor or '')
+
+def post_key(post_id, cursor):
+  # The body of a post page is the same for everyone allowed to see it.
+  return POST_KEY % (post_id, post_version(post_id), cursor or '')
+
+def posts_changed(post_ids=(), group_ids=(), public=False):
+  """
+  Invalidates the cached pages of the given posts, and the feeds of the
+  audiences that include the given groups, or of every audience if public.
+  """
+  keys = [POST_VERSION_KEY % post_id for post_id in post_ids]
+  keys += [GROUP_VERSION_KEY % group_id for group_id in group_ids]
+  if public:
+    keys.append(PUBLIC_VERSION_KEY)
+  if keys:
+    changed(keys)
+
+def profiles_changed():
+  """
+  Invalidates every cached page, as they show the names of posters and
+  commenters.
+  """
+  changed([PROFILES_VERSION_KEY])
+
+def post_changed(post):
+  """
+  Invalidates the cached pages of a post changed in place, whose audience is
+  the same as before.
+  """
+  group_ids = set(post.viewers.values_list('id', flat=True))
+  group_ids.add(post.knower_id)
+  posts_changed([post.id], group_ids, post.viewed_by == 'all')
@@ -0,0 +1,40 @@
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Comment
+from .pagination import after_cursor
+
+PAGE_SIZE = 20
+
+def get_comments(post, after=None):
+  """
+  Returns the comments on a post, oldest first, with their posters and
+  profiles loaded.
+
+  Arguments:
+  post : the post the comments are on
+  after : a pagination cursor; only comments after it are returned
+  """
+  conditions = Q(post=post)
+  if after:
+    conditions &= after_cursor(after, 'date_posted', 'id')
+  comments = Comment.objects.filter(conditions)
+  comments = comments.select_related('poster__userprofile')
+  return comments.order_by('date_posted', 'id')
+
+def poster_name(comment):
+  """
+  Returns the name to show for the poster of a comment.
+  """
+  try:
+    return comment.poster.userprofile.name
+  except AttributeError:
+    return comment.poster.username
+
+def add_comment(post, poster, text):
+  return Comment.objects.create(
+    post = post,
+    poster = poster,
+    text = text,
+    date_posted = timezone.now(),
+  )
@@ -0,0 +1,126 @@
+import logging
+import mimetypes
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+from .models import Post
+from .storage import blob_storage
+from . import caching, jobs
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL = 'thumbnail.jpg'
+THUMBNAIL_SIZE = (640, 480)
+THUMBNAIL_QUALITY = 80
+
+# The image shown until a post's thumbnail is ready.
+PLACEHOLDER = 'story/images/pic01.jpg'
+
+executor = None
+
+def get_executor():
+  """
+  Returns the process pool that renders derivatives, starting it on first
+  use. STORY_DERIVATIVE_WORKERS sets its size.
+  """
+  global executor
+  if executor is None:
+    executor = ProcessPoolExecutor(
+      max_workers=getattr(settings, 'STORY_DERIVATIVE_WORKERS', None)
+    )
+  return executor
+
+def render_thumbnail(source, destination,
+                     size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+  """
+  Writes a resized, recompressed JPEG copy of an image.
+
+  Runs in a worker process, so it takes paths rather than models.
+
+  Returns:
+  (width, height): the size of the thumbnail
+  """
+  if not os.path.exists(destination):
+    with Image.open(source) as image:
+      image = image.convert('RGB')
+      image.thumbnail(size)
+      os.makedirs(os.path.dirname(destination), exist_ok=True)
+      temporary = destination + '.%d.tmp' % os.getpid()
+      image.save(temporary, 'JPEG', quality=quality, optimize=True,
+                 progressive=True)
+      os.replace(temporary, destination)
+  with Image.open(destination) as image:
+    return image.size
+
+def is_image(name):
+  content_type = mimetypes.guess_type(name)[0]
+  return content_type is not None and content_type.startswith('image/')
+
+def has_thumbnail(post):
+  return Image is not None and post.file and is_image(post.file.name)
+
+def render_post_thumbnail(post):
+  """
+  Renders the thumbnail of a post in this process, as a job does.
+  """
+  name = blob_storage.derivative_name(post.file.name, THUMBNAIL)
+  size = render_thumbnail(post.file.path, blob_storage.path(name))
+  record(post.id, post.file.name, name, size)
+
+def schedule(post):
+  """
+  Queues the thumbnail of a post to be rendered in the background, as a job
+  when STORY_BACKGROUND_JOBS is on, or else in the process pool.
+
+  Does nothing if the post has no image or Pillow is not installed.
+  """
+  if not has_thumbnail(post):
+    return None
+  if jobs.is_enabled():
+    return jobs.enqueue('story.render_thumbnail', post.id)
+
+  name = blob_storage.derivative_name(post.file.name, THUMBNAIL)
+  future = get_executor().submit(
+    render_thumbnail,
+    post.file.path,
+    blob_storage.path(name)
+  )
+  future.add_done_callback(partial(rendered, post.id, post.file.name, name))
+  return future
+
+def record(post_id, file_name, name, size):
+  """
+  Records a rendered thumbnail on its post, unless the file of the post has
+  changed in the meantime.
+  """
+  width, height = size
+  posts = Post.objects.filter(pk=post_id, file=file_name)
+  if posts.update(thumbnail=name, thumbnail_width=width,
+                  thumbnail_height=height, date_modified=timezone.now()):
+    # The feed shows the size of the thumbnail.
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None:
+      caching.post_changed(post)
+
+def rendered(post_id, file_name, name, future):
+  try:
+    size = future.result()
+  except Exception:
+    logger.exception('Could not render the thumbnail of post %d', post_id)
+    return
+
+  # Callbacks run in a thread of the executor, which opens its own connection.
+  try:
+    record(post_id, file_name, name, size)
+  finally:
+    connection.close()
@@ -0,0 +1,140 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse, \
+                        HttpResponseNotModified, Http404
+
+from .storage import blob_storage
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+class RangeNotSatisfiable(Exception):
+  pass
+
+def parse_range(header, size):
+  """
+  Parses a Range header for a file of the given size.
+
+  Only a single byte range is supported. Other headers, including ones with
+  several ranges, are ignored as allowed by RFC 7233.
+
+  Returns:
+  (start, end): the first and last byte of the range, or None to send the
+  whole file.
+  """
+  match = RANGE_RE.match(header.replace(' ', '')) if header else None
+  if not match or match.groups() == ('', ''):
+    return None
+
+  first, last = match.groups()
+  if first:
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+      return None
+  else:
+    # A suffix range holds the last bytes of the file.
+    start = max(size - int(last), 0)
+    end = size - 1
+  if start >= size or end < start:
+    raise RangeNotSatisfiable()
+  return start, end
+
+def get_etag(fieldfile):
+  """
+  Returns a strong ETag for a stored file.
+
+  Files in the content addressed storage are tagged with their digest. Older
+  files are tagged with their modification time and size.
+  """
+  digest = blob_storage.digest_of(fieldfile.name)
+  if digest is None:
+    stat = os.stat(fieldfile.path)
+    digest = '%x-%x' % (int(stat.st_mtime), stat.st_size)
+  return '"%s"' % digest
+
+def read_range(path, start, end):
+  with open(path, 'rb') as f:
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+      chunk = f.read(min(CHUNK_SIZE, remaining))
+      if not chunk:
+        break
+      remaining -= len(chunk)
+      yield chunk
+
+def serve_file(request, fieldfile):
+  """
+  Returns a response serving the given stored file.
+
+  If STORY_SENDFILE_HEADER is set to 'X-Accel-Redirect' or 'X-Sendfile', the
+  web server is told to send the file, and handles ranges itself. Otherwise
+  whole files are sent with a FileResponse, which the WSGI server can hand to
+  sendfile, and single byte ranges are streamed from the file.
+
+  Raises Http404 if the file is missing from the storage.
+  """
+  try:
+    return send_file(request, fieldfile)
+  except FileNotFoundError:
+    raise Http404('The file is missing.')
+
+def send_file(request, fieldfile):
+  etag = get_etag(fieldfile)
+  content_type = mimetypes.guess_type(fieldfile.name)[0] \
+                 or 'application/octet-stream'
+
+  if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+  header = getattr(settings, 'STORY_SENDFILE_HEADER', None)
+  if header == 'X-Accel-Redirect':
+    response = HttpResponse(content_type=content_type)
+    response[header] = getattr(settings, 'STORY_SENDFILE_URL', '/protected/') \
+                       + fieldfile.name
+  elif header == 'X-Sendfile':
+    response = HttpResponse(content_type=content_type)
+    response[header] = fieldfile.path
+  else:
+    response = file_response(request, fieldfile, etag, content_type)
+
+  response['ETag'] = etag
+  response['Accept-Ranges'] = 'bytes'
+  response['Cache-Control'] = 'private'
+  return response
+
+def file_response(request, fieldfile, etag, content_type):
+  size = fieldfile.size
+  header = request.META.get('HTTP_RANGE')
+  if_range = request.META.get('HTTP_IF_RANGE')
+  if if_range is not None and if_range != etag:
+    header = None
+
+  try:
+    byte_range = parse_range(header, size)
+  except RangeNotSatisfiable:
+    response = HttpResponse(status=416)
+    response['Content-Range'] = 'bytes */%d' % size
+    return response
+
+  if byte_range is None:
+    response = FileResponse(open(fieldfile.path, 'rb'),
+                            content_type=content_type)
+    response['Content-Length'] = size
+    return response
+
+  start, end = byte_range
+  response = StreamingHttpResponse(
+    read_range(fieldfile.path, start, end),
+    status=206,
+    content_type=content_type
+  )
+  response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+  response['Content-Length'] = end - start + 1
+  return response
@@ -0,0 +1,144 @@
+import json
+import os
+import zipfile
+
+from django.db.models import Q
+
+from .access import ObjectPermissionsBackend
+from .imports import chunks
+from .models import Comment, Post
+
+CHUNK_SIZE = 200
+FILE_CHUNK_SIZE = 64 * 1024
+
+def group_posts(group, user=None):
+  """
+  Returns the posts known by a group that the user is allowed to view, or
+  all of them if no user is given, oldest first.
+  """
+  posts = Post.objects.filter(knower=group)
+  if user is not None:
+    group_ids = ObjectPermissionsBackend().get_group_ids(user)
+    viewers = Post.viewers.through.objects.filter(group_id__in=group_ids)
+    posts = posts.filter(
+      Q(viewed_by__exact='all')
+      | Q(viewed_by__exact='some', id__in=viewers.values('post_id'))
+    )
+  return posts.select_related('poster', 'knower').order_by('date_posted', 'id')
+
+def file_name(post):
+  """
+  Returns the name of the file of a post in an export archive.
+  """
+  return 'files/%d/%s' % (post.id, os.path.basename(post.file.name))
+
+def export_records(posts, chunk_size=CHUNK_SIZE):
+  """
+  Yields a record for each post with its viewers and comments, in the format
+  read by import_yarns.
+
+  Posts are read with an iterator, and their viewers and comments with one
+  query per chunk of posts, so that memory use does not grow with the number
+  of posts.
+  """
+  for chunk in chunks(posts.iterator(chunk_size=chunk_size), chunk_size):
+    post_ids = [post.id for post in chunk]
+    viewers = {}
+    rows = Post.viewers.through.objects.filter(post_id__in=post_ids)
+    for post_id, name in rows.values_list('post_id', 'group__name'):
+      viewers.setdefault(post_id, []).append(name)
+    comments = {}
+    rows = Comment.objects.filter(post_id__in=post_ids) \
+                          .select_related('poster') \
+                          .order_by('date_posted', 'id')
+    for comment in rows:
+      comments.setdefault(comment.post_id, []).append({
+        'poster': comment.poster.username,
+        'text': comment.text,
+        'date_posted': comment.date_posted.isoformat(),
+      })
+
+    for post in chunk:
+      yield post, {
+        'model': 'post',
+        'id': post.id,
+        'description': post.description,
+        'date_posted': post.date_posted.isoformat(),
+        'poster': post.poster.username if post.poster else None,
+        'knower': post.knower.name,
+        'viewed_by': post.viewed_by,
+        'viewers': sorted(viewers.get(post.id, [])),
+        'file': file_name(post) if post.file else None,
+        'comments': comments.get(post.id, []),
+      }
+
+def export_ndjson(posts):
+  """
+  Yields the lines of an NDJSON export of the given posts.
+  """
+  for post, record in export_records(posts):
+    yield json.dumps(record) + '\n'
+
+class ZipStream:
+  """
+  A write-only file that hands over what was written to it, so that a
+  ZipFile can be streamed without buffering the archive.
+  """
+  def __init__(self):
+    self.position = 0
+    self.buffer = []
+
+  def write(self, data):
+    self.buffer.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self.position
+
+  def flush(self):
+    pass
+
+  def read_written(self):
+    data = b''.join(self.buffer)
+    self.buffer = []
+    return data
+
+def export_zip(posts):
+  """
+  Yields the bytes of a ZIP export of the given posts, holding posts.ndjson
+  and the file of each post.
+
+  The files are copied in chunks, so that at most one chunk of a file is in
+  memory at a time. Files missing from the storage are left out, with their
+  names under 'missing_file' in place of 'file' in their records, as the
+  response is already being sent when they are copied.
+  """
+  stream = ZipStream()
+  # The stream cannot seek, so ZipFile writes the sizes after each entry.
+  with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+    # Only the names of the files are kept until posts.ndjson is written.
+    files = []
+    with archive.open('posts.ndjson', 'w', force_zip64=True) as entry:
+      for post, record in export_records(posts):
+        if post.file and not post.file.storage.exists(post.file.name):
+          record['missing_file'] = record.pop('file')
+          record['file'] = None
+        elif post.file:
+          files.append((post.id, post.file.name))
+        entry.write((json.dumps(record) + '\n').encode())
+        yield stream.read_written()
+
+    for post_id, name in files:
+      post = Post(id=post_id, file=name)
+      try:
+        source = post.file.open('rb')
+      except FileNotFoundError:
+        # Deleted since posts.ndjson was written.
+        continue
+      with source, \
+           archive.open(file_name(post), 'w', force_zip64=True) as entry:
+        for data in source.chunks(FILE_CHUNK_SIZE):
+          entry.write(data)
+          yield stream.read_written()
+  yield stream.read_written()
@@ -0,0 +1,194 @@
+import collections
+import itertools
+
+from django.contrib.auth.models import User
+from django.db.models import Q, Exists, OuterRef
+
+from .models import Post, FeedEntry
+from .pagination import before_cursor
+
+BATCH_SIZE = 500
+
+def post_audience(post):
+  """
+  Returns the ids of the users that are allowed to view the given post.
+  """
+  if post.viewed_by == 'all':
+    users = User.objects.all()
+  else:
+    users = User.objects.filter(groups__views=post)
+  return set(users.values_list('id', flat=True))
+
+def viewable_post_ids(user):
+  """
+  Returns the ids of the posts that the given user is allowed to view.
+  """
+  public = Post.objects.filter(viewed_by__exact='all')
+  private = Post.objects.filter(
+    viewed_by__exact='some',
+    viewers__user=user
+  )
+  return set(public.values_list('id', flat=True)) \
+        | set(private.values_list('id', flat=True))
+
+def fan_out_post(post):
+  """
+  Writes the feed entries of a post so that they match its audience.
+  """
+  audience = post_audience(post)
+  entries = FeedEntry.objects.filter(post=post)
+  existing = set(entries.values_list('user_id', flat=True))
+
+  entries.filter(user_id__in=existing - audience).delete()
+  FeedEntry.objects.bulk_create([
+      FeedEntry(user_id=user_id, post=post, date_posted=post.date_posted)
+      for user_id in audience - existing
+    ],
+    batch_size=BATCH_SIZE
+  )
+
+def fan_out_new_posts(posts, viewers):
+  """
+  Writes the feed entries of posts that were just created, given the rows of
+  their viewer groups.
+
+  The users, and the members of each viewer group, are read once for all the
+  posts, rather than once per post as fan_out_post would.
+  """
+  user_ids = []
+  if any(post.viewed_by == 'all' for post in posts):
+    user_ids = list(User.objects.values_list('id', flat=True))
+  post_groups = collections.defaultdict(set)
+  for viewer in viewers:
+    post_groups[viewer.post_id].add(viewer.group_id)
+  memberships = User.groups.through.objects.filter(
+    group_id__in=set(viewer.group_id for viewer in viewers)
+  )
+  members = collections.defaultdict(set)
+  for user_id, group_id in memberships.values_list('user_id', 'group_id'):
+    members[group_id].add(user_id)
+
+  def audience(post):
+    if post.viewed_by == 'all':
+      return user_ids
+    return set().union(*(members[g] for g in post_groups[post.id]))
+
+  entries = (
+    FeedEntry(user_id=user_id, post=post, date_posted=post.date_posted)
+    for post in posts
+    for user_id in audience(post)
+  )
+  while True:
+    batch = list(itertools.islice(entries, BATCH_SIZE))
+    if not batch:
+      break
+    FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+def sync_user_feed(user):
+  """
+  Writes the feed entries of a user so that they match the posts the user is
+  allowed to view.
+  """
+  viewable = viewable_post_ids(user)
+  entries = FeedEntry.objects.filter(user=user)
+  existing = set(entries.values_list('post_id', flat=True))
+
+  entries.filter(post_id__in=existing - viewable).delete()
+  posts = Post.objects.filter(id__in=viewable - existing)
+  FeedEntry.objects.bulk_create([
+      FeedEntry(user=user, post_id=post_id, date_posted=date_posted)
+      for post_id, date_posted in posts.values_list('id', 'date_posted')
+    ],
+    batch_size=BATCH_SIZE
+  )
+
+def add_group_posts(group, user_ids):
+  """
+  Writes the feed entries of the private posts viewed by a group for users
+  that just joined it.
+  """
+  posts = Post.objects.filter(viewed_by__exact='some', viewers=group)
+  posts = list(posts.values_list('id', 'date_posted'))
+  for start in range(0, len(posts), BATCH_SIZE):
+    FeedEntry.objects.bulk_create([
+        FeedEntry(user_id=user_id, post_id=post_id, date_posted=date_posted)
+        for user_id in user_ids
+        for post_id, date_posted in posts[start:start + BATCH_SIZE]
+      ],
+      batch_size=BATCH_SIZE,
+      ignore_conflicts=True
+    )
+
+def remove_group_posts(group, user_ids):
+  """
+  Deletes the feed entries of users that just left a group for the private
+  posts viewed by the group, unless another of their groups views them.
+  """
+  other_viewers = Post.viewers.through.objects.filter(
+    post_id=OuterRef('post_id'),
+    group__user=OuterRef('user_id')
+  )
+  entries = FeedEntry.objects.filter(
+    user_id__in=user_ids,
+    post__viewed_by__exact='some',
+    post__viewers=group
+  ).annotate(still_viewable=Exists(other_viewers))
+  stale = list(
+    entries.filter(still_viewable=False).values_list('id', flat=True)
+  )
+  for start in range(0, len(stale), BATCH_SIZE):
+    FeedEntry.objects.filter(id__in=stale[start:start + BATCH_SIZE]).delete()
+
+def rebuild_feed(users=None):
+  """
+  Rebuilds the feed of the given users, or of every user if none are given.
+  """
+  if users is None:
+    users = User.objects.all()
+  for user in users.iterator():
+    sync_user_feed(user)
+
+def check_user_feed(user):
+  """
+  Compares the feed of a user against the posts that the permission backend
+  allows the user to view.
+
+  Returns:
+  (missing, extra): the ids of viewable posts that are not in the feed, and
+  the ids of posts in the feed that are not viewable.
+  """
+  from .access import ObjectPermissionsBackend
+
+  posts = ObjectPermissionsBackend().get_viewable_posts(user)
+  viewable = set(post.id for post in posts)
+  feed = set(
+    FeedEntry.objects.filter(user=user).values_list('post_id', flat=True)
+  )
+  return viewable - feed, feed - viewable
+
+def get_feed(user=None, before=None):
+  """
+  Returns the posts that the given user is allowed to view, newest first.
+
+  Arguments:
+  user : the viewing user, or None for an anonymous visitor
+  before : a pagination cursor; only posts after it are returned
+  """
+  if user is None or not user.is_authenticated:
+    conditions = Q(viewed_by__exact='all')
+    if before:
+      conditions &= before_cursor(before, 'date_posted', 'id')
+    posts = Post.objects.filter(conditions)
+    return posts.order_by('-date_posted', '-id')
+
+  # The conditions are applied in a single filter so that they share one join
+  # on the feed table.
+  conditions = Q(feed_entries__user=user)
+  if before:
+    conditions &= before_cursor(
+      before,
+      'feed_entries__date_posted',
+      'feed_entries__post'
+    )
+  posts = Post.objects.filter(conditions)
+  return posts.order_by('-feed_entries__date_posted', '-feed_entries__post')
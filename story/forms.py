@@ -1,12 +1,20 @@
+import io
+
 from django import forms
 
 from django.contrib.auth.models import User, Group
-from .models import Post, UserProfile
+from .models import Post, UserProfile, Comment
+from . import membership
 
 class PostForm(forms.ModelForm):
   class Meta:
     model = Post
-    exclude = ['poster', 'date_posted', 'comments']
+    exclude = ['poster', 'date_posted']
+
+class CommentForm(forms.ModelForm):
+  class Meta:
+    model = Comment
+    fields = ['text']
 
 class ProfileForm(forms.ModelForm):
   class Meta:
@@ -19,4 +27,62 @@ class GroupCreationForm(forms.ModelForm):
     fields = '__all__'
 
 class AddUserToGroupForm(forms.Form):
-  joining_user = forms.ModelChoiceField(queryset=User.objects.all())
+  """
+  Adds a user, chosen by id, to a group they are not yet a member of.
+
+  The user is picked with the autocomplete endpoint, so the form never lists
+  the users.
+  """
+  joining_user = forms.ModelChoiceField(
+    queryset=User.objects.all(),
+    widget=forms.HiddenInput
+  )
+
+  def __init__(self, *args, group=None, **kwargs):
+    super(AddUserToGroupForm, self).__init__(*args, **kwargs)
+    if group is not None:
+      self.fields['joining_user'].queryset = User.objects.exclude(groups=group)
+
+class BulkMembershipForm(forms.Form):
+  """
+  Adds or removes many users at once, listed by username or by id, one per
+  line or in the first column of a CSV file. A header row of 'id' or
+  'username' in the file sets the column its users are read as.
+  """
+  action = forms.ChoiceField(choices=[('add', 'Add'), ('remove', 'Remove')])
+  column = forms.ChoiceField(
+    choices=[('username', 'Usernames'), ('id', 'Ids')],
+    initial='username',
+    required=False
+  )
+  users = forms.CharField(widget=forms.Textarea, required=False)
+  file = forms.FileField(required=False)
+
+  def clean(self):
+    cleaned_data = super(BulkMembershipForm, self).clean()
+    column = cleaned_data.get('column') or 'username'
+    sources = [(cleaned_data.get('users') or '').splitlines()]
+    if cleaned_data.get('file'):
+      try:
+        sources.append(
+          io.TextIOWrapper(cleaned_data['file'], 'utf-8').readlines()
+        )
+      except UnicodeDecodeError:
+        raise forms.ValidationError('The file is not UTF-8 text.')
+    ids, usernames = set(), set()
+    for lines in sources:
+      try:
+        listed = membership.parse_users(lines, column)
+      except ValueError as e:
+        raise forms.ValidationError(str(e))
+      ids |= listed[0]
+      usernames |= listed[1]
+    user_ids, unknown = membership.resolve_users(ids, usernames)
+    if unknown:
+      raise forms.ValidationError(
+        'Unknown users: %s' % ', '.join(sorted(map(str, unknown))[:20])
+      )
+    if not user_ids:
+      raise forms.ValidationError('No users were given.')
+    cleaned_data['user_ids'] = user_ids
+    return cleaned_data
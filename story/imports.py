@@ -0,0 +1,318 @@
+import hashlib
+import json
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserProfile, Post, GroupProfile
+from .visibility import get_visibility_index
+from . import bus, caching, feed
+
+BATCH_SIZE = 1000
+
+MODELS = ('group', 'user', 'profile', 'post')
+
+class InvalidRecord(ValueError):
+  def __init__(self, line, message):
+    super(InvalidRecord, self).__init__('Line %d: %s' % (line, message))
+    self.line = line
+
+def read_records(lines):
+  """
+  Yields (line number, record) for each non-blank line of an NDJSON stream.
+  """
+  for number, line in enumerate(lines, 1):
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+    except ValueError as e:
+      raise InvalidRecord(number, 'invalid JSON (%s)' % e)
+    if not isinstance(record, dict) or record.get('model') not in MODELS:
+      raise InvalidRecord(
+        number,
+        "'model' must be one of %s" % ', '.join(MODELS)
+      )
+    yield number, record
+
+def chunks(records, size=BATCH_SIZE):
+  chunk = []
+  for record in records:
+    chunk.append(record)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+def get_field(number, record, name, default=None, required=False):
+  value = record.get(name, default)
+  if required and value in (None, ''):
+    raise InvalidRecord(number, "'%s' is required" % name)
+  return value
+
+def get_date(number, record, name, required=False):
+  value = get_field(number, record, name, required=required)
+  if value is None:
+    return None
+  date = parse_datetime(value) if isinstance(value, str) else None
+  if date is None:
+    raise InvalidRecord(number, "'%s' is not a date: %r" % (name, value))
+  if timezone.is_naive(date):
+    date = timezone.make_aware(date)
+  return date
+
+def get_password(number, record):
+  """
+  Returns the password of a user record, which must already be hashed, or an
+  unusable password if it has none.
+  """
+  password = record.get('password')
+  if not password:
+    return make_password(None)
+  try:
+    identify_hasher(password)
+  except ValueError:
+    raise InvalidRecord(number, "'password' must be a password hash")
+  return password
+
+class Lookup:
+  """
+  Maps the names used in records to the ids of existing rows.
+  """
+  def __init__(self, queryset, field):
+    self.queryset = queryset
+    self.field = field
+    self.ids = {}
+
+  def load(self, names):
+    names = set(names) - set(self.ids)
+    if names:
+      rows = self.queryset.filter(**{self.field + '__in': names})
+      self.ids.update(rows.values_list(self.field, 'id'))
+
+  def get(self, number, name):
+    if name not in self.ids:
+      raise InvalidRecord(number, 'unknown %s %r' % (self.field, name))
+    return self.ids[name]
+
+def get_source_id(number, record):
+  """
+  Returns the id of a post record in the records it came from, as exported
+  by export_records, or else a digest of the record, so that importing the
+  same post again skips it.
+  """
+  source_id = record.get('id')
+  if source_id in (None, ''):
+    content = json.dumps(record, sort_keys=True).encode()
+    return 'sha256:' + hashlib.sha256(content).hexdigest()
+  source_id = str(source_id)
+  if len(source_id) > Post._meta.get_field('source_id').max_length:
+    raise InvalidRecord(number, "'id' is too long")
+  return source_id
+
+def create_posts(posts):
+  """
+  Inserts posts and sets their ids, which bulk_create only returns on some
+  databases, by reading them back by source id.
+  """
+  Post.objects.bulk_create(posts, batch_size=BATCH_SIZE)
+  if any(post.id is None for post in posts):
+    rows = Post.objects.filter(source_id__in=[post.source_id for post in posts])
+    ids = dict(rows.values_list('source_id', 'id'))
+    for post in posts:
+      post.id = ids[post.source_id]
+  return posts
+
+def import_chunk(chunk):
+  """
+  Imports a chunk of (line number, record) pairs in one transaction.
+
+  Records are imported by model, so that they can refer to groups and users
+  created earlier in the same chunk. Groups and users that already exist are
+  left unchanged, as are users that already have a profile, and posts with a
+  source id that was already imported.
+
+  Returns:
+  {model: number of rows created}
+  """
+  by_model = {model: [] for model in MODELS}
+  for number, record in chunk:
+    by_model[record['model']].append((number, record))
+  created = dict.fromkeys(MODELS, 0)
+  groups = Lookup(Group.objects.all(), 'name')
+  users = Lookup(User.objects.all(), 'username')
+
+  # Groups.
+  names = dict(
+    (get_field(n, r, 'name', required=True), n) for n, r in by_model['group']
+  )
+  groups.load(names)
+  Group.objects.bulk_create([
+    Group(name=name) for name in names if name not in groups.ids
+  ])
+  created['group'] = len(set(names) - set(groups.ids))
+
+  # Users, and their memberships.
+  new_users = {}
+  for number, record in by_model['user']:
+    username = get_field(number, record, 'username', required=True)
+    new_users[username] = (number, record, User(
+      username = username,
+      password = get_password(number, record),
+      email = get_field(number, record, 'email', ''),
+      first_name = get_field(number, record, 'first_name', ''),
+      last_name = get_field(number, record, 'last_name', ''),
+      date_joined = get_date(number, record, 'date_joined') or timezone.now(),
+    ))
+  users.load(new_users)
+  for username in users.ids:
+    new_users.pop(username, None)
+  User.objects.bulk_create([user for n, r, user in new_users.values()])
+  created['user'] = len(new_users)
+
+  groups.load(
+    name for n, r, u in new_users.values() for name in r.get('groups', [])
+  )
+  users.load(new_users)
+  memberships = [
+    User.groups.through(
+      user_id=users.get(number, username),
+      group_id=groups.get(number, name)
+    )
+    for username, (number, record, user) in new_users.items()
+    for name in record.get('groups', [])
+  ]
+  User.groups.through.objects.bulk_create(
+    memberships,
+    batch_size=BATCH_SIZE,
+    ignore_conflicts=True
+  )
+  groups.load(names)
+  GroupProfile.objects.refresh_member_counts(
+    [groups.ids[name] for name in names]
+    + [membership.group_id for membership in memberships]
+  )
+
+  # Profiles.
+  users.load(get_field(n, r, 'username') for n, r in by_model['profile'])
+  profiles = {}
+  for number, record in by_model['profile']:
+    username = get_field(number, record, 'username', required=True)
+    profiles[users.get(number, username)] = UserProfile(
+      user_id = users.get(number, username),
+      name = get_field(number, record, 'name', required=True),
+      dob = get_date(number, record, 'dob', required=True),
+      gender = get_field(number, record, 'gender', ''),
+      date_joined = get_date(number, record, 'date_joined') or timezone.now(),
+    )
+  existing = UserProfile.objects.filter(user_id__in=profiles)
+  for user_id in existing.values_list('user_id', flat=True):
+    del profiles[user_id]
+  UserProfile.objects.bulk_create(profiles.values(), batch_size=BATCH_SIZE)
+  created['profile'] = len(profiles)
+
+  # Posts, and their viewers.
+  groups.load(
+    name for n, r in by_model['post']
+    for name in [r.get('knower')] + list(r.get('viewers', []))
+  )
+  users.load(r['poster'] for n, r in by_model['post'] if r.get('poster'))
+  sources = [
+    (get_source_id(number, record), number, record)
+    for number, record in by_model['post']
+  ]
+  # Posts imported before, or earlier in the chunk, are skipped.
+  existing = set(Post.objects.filter(
+    source_id__in=[source_id for source_id, n, r in sources]
+  ).values_list('source_id', flat=True))
+  posts, post_records = [], []
+  for source_id, number, record in sources:
+    if source_id in existing:
+      continue
+    existing.add(source_id)
+    viewed_by = get_field(number, record, 'viewed_by', 'all')
+    if viewed_by not in ('all', 'some'):
+      raise InvalidRecord(number, "'viewed_by' must be 'all' or 'some'")
+    poster = get_field(number, record, 'poster')
+    posts.append(Post(
+      description = get_field(number, record, 'description', ''),
+      date_posted = get_date(number, record, 'date_posted', required=True),
+      poster_id = users.get(number, poster) if poster else None,
+      knower_id = groups.get(
+        number,
+        get_field(number, record, 'knower', required=True)
+      ),
+      viewed_by = viewed_by,
+      source_id = source_id,
+    ))
+    post_records.append((number, record))
+  create_posts(posts)
+  viewers = [
+    Post.viewers.through(post_id=post.id, group_id=groups.get(number, name))
+    for post, (number, record) in zip(posts, post_records)
+    for name in record.get('viewers', [])
+  ]
+  Post.viewers.through.objects.bulk_create(
+    viewers,
+    batch_size=BATCH_SIZE,
+    ignore_conflicts=True
+  )
+  created['post'] = len(posts)
+
+  # bulk_create sends no signals, so the feeds are written here: new posts are
+  # fanned out to every user, then new users get the rest of their feed.
+  feed.fan_out_new_posts(posts, viewers)
+  for user in User.objects.filter(username__in=new_users).iterator():
+    feed.sync_user_feed(user)
+
+  transaction.on_commit(lambda: posts_imported(posts, viewers))
+  return created
+
+def posts_imported(posts, viewers):
+  """
+  Updates the fragment cache and the visibility index for imported posts.
+  """
+  group_ids = set(viewer.group_id for viewer in viewers)
+  group_ids.update(post.knower_id for post in posts)
+  caching.posts_changed(
+    group_ids=group_ids,
+    public=any(post.viewed_by == 'all' for post in posts)
+  )
+
+  index = get_visibility_index()
+  if index is not None:
+    for post in posts:
+      index.set_public(post.id, post.viewed_by == 'all')
+    for viewer in viewers:
+      index.add_viewers([viewer.post_id], [viewer.group_id])
+    # The indexes of other processes are loaded again rather than sent every
+    # post.
+    bus.send('visibility', method='reset', args=[])
+
+def import_records(lines, batch_size=BATCH_SIZE, progress=None):
+  """
+  Imports users, groups, profiles and posts from an NDJSON stream, one
+  transaction per chunk of batch_size records.
+
+  Chunks imported before an invalid record stay imported.
+
+  Arguments:
+  lines : an iterable of NDJSON lines
+  progress : called with the counts of each chunk after it is committed
+
+  Returns:
+  {model: number of rows created}
+  """
+  totals = dict.fromkeys(MODELS, 0)
+  for chunk in chunks(read_records(lines), batch_size):
+    with transaction.atomic():
+      created = import_chunk(chunk)
+    for model in MODELS:
+      totals[model] += created[model]
+    if progress is not None:
+      progress(created)
+  return totals
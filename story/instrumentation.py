@@ -0,0 +1,137 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as backend
+
+class Timings:
+  """
+  What a request cost: its queries, and the time spent in the database,
+  rendering templates and in total, in seconds.
+  """
+  def __init__(self):
+    self.queries = 0
+    self.db_time = 0.0
+    self.template_time = 0.0
+    self.wall_time = 0.0
+    self.template_depth = 0
+
+  def execute(self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.db_time += time.perf_counter() - start
+      self.queries += 1
+
+  def server_timing(self):
+    return 'db;dur=%.1f, tpl;dur=%.1f, total;dur=%.1f' % (
+      self.db_time * 1000,
+      self.template_time * 1000,
+      self.wall_time * 1000
+    )
+
+local = threading.local()
+
+# Called with (view name, Timings) after each request, by the test helpers.
+listeners = []
+
+lock = threading.Lock()
+totals = {}
+
+def record(view_name, timings):
+  """
+  Adds the timings of a request to the totals of its view.
+  """
+  with lock:
+    total = totals.setdefault(view_name, {
+      'requests': 0,
+      'queries': 0,
+      'db_time': 0.0,
+      'template_time': 0.0,
+      'wall_time': 0.0,
+    })
+    total['requests'] += 1
+    total['queries'] += timings.queries
+    total['db_time'] += timings.db_time
+    total['template_time'] += timings.template_time
+    total['wall_time'] += timings.wall_time
+  for listener in listeners:
+    listener(view_name, timings)
+
+def get_totals():
+  """
+  Returns the counters of each view name since the process started.
+  """
+  with lock:
+    return dict((name, dict(total)) for name, total in totals.items())
+
+def reset_totals():
+  with lock:
+    totals.clear()
+
+class TimedTemplate(backend.Template):
+  def render(self, context=None, request=None):
+    timings = getattr(local, 'timings', None)
+    if timings is None:
+      return super().render(context, request)
+    # A template rendered while another is, by a tag or a context processor,
+    # is part of the outer render, so only the outermost render is timed.
+    timings.template_depth += 1
+    start = time.perf_counter()
+    try:
+      return super().render(context, request)
+    finally:
+      timings.template_depth -= 1
+      if not timings.template_depth:
+        timings.template_time += time.perf_counter() - start
+
+class TimedTemplates(backend.DjangoTemplates):
+  """
+  The Django template backend, with the time its templates take to render
+  added to the timings of the request being served, if any.
+
+  Set as the BACKEND of TEMPLATES for InstrumentationMiddleware to record
+  template time. Templates of other engines, and those rendered outside a
+  request, are left alone.
+  """
+  def from_string(self, template_code):
+    return TimedTemplate(super().from_string(template_code).template, self)
+
+  def get_template(self, template_name):
+    return TimedTemplate(super().get_template(template_name).template, self)
+
+class InstrumentationMiddleware:
+  """
+  Records the queries, database time, template time and wall time of each
+  request by the name of the view it resolved to, such as 'story:index'.
+
+  Template time is recorded for templates of the TimedTemplates backend.
+  With DEBUG on, the timings of a request are sent in its Server-Timing and
+  X-Query-Count headers. They are always added to the per-view counters of
+  get_totals, which staff can read from views.instrumentation_api.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    timings = Timings()
+    local.timings = timings
+    start = time.perf_counter()
+    try:
+      with ExitStack() as stack:
+        for connection in connections.all():
+          stack.enter_context(connection.execute_wrapper(timings.execute))
+        response = self.get_response(request)
+    finally:
+      local.timings = None
+    timings.wall_time = time.perf_counter() - start
+
+    match = getattr(request, 'resolver_match', None)
+    record(match.view_name if match else None, timings)
+    if settings.DEBUG:
+      response['Server-Timing'] = timings.server_timing()
+      response['X-Query-Count'] = str(timings.queries)
+    return response
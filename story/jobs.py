@@ -0,0 +1,292 @@
+import datetime
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, \
+                               FIRST_COMPLETED
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from . import bus
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 3600
+
+tasks = {}
+
+def task(name):
+  """
+  Registers a function as the task run for jobs of the given name.
+  """
+  def register(function):
+    tasks[name] = function
+    return function
+  return register
+
+def is_enabled():
+  """
+  Whether work is queued as jobs, rather than done during the request, as
+  set by STORY_BACKGROUND_JOBS.
+  """
+  return getattr(settings, 'STORY_BACKGROUND_JOBS', False)
+
+def enqueue(name, *args, priority=0, delay=0, max_attempts=5):
+  """
+  Queues a job to run the named task with the given JSON serializable
+  arguments, after delay seconds. Jobs of higher priority run first.
+
+  The job is written in the current transaction, so it only runs if the
+  transaction commits.
+  """
+  if name not in tasks:
+    raise KeyError('Unknown task: %s' % name)
+  return Job.objects.create(
+    name = name,
+    args = json.dumps(args),
+    priority = priority,
+    run_at = timezone.now() + datetime.timedelta(seconds=delay),
+    max_attempts = max_attempts,
+  )
+
+def claim(worker_id, limit):
+  """
+  Claims up to limit due jobs for a worker, highest priority first.
+
+  Each job is claimed with an UPDATE conditional on it still being queued,
+  so that two workers never run the same job, without locking the table.
+  """
+  now = timezone.now()
+  due = Job.objects.filter(status='queued', run_at__lte=now)
+  candidates = due.order_by('-priority', 'run_at', 'id') \
+                  .values_list('id', flat=True)[:limit * 2]
+  claimed = []
+  for job_id in candidates:
+    if len(claimed) == limit:
+      break
+    updated = Job.objects.filter(id=job_id, status='queued').update(
+      status = 'running',
+      claimed_by = worker_id,
+      claimed_at = now,
+      heartbeat_at = now,
+    )
+    if updated:
+      claimed.append(job_id)
+  return claimed
+
+def heartbeat(worker_id):
+  """
+  Records that a worker is still running the jobs it claimed.
+  """
+  return Job.objects.filter(status='running', claimed_by=worker_id).update(
+    heartbeat_at = timezone.now(),
+  )
+
+def requeue_stale(timeout):
+  """
+  Queues again the running jobs whose worker has not recorded a heartbeat for
+  longer than timeout seconds, and is presumed dead. Jobs that take longer
+  than timeout keep running while their worker is alive.
+
+  The lost run counts as an attempt, so that a job that kills its worker
+  fails once it has no attempts left rather than being queued forever.
+
+  Returns the number of jobs queued again or failed.
+  """
+  now = timezone.now()
+  cutoff = now - datetime.timedelta(seconds=timeout)
+  stale = Job.objects.filter(status='running', heartbeat_at__lt=cutoff)
+  failed = stale.filter(attempts__gte=F('max_attempts') - 1).update(
+    status = 'failed',
+    claimed_by = '',
+    attempts = F('attempts') + 1,
+    last_error = 'The worker running the job was lost.',
+    finished_at = now,
+  )
+  return failed + stale.update(
+    status = 'queued',
+    claimed_by = '',
+    attempts = F('attempts') + 1,
+  )
+
+def backoff(attempts):
+  """
+  Returns the seconds to wait before retrying a job that failed attempts
+  times.
+  """
+  return min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+def run_job(job_id):
+  """
+  Runs a claimed job and records its outcome, retrying it later if it fails
+  and has attempts left.
+
+  Returns:
+  (succeeded, wait, duration): whether the task succeeded, the seconds the
+  job waited after it was due, and the seconds the task took
+  """
+  try:
+    # Tasks read the caches of this process, which may be a process of the
+    # pool.
+    bus.check()
+    job = Job.objects.get(id=job_id)
+    started = timezone.now()
+    wait_time = max((started - job.run_at).total_seconds(), 0)
+    attempts = job.attempts + 1
+    start = time.perf_counter()
+    try:
+      tasks[job.name](*json.loads(job.args))
+    except Exception:
+      duration = time.perf_counter() - start
+      error = traceback.format_exc()
+      logger.warning('Job %d (%s) failed:\n%s', job.id, job.name, error)
+      retry = attempts < job.max_attempts
+      Job.objects.filter(id=job.id).update(
+        status = 'queued' if retry else 'failed',
+        attempts = attempts,
+        run_at = timezone.now()
+                 + datetime.timedelta(seconds=backoff(attempts)),
+        last_error = error,
+        finished_at = None if retry else timezone.now(),
+      )
+      return False, wait_time, duration
+
+    duration = time.perf_counter() - start
+    Job.objects.filter(id=job.id).update(
+      status = 'done',
+      attempts = attempts,
+      finished_at = timezone.now(),
+    )
+    return True, wait_time, duration
+  finally:
+    # Each job runs on whichever thread or process of the pool is free, so it
+    # does not keep a connection open.
+    connection.close()
+
+def percentile(samples, p):
+  """
+  Returns the p-th percentile of the samples by the nearest-rank method, or 0
+  if there are none.
+  """
+  ordered = sorted(samples)
+  if not ordered:
+    return 0
+  rank = max(int(math.ceil(p / 100.0 * len(ordered))), 1)
+  return ordered[rank - 1]
+
+class Metrics:
+  """
+  Counts the jobs a worker ran, and how long they waited and took.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.start = time.perf_counter()
+    self.succeeded = 0
+    self.failed = 0
+    self.waits = []
+    self.durations = []
+
+  def record(self, succeeded, wait_time, duration):
+    with self.lock:
+      if succeeded:
+        self.succeeded += 1
+      else:
+        self.failed += 1
+      self.waits.append(wait_time)
+      self.durations.append(duration)
+
+  def summary(self):
+    with self.lock:
+      elapsed = time.perf_counter() - self.start
+      processed = self.succeeded + self.failed
+      return {
+        'processed': processed,
+        'succeeded': self.succeeded,
+        'failed': self.failed,
+        'jobs_per_second': processed / elapsed if elapsed else 0,
+        'wait_p50_ms': percentile(self.waits, 50) * 1000,
+        'wait_p95_ms': percentile(self.waits, 95) * 1000,
+        'run_p50_ms': percentile(self.durations, 50) * 1000,
+        'run_p95_ms': percentile(self.durations, 95) * 1000,
+      }
+
+class Worker:
+  """
+  Claims due jobs and runs them on a pool of threads, or of processes.
+  """
+  def __init__(self, concurrency=4, processes=False, poll_interval=1.0,
+               stale_timeout=None):
+    self.concurrency = concurrency
+    self.processes = processes
+    self.poll_interval = poll_interval
+    self.stale_timeout = stale_timeout or getattr(
+      settings, 'STORY_JOB_TIMEOUT', 600
+    )
+    self.worker_id = '%s:%d:%d' % (
+      socket.gethostname(),
+      os.getpid(),
+      id(self)
+    )
+    self.metrics = Metrics()
+    self.stopping = threading.Event()
+
+  def stop(self):
+    self.stopping.set()
+
+  def run(self, burst=False):
+    """
+    Runs jobs until stopped, or with burst until no job is due.
+    """
+    if self.processes:
+      # Forked processes must not share the connections of this one.
+      connections.close_all()
+      pool = ProcessPoolExecutor(self.concurrency)
+    else:
+      pool = ThreadPoolExecutor(self.concurrency)
+
+    running = set()
+    last_heartbeat = time.monotonic()
+    try:
+      while not self.stopping.is_set():
+        bus.check()
+        if time.monotonic() - last_heartbeat > self.stale_timeout / 4:
+          heartbeat(self.worker_id)
+          last_heartbeat = time.monotonic()
+        requeue_stale(self.stale_timeout)
+        free = self.concurrency - len(running)
+        job_ids = claim(self.worker_id, free) if free else []
+        for job_id in job_ids:
+          running.add(pool.submit(run_job, job_id))
+        if not running:
+          if burst:
+            break
+          self.stopping.wait(self.poll_interval)
+          continue
+        done, running = wait(
+          running,
+          timeout=self.poll_interval,
+          return_when=FIRST_COMPLETED
+        )
+        for future in done:
+          self.record(future)
+    finally:
+      for future in wait(running)[0]:
+        self.record(future)
+      pool.shutdown()
+      connection.close()
+
+  def record(self, future):
+    try:
+      self.metrics.record(*future.result())
+    except Exception:
+      logger.exception('A job could not be run')
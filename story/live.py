@@ -0,0 +1,355 @@
+import asyncio
+import collections
+import json
+import threading
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, HASH_SESSION_KEY, get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections, transaction
+from django.utils.crypto import constant_time_compare
+
+from .access import ObjectPermissionsBackend
+from . import bus
+
+PATH = '/api/live'
+
+def is_enabled():
+  """
+  Whether pages open the live feed, as set by STORY_LIVE_FEED.
+
+  Over WSGI each open page holds a worker thread, so it is meant for sites
+  served by yarns.asgi, where LiveApplication holds connections without one.
+  """
+  return getattr(settings, 'STORY_LIVE_FEED', False)
+
+def get_heartbeat():
+  return getattr(settings, 'STORY_LIVE_HEARTBEAT', 15)
+
+def get_queue_size():
+  return getattr(settings, 'STORY_LIVE_QUEUE_SIZE', 100)
+
+def get_max_connections():
+  return getattr(settings, 'STORY_LIVE_MAX_CONNECTIONS', 1000)
+
+def get_max_seconds():
+  return getattr(settings, 'STORY_LIVE_MAX_SECONDS', 300)
+
+def format_event(event, data=None, event_id=None):
+  lines = []
+  if event_id is not None:
+    lines.append('id: %s' % event_id)
+  lines.append('event: %s' % event)
+  lines.append('data: %s' % json.dumps(data))
+  return ('\n'.join(lines) + '\n\n').encode()
+
+HEARTBEAT = b': heartbeat\n\n'
+RETRY = b'retry: 5000\n\n'
+
+class Subscription:
+  """
+  The events waiting to be sent to one connected client.
+
+  At most STORY_LIVE_QUEUE_SIZE events are kept. A client that falls further
+  behind is sent a single 'reload' event instead of the events it missed.
+
+  A subscription is closed when the groups of its user change, after which
+  its stream ends and the client reconnects with its new groups.
+  """
+  def __init__(self, group_ids, loop=None, user_id=None):
+    self.group_ids = frozenset(group_ids)
+    self.user_id = user_id
+    self.lock = threading.Lock()
+    self.events = collections.deque()
+    self.overflowed = False
+    self.closed = False
+    self.loop = loop
+    self.ready = asyncio.Event() if loop else threading.Event()
+
+  def push(self, event):
+    with self.lock:
+      if self.overflowed:
+        pass
+      elif len(self.events) >= get_queue_size():
+        self.events.clear()
+        self.overflowed = True
+      else:
+        self.events.append(event)
+    self.wake()
+
+  def close(self):
+    self.closed = True
+    self.wake()
+
+  def wake(self):
+    if self.loop:
+      self.loop.call_soon_threadsafe(self.ready.set)
+    else:
+      self.ready.set()
+
+  def pop_all(self):
+    """
+    Returns the events waiting to be sent, as bytes.
+    """
+    with self.lock:
+      self.ready.clear()
+      if self.overflowed:
+        self.overflowed = False
+        return format_event('reload')
+      events = b''.join(self.events)
+      self.events.clear()
+    return events
+
+def discard(index, key, subscription):
+  subscribers = index.get(key)
+  if subscribers is not None:
+    subscribers.discard(subscription)
+    if not subscribers:
+      del index[key]
+
+class Hub:
+  """
+  Sends the ids of new posts to the subscriptions of the clients that can
+  view them.
+
+  Subscriptions are indexed by group, so that publishing a private post only
+  visits the clients in its viewer groups, however many are connected.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.subscriptions = set()
+    self.by_group = collections.defaultdict(set)
+    self.by_user = collections.defaultdict(set)
+
+  def subscribe(self, group_ids, loop=None, user_id=None):
+    """
+    Returns a new subscription of a user to the posts the given groups can
+    view, or None if STORY_LIVE_MAX_CONNECTIONS clients are already
+    connected.
+    """
+    subscription = Subscription(group_ids, loop, user_id)
+    with self.lock:
+      if len(self.subscriptions) >= get_max_connections():
+        return None
+      self.subscriptions.add(subscription)
+      for group_id in subscription.group_ids:
+        self.by_group[group_id].add(subscription)
+      if user_id is not None:
+        self.by_user[user_id].add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self.lock:
+      self.subscriptions.discard(subscription)
+      for group_id in subscription.group_ids:
+        discard(self.by_group, group_id, subscription)
+      discard(self.by_user, subscription.user_id, subscription)
+
+  def close_users(self, user_ids):
+    """
+    Closes the subscriptions of the given users, whose groups changed.
+    """
+    with self.lock:
+      closed = set()
+      for user_id in user_ids:
+        closed.update(self.by_user.get(user_id, ()))
+    for subscription in closed:
+      self.unsubscribe(subscription)
+      subscription.close()
+
+  def publish(self, post_id, public, group_ids=()):
+    """
+    Sends a post to the clients that can view it: all clients if it is
+    public, or else the members of its viewer groups.
+    """
+    event = format_event('post', {'id': post_id}, post_id)
+    with self.lock:
+      if public:
+        subscribers = list(self.subscriptions)
+      else:
+        subscribers = set()
+        for group_id in group_ids:
+          subscribers.update(self.by_group.get(group_id, ()))
+    for subscription in subscribers:
+      subscription.push(event)
+
+  def __len__(self):
+    return len(self.subscriptions)
+
+hub = Hub()
+
+def post_published(post, group_ids):
+  hub.publish(post.id, post.viewed_by == 'all', group_ids)
+
+def memberships_changed(user_ids):
+  """
+  Closes the live feeds of users whose groups changed once the change
+  commits, in this process and through the invalidation bus in the others.
+  """
+  user_ids = list(user_ids)
+  transaction.on_commit(lambda: hub.close_users(user_ids))
+  bus.send('live', user_ids=user_ids)
+
+bus.register('live', hub.close_users)
+
+def get_group_ids(user):
+  if not user.is_authenticated:
+    return set()
+  return ObjectPermissionsBackend().get_group_ids(user)
+
+def stream(subscription, max_seconds=None):
+  """
+  Yields the events of a subscription as they arrive, with a comment every
+  STORY_LIVE_HEARTBEAT seconds, for max_seconds or until the subscription
+  is closed, after which the client reconnects.
+
+  Blocks the thread serving the request, so it is the fallback for WSGI.
+  """
+  deadline = time.monotonic() + (max_seconds or get_max_seconds())
+  try:
+    yield RETRY
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      if subscription.ready.wait(min(get_heartbeat(), remaining)):
+        yield subscription.pop_all()
+        if subscription.closed:
+          break
+      else:
+        yield HEARTBEAT
+  finally:
+    hub.unsubscribe(subscription)
+
+def get_scope_user(scope):
+  """
+  Returns the user logged in with the session cookie of an ASGI request, as
+  AuthenticationMiddleware would.
+  """
+  cookie = SimpleCookie()
+  for name, value in scope.get('headers', []):
+    if name == b'cookie':
+      cookie.load(value.decode('latin-1'))
+  morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+  if morsel is None:
+    return AnonymousUser()
+
+  engine = import_module(settings.SESSION_ENGINE)
+  session = engine.SessionStore(morsel.value)
+  try:
+    user = get_user_model().objects.get(pk=session[SESSION_KEY])
+  except (KeyError, get_user_model().DoesNotExist):
+    return AnonymousUser()
+  session_hash = session.get(HASH_SESSION_KEY)
+  if not session_hash or not constant_time_compare(
+    session_hash,
+    user.get_session_auth_hash()
+  ):
+    return AnonymousUser()
+  return user
+
+def get_scope_subscriber(scope):
+  """
+  Returns the id of the user of an ASGI request, or None, and the ids of
+  their groups.
+  """
+  close_old_connections()
+  try:
+    user = get_scope_user(scope)
+    return user.id, get_group_ids(user)
+  finally:
+    close_old_connections()
+
+class LiveApplication:
+  """
+  An ASGI application that serves the live feed at PATH, holding each
+  connection as a coroutine rather than a thread, and passes other requests
+  to the given ASGI application.
+  """
+  def __init__(self, application=None):
+    self.application = application
+
+  async def __call__(self, scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == PATH:
+      await self.live(scope, receive, send)
+    elif self.application is not None:
+      await self.application(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+      while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+          await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+          await send({'type': 'lifespan.shutdown.complete'})
+          return
+    elif scope['type'] == 'http':
+      await self.respond(send, 404, b'Not found.')
+
+  async def respond(self, send, status, body):
+    await send({
+      'type': 'http.response.start',
+      'status': status,
+      'headers': [(b'content-type', b'text/plain')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+  async def live(self, scope, receive, send):
+    loop = asyncio.get_running_loop()
+    user_id, group_ids = await loop.run_in_executor(
+      None,
+      get_scope_subscriber,
+      scope
+    )
+    subscription = hub.subscribe(group_ids, loop, user_id)
+    if subscription is None:
+      await self.respond(send, 503, b'Too many connections.')
+      return
+
+    async def disconnected():
+      while (await receive())['type'] != 'http.disconnect':
+        pass
+    disconnect = asyncio.ensure_future(disconnected())
+
+    try:
+      await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+          (b'content-type', b'text/event-stream'),
+          (b'cache-control', b'no-cache'),
+          (b'x-accel-buffering', b'no'),
+        ],
+      })
+      await send({'type': 'http.response.body', 'body': RETRY,
+                  'more_body': True})
+      deadline = loop.time() + get_max_seconds()
+      while not disconnect.done():
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+          break
+        ready = asyncio.ensure_future(subscription.ready.wait())
+        await asyncio.wait(
+          [ready, disconnect],
+          timeout=min(get_heartbeat(), remaining),
+          return_when=asyncio.FIRST_COMPLETED
+        )
+        if disconnect.done():
+          ready.cancel()
+          break
+        if ready.done():
+          body = subscription.pop_all()
+        else:
+          ready.cancel()
+          body = HEARTBEAT
+        await send({'type': 'http.response.body', 'body': body,
+                    'more_body': True})
+        if subscription.closed:
+          break
+      if not disconnect.done():
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+      disconnect.cancel()
+      hub.unsubscribe(subscription)
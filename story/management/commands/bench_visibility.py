@@ -0,0 +1,54 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from story.access import ObjectPermissionsBackend
+from story.benchmarks import visibility
+from story.models import Post
+
+class Command(BaseCommand):
+  help = 'Times the visibility index against get_viewable_posts.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--users', type=int, default=20,
+      help='Number of users to check.')
+    parser.add_argument('--posts', type=int, default=100,
+      help='Number of recent posts to check for each user.')
+    parser.add_argument('--repeat', type=int, default=5,
+      help='Number of times each check is repeated.')
+
+  def handle(self, *args, **options):
+    backend = ObjectPermissionsBackend()
+    users = list(User.objects.order_by('?')[:options['users']])
+    posts = list(Post.objects.order_by('-date_posted')[:options['posts']])
+
+    start = time.perf_counter()
+    index = visibility.load_index()
+    self.report('load index', time.perf_counter() - start, 1)
+
+    def union(user):
+      return visibility.by_union(backend, user, posts)
+
+    def bitmap(user):
+      return visibility.by_index(backend, index, user, posts)
+
+    checks = [('get_viewable_posts', union), ('visibility index', bitmap)]
+    for name, check in checks:
+      elapsed = 0
+      for user in users:
+        expected = union(user)
+        for i in range(options['repeat']):
+          # Group ids are fetched on every check, as they would be once per
+          # request.
+          user.__dict__.pop('_group_ids_cache', None)
+          start = time.perf_counter()
+          result = check(user)
+          elapsed += time.perf_counter() - start
+        if result != expected:
+          self.stderr.write('%s disagrees for %s' % (name, user.username))
+      self.report(name, elapsed, len(users) * options['repeat'])
+
+  def report(self, name, elapsed, calls):
+    self.stdout.write('%-20s %8.3f ms/call over %d calls'
+      % (name, elapsed * 1000 / max(calls, 1), calls))
@@ -0,0 +1,99 @@
+import json
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, \
+                             teardown_test_environment
+
+from story.benchmarks import data, scenarios
+
+class Command(BaseCommand):
+  help = (
+    'Times the permission backend and the main views on generated data, in '
+    'a throwaway test database, and saves the results as JSON.'
+  )
+
+  def add_arguments(self, parser):
+    for name, default in data.DEFAULTS.items():
+      parser.add_argument('--' + name.replace('_', '-'),
+        type=type(default), default=default,
+        help='Data generator setting (default %s).' % default)
+    parser.add_argument('--samples', type=int, default=100,
+      help='Number of times each scenario is timed.')
+    parser.add_argument('--scenario', action='append',
+      choices=sorted(scenarios.SCENARIOS),
+      help='Scenario to run; may be repeated. All are run by default.')
+    parser.add_argument('--cold-cache', action='store_true',
+      help='Clear the benchmark\'s own cache before each sample.')
+    parser.add_argument('--output',
+      help='File to save the results to as JSON.')
+    parser.add_argument('--compare',
+      help='Results of an earlier run to compare against.')
+
+  def handle(self, *args, **options):
+    config = dict((name, options[name]) for name in data.DEFAULTS)
+    baseline = None
+    if options['compare']:
+      try:
+        with open(options['compare']) as f:
+          baseline = json.load(f)
+      except (OSError, ValueError) as e:
+        raise CommandError('Cannot read %s: %s' % (options['compare'], e))
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(
+      verbosity=options['verbosity'] - 1,
+      autoclobber=True
+    )
+    try:
+      start = time.perf_counter()
+      data.generate(config)
+      self.stdout.write('Generated data in %.1fs.'
+        % (time.perf_counter() - start))
+      results = scenarios.run(
+        options['scenario'],
+        options['samples'],
+        config['seed'],
+        options['cold_cache']
+      )
+    finally:
+      connection.creation.destroy_test_db(old_name, options['verbosity'] - 1)
+      teardown_test_environment()
+
+    report = {
+      'commit': self.get_commit(),
+      'config': config,
+      'samples': options['samples'],
+      'cold_cache': options['cold_cache'],
+      'results': results,
+    }
+    for name, result in results.items():
+      line = '%-20s p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  %5.1f queries' % (
+        name,
+        result['p50_ms'],
+        result['p95_ms'],
+        result['p99_ms'],
+        result['queries_mean']
+      )
+      if baseline and name in baseline['results']:
+        before = baseline['results'][name]
+        line += '  (p50 x%.2f, %+.1f queries)' % (
+          result['p50_ms'] / before['p50_ms'] if before['p50_ms'] else 0,
+          result['queries_mean'] - before['queries_mean']
+        )
+      self.stdout.write(line)
+
+    if options['output']:
+      with open(options['output'], 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+  def get_commit(self):
+    try:
+      return subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'],
+        stderr=subprocess.DEVNULL
+      ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+      return None
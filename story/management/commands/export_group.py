@@ -0,0 +1,47 @@
+import sys
+
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand, CommandError
+
+from story import exports
+
+class Command(BaseCommand):
+  help = (
+    "Exports the posts known by a group, with their comments, as NDJSON or as "
+    "a ZIP archive that also holds the posts' files."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('group', help='Name of the group to export.')
+    parser.add_argument('--zip', action='store_true',
+      help='Write a ZIP archive with the files of the posts.')
+    parser.add_argument('--output', default='-',
+      help="File to write, or '-' for stdout.")
+    parser.add_argument('--user',
+      help='Only export the posts this user is allowed to view.')
+
+  def handle(self, *args, **options):
+    try:
+      group = Group.objects.get(name=options['group'])
+      user = None
+      if options['user']:
+        user = User.objects.get(username=options['user'])
+    except (Group.DoesNotExist, User.DoesNotExist) as e:
+      raise CommandError(e)
+
+    posts = exports.group_posts(group, user)
+    if options['zip']:
+      chunks = exports.export_zip(posts)
+    else:
+      chunks = (line.encode() for line in exports.export_ndjson(posts))
+
+    if options['output'] == '-':
+      output = sys.stdout.buffer
+    else:
+      output = open(options['output'], 'wb')
+    try:
+      for chunk in chunks:
+        output.write(chunk)
+    finally:
+      if output is not sys.stdout.buffer:
+        output.close()
@@ -0,0 +1,54 @@
+import sys
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+
+from story import membership
+
+class Command(BaseCommand):
+  help = (
+    'Adds or removes many users to or from a group. Users are listed in the '
+    'first column of a CSV file, by username unless --column or a header row '
+    'says id.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('group', help='Name of the group.')
+    parser.add_argument('action', choices=['add', 'remove'])
+    parser.add_argument('path', help="CSV file of users, or '-' for stdin.")
+    parser.add_argument(
+      '--column',
+      choices=membership.COLUMNS,
+      default='username',
+      help='Column of the user table the users are listed by.'
+    )
+
+  def handle(self, *args, **options):
+    try:
+      group = Group.objects.get(name=options['group'])
+    except Group.DoesNotExist as e:
+      raise CommandError(e)
+
+    try:
+      if options['path'] == '-':
+        listed = membership.parse_users(sys.stdin, options['column'])
+      else:
+        with open(options['path'], encoding='utf-8', newline='') as lines:
+          listed = membership.parse_users(lines, options['column'])
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+      raise CommandError(e)
+
+    user_ids, unknown = membership.resolve_users(*listed)
+    if unknown:
+      raise CommandError(
+        'Unknown users: %s' % ', '.join(sorted(map(str, unknown)))
+      )
+
+    if options['action'] == 'add':
+      changed = membership.add_members(group, user_ids)
+      self.stdout.write('Added %d users to %s.' % (len(changed), group.name))
+    else:
+      changed = membership.remove_members(group, user_ids)
+      self.stdout.write(
+        'Removed %d users from %s.' % (len(changed), group.name)
+      )
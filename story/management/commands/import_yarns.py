@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from story import imports
+
+class Command(BaseCommand):
+  help = (
+    'Imports users, groups, profiles and posts from NDJSON, one record per '
+    'line. Each record has a "model" of group, user, profile or post, and '
+    'refers to groups by name and users by username. User passwords must '
+    'already be hashed. Posts with the "id" of a post imported before are '
+    'skipped.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help="NDJSON file to import, or '-' for stdin.")
+    parser.add_argument('--batch-size', type=int, default=imports.BATCH_SIZE,
+      help='Number of records imported in each transaction.')
+
+  def handle(self, *args, **options):
+    start = time.perf_counter()
+    imported = [0]
+
+    def progress(created):
+      imported[0] += sum(created.values())
+      if options['verbosity'] > 1:
+        self.stdout.write(
+          'Imported %d rows (%.0f rows/sec).'
+          % (imported[0], imported[0] / (time.perf_counter() - start))
+        )
+
+    try:
+      if options['path'] == '-':
+        totals = imports.import_records(
+          sys.stdin,
+          options['batch_size'],
+          progress
+        )
+      else:
+        with open(options['path'], encoding='utf-8') as lines:
+          totals = imports.import_records(
+            lines,
+            options['batch_size'],
+            progress
+          )
+    except (OSError, imports.InvalidRecord) as e:
+      raise CommandError(
+        '%s (%d rows were imported before the error)' % (e, imported[0])
+      )
+
+    elapsed = time.perf_counter() - start
+    self.stdout.write(
+      'Imported %s in %.1fs (%.0f rows/sec).' % (
+        ', '.join('%d %ss' % (totals[m], m) for m in imports.MODELS),
+        elapsed,
+        sum(totals.values()) / elapsed if elapsed else 0
+      )
+    )
@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from story import feed
+
+class Command(BaseCommand):
+  help = 'Rebuilds the per-user post feeds, or checks them for consistency.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      'users',
+      nargs='*',
+      help='Usernames to rebuild. All users are rebuilt if none are given.'
+    )
+    parser.add_argument(
+      '--check',
+      action='store_true',
+      help='Report feeds that differ from the viewable posts instead.'
+    )
+
+  def handle(self, *args, **options):
+    users = User.objects.all()
+    if options['users']:
+      users = users.filter(username__in=options['users'])
+
+    if not options['check']:
+      feed.rebuild_feed(users)
+      self.stdout.write('Rebuilt the feed of %d users.' % users.count())
+      return
+
+    inconsistent = 0
+    for user in users.iterator():
+      missing, extra = feed.check_user_feed(user)
+      if missing or extra:
+        inconsistent += 1
+        self.stdout.write(
+          '%s: missing %s, extra %s'
+          % (user.username, sorted(missing), sorted(extra))
+        )
+    if inconsistent:
+      raise CommandError('%d feeds are inconsistent.' % inconsistent)
+    self.stdout.write('All feeds are consistent.')
@@ -0,0 +1,47 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from story import jobs
+
+class Command(BaseCommand):
+  help = (
+    'Runs queued background jobs on a pool of worker threads or processes. '
+    'Several of these commands can run at once against the same database. '
+    'Stops after the running jobs finish on SIGINT or SIGTERM.'
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument('--concurrency', type=int, default=4,
+      help='Number of jobs run at once.')
+    parser.add_argument('--processes', action='store_true',
+      help='Run jobs in worker processes rather than threads.')
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+      help='Seconds to wait for new jobs when none are due.')
+    parser.add_argument('--burst', action='store_true',
+      help='Exit once no job is due.')
+
+  def handle(self, *args, **options):
+    worker = jobs.Worker(
+      concurrency=options['concurrency'],
+      processes=options['processes'],
+      poll_interval=options['poll_interval']
+    )
+
+    def stop(signum, frame):
+      self.stdout.write('Stopping after the running jobs finish.')
+      worker.stop()
+
+    previous = [signal.signal(s, stop) for s in (signal.SIGINT, signal.SIGTERM)]
+    try:
+      worker.run(burst=options['burst'])
+    finally:
+      signal.signal(signal.SIGINT, previous[0])
+      signal.signal(signal.SIGTERM, previous[1])
+
+    summary = worker.metrics.summary()
+    self.stdout.write(
+      'Ran %(processed)d jobs, %(failed)d failed (%(jobs_per_second).1f '
+      'jobs/sec). Waited p50 %(wait_p50_ms).0fms, p95 %(wait_p95_ms).0fms; '
+      'ran p50 %(run_p50_ms).0fms, p95 %(run_p95_ms).0fms.' % summary
+    )
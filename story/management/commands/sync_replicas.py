@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from story.routers import get_replicas
+
+class Command(BaseCommand):
+  help = (
+    'Copies the default SQLite database to the replicas in STORY_REPLICAS, '
+    'to try out replica reads locally.'
+  )
+
+  def handle(self, *args, **options):
+    primary = connections[DEFAULT_DB_ALIAS]
+    if primary.vendor != 'sqlite':
+      raise CommandError('Replicas can only be copied for SQLite databases.')
+
+    source = sqlite3.connect(primary.settings_dict['NAME'])
+    try:
+      for alias in get_replicas():
+        replica = connections[alias]
+        if replica.vendor != 'sqlite':
+          raise CommandError('%s is not an SQLite database.' % alias)
+        replica.close()
+        destination = sqlite3.connect(replica.settings_dict['NAME'])
+        try:
+          # The backup API copies a consistent snapshot while the primary is
+          # in use.
+          source.backup(destination)
+        finally:
+          destination.close()
+        self.stdout.write('Copied %s to %s.' % (DEFAULT_DB_ALIAS, alias))
+    finally:
+      source.close()
@@ -0,0 +1,42 @@
+from .pagination import InvalidCursor
+
+PAGE_SIZE = 50
+
+# The orders members can be listed in, by the field they are sorted on.
+SORTS = {
+  'name': 'username',
+  'newest': '-id',
+}
+
+def get_members(group, sort='name', after=None):
+  """
+  Returns the members of a group in the given order, with their profiles
+  loaded.
+
+  Arguments:
+  group : the group whose members are listed
+  sort : a key of SORTS
+  after : a pagination cursor; only members after it are returned
+  """
+  if sort not in SORTS:
+    raise InvalidCursor(sort)
+  users = group.user_set.select_related('userprofile')
+  if after:
+    if sort == 'name':
+      users = users.filter(username__gt=after)
+    else:
+      try:
+        users = users.filter(id__lt=int(after))
+      except ValueError:
+        raise InvalidCursor(after)
+  return users.order_by(SORTS[sort])
+
+def next_cursor(users, page_size, sort='name'):
+  """
+  Returns the cursor of the page following the given members, or None if
+  they are the last page.
+  """
+  if len(users) < page_size:
+    return None
+  last = users[page_size - 1]
+  return last.username if sort == 'name' else str(last.id)
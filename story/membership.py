@@ -0,0 +1,112 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed
+
+BATCH_SIZE = 500
+
+Membership = User.groups.through
+
+COLUMNS = ('username', 'id')
+
+def parse_users(lines, column='username'):
+  """
+  Returns the user ids and usernames listed in CSV lines, one user per row in
+  the first column, read as the given column of the user table. A header row
+  of 'id' or 'username' sets the column for the rows after it, and is
+  skipped.
+
+  Raises ValueError for an id that is not an integer.
+
+  Returns:
+  (ids, usernames)
+  """
+  ids, usernames = set(), set()
+  for row in csv.reader(lines):
+    cells = [cell.strip() for cell in row if cell.strip()]
+    if not cells:
+      continue
+    if cells[0].lower() in COLUMNS:
+      column = cells[0].lower()
+    elif column == 'id':
+      try:
+        ids.add(int(cells[0]))
+      except ValueError:
+        raise ValueError('Not a user id: %s' % cells[0])
+    else:
+      usernames.add(cells[0])
+  return ids, usernames
+
+def resolve_users(ids, usernames):
+  """
+  Looks up the listed users in a single query.
+
+  Returns:
+  (user_ids, unknown): the ids of the users found, and the listed ids and
+  usernames that match no user.
+  """
+  found = User.objects.filter(Q(id__in=ids) | Q(username__in=usernames))
+  found = list(found.values_list('id', 'username'))
+  unknown = (set(ids) - set(pk for pk, username in found)) \
+            | (set(usernames) - set(username for pk, username in found))
+  return set(pk for pk, username in found), unknown
+
+def send_changed(group, action, user_ids):
+  """
+  Sends one m2m_changed for a change to many memberships of a group, as
+  group.user_set would, so that caches and feeds are updated once.
+  """
+  m2m_changed.send(
+    sender=Membership,
+    instance=group,
+    action=action,
+    reverse=True,
+    model=User,
+    pk_set=set(user_ids),
+    using=router.db_for_write(Membership)
+  )
+
+def add_members(group, user_ids):
+  """
+  Adds many users to a group with batched inserts.
+
+  Returns:
+  the ids of the users that were not already members
+  """
+  with transaction.atomic():
+    existing = Membership.objects.filter(group=group, user_id__in=user_ids)
+    added = set(user_ids) - set(existing.values_list('user_id', flat=True))
+    if not added:
+      return added
+    send_changed(group, 'pre_add', added)
+    Membership.objects.bulk_create(
+      [Membership(group=group, user_id=user_id) for user_id in added],
+      batch_size=BATCH_SIZE,
+      ignore_conflicts=True
+    )
+    send_changed(group, 'post_add', added)
+  return added
+
+def remove_members(group, user_ids):
+  """
+  Removes many users from a group with batched deletes.
+
+  Returns:
+  the ids of the users that were members
+  """
+  with transaction.atomic():
+    existing = Membership.objects.filter(group=group, user_id__in=user_ids)
+    removed = set(existing.values_list('user_id', flat=True))
+    if not removed:
+      return removed
+    send_changed(group, 'pre_remove', removed)
+    removed_list = list(removed)
+    for start in range(0, len(removed_list), BATCH_SIZE):
+      Membership.objects.filter(
+        group=group,
+        user_id__in=removed_list[start:start + BATCH_SIZE]
+      ).delete()
+    send_changed(group, 'post_remove', removed)
+  return removed
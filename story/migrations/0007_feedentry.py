@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_feeds(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    Post = apps.get_model('story', 'Post')
+    FeedEntry = apps.get_model('story', 'FeedEntry')
+
+    for post in Post.objects.all().iterator():
+        if post.viewed_by == 'all':
+            users = User.objects.all()
+        else:
+            users = User.objects.filter(groups__views=post).distinct()
+        FeedEntry.objects.bulk_create([
+            FeedEntry(user_id=user_id, post=post, date_posted=post.date_posted)
+            for user_id in users.values_list('id', flat=True)
+        ], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('story', '0006_auto_20190529_0438'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_posted', models.DateTimeField(verbose_name='date posted')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='story.Post')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-date_posted', '-post'], name='story_feede_user_id_74223b_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='feedentry',
+            unique_together={('user', 'post')},
+        ),
+        migrations.RunPython(populate_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0007_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['viewed_by', '-date_posted', '-id'], name='story_post_viewed__c01991_idx'),
+        ),
+        # Looks up the private posts of a set of viewer groups without
+        # touching the post table.
+        migrations.RunSQL(
+            'CREATE INDEX story_post_viewers_group_post_idx '
+            'ON story_post_viewers (group_id, post_id)',
+            'DROP INDEX story_post_viewers_group_post_idx',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:59
+
+from django.db import migrations, models
+import story.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0008_post_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='file',
+            field=models.FileField(blank=True, storage=story.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:00
+
+from django.db import migrations, models
+import story.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0009_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail',
+            field=models.FileField(blank=True, editable=False, storage=story.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='thumbnail_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,60 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_comments(apps, schema_editor):
+    Post = apps.get_model('story', 'Post')
+    Comment = apps.get_model('story', 'Comment')
+    PostComments = Post._meta.get_field('comments').remote_field.through
+
+    for link in PostComments.objects.all().iterator():
+        Comment.objects.filter(pk=link.comment_id).update(post_id=link.post_id)
+    for post in Post.objects.all().iterator():
+        count = Comment.objects.filter(post=post).count()
+        Post.objects.filter(pk=post.pk).update(comment_count=count)
+
+
+def unlink_comments(apps, schema_editor):
+    Post = apps.get_model('story', 'Post')
+    Comment = apps.get_model('story', 'Comment')
+    PostComments = Post._meta.get_field('comments').remote_field.through
+
+    PostComments.objects.bulk_create([
+        PostComments(post_id=post_id, comment_id=comment_id)
+        for comment_id, post_id in Comment.objects.filter(
+            post__isnull=False).values_list('id', 'post_id')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0010_post_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='post_thread', to='story.Post'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(link_comments, unlink_comments),
+        migrations.RemoveField(
+            model_name='post',
+            name='comments',
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='post',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='story.Post'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'date_posted', 'id'], name='story_comme_post_id_9d8c1a_idx'),
+        ),
+    ]
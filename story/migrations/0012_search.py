@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# Posts are stored under rowid 2 * id and comments under 2 * id + 1, so that
+# the triggers update the index by rowid.
+CREATE_SEARCH = [
+    'CREATE VIRTUAL TABLE story_search '
+    'USING fts5(body, post_id UNINDEXED)',
+
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'SELECT 2 * id, description, id FROM story_post',
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'SELECT 2 * id + 1, text, post_id FROM story_comment '
+    'WHERE post_id IS NOT NULL',
+
+    'CREATE TRIGGER story_search_post_insert AFTER INSERT ON story_post BEGIN '
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'VALUES (2 * new.id, new.description, new.id); END',
+    'CREATE TRIGGER story_search_post_update '
+    'AFTER UPDATE OF description ON story_post BEGIN '
+    'DELETE FROM story_search WHERE rowid = 2 * old.id; '
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'VALUES (2 * new.id, new.description, new.id); END',
+    'CREATE TRIGGER story_search_post_delete AFTER DELETE ON story_post BEGIN '
+    'DELETE FROM story_search WHERE rowid = 2 * old.id; END',
+
+    'CREATE TRIGGER story_search_comment_insert '
+    'AFTER INSERT ON story_comment WHEN new.post_id IS NOT NULL BEGIN '
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'VALUES (2 * new.id + 1, new.text, new.post_id); END',
+    'CREATE TRIGGER story_search_comment_update '
+    'AFTER UPDATE OF text, post_id ON story_comment BEGIN '
+    'DELETE FROM story_search WHERE rowid = 2 * old.id + 1; '
+    'INSERT INTO story_search (rowid, body, post_id) '
+    'SELECT 2 * new.id + 1, new.text, new.post_id '
+    'WHERE new.post_id IS NOT NULL; END',
+    'CREATE TRIGGER story_search_comment_delete '
+    'AFTER DELETE ON story_comment BEGIN '
+    'DELETE FROM story_search WHERE rowid = 2 * old.id + 1; END',
+]
+
+DROP_SEARCH = [
+    'DROP TRIGGER IF EXISTS story_search_post_insert',
+    'DROP TRIGGER IF EXISTS story_search_post_update',
+    'DROP TRIGGER IF EXISTS story_search_post_delete',
+    'DROP TRIGGER IF EXISTS story_search_comment_insert',
+    'DROP TRIGGER IF EXISTS story_search_comment_update',
+    'DROP TRIGGER IF EXISTS story_search_comment_delete',
+    'DROP TABLE IF EXISTS story_search',
+]
+
+
+def create_search(apps, schema_editor):
+    # Full-text search is only available on SQLite.
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_SEARCH:
+            schema_editor.execute(statement)
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SEARCH:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0011_comment_post'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,36 @@
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+search = import_module('story.migrations.0012_search')
+
+
+def copy_date_posted(apps, schema_editor):
+    Post = apps.get_model('story', 'Post')
+    Post.objects.update(date_modified=F('date_posted'))
+
+
+def rebuild_search(apps, schema_editor):
+    # SQLite adds the column by copying the table, which drops its triggers.
+    search.drop_search(apps, schema_editor)
+    search.create_search(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0012_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='date_modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='date modified'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_date_posted, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_search, rebuild_search),
+    ]
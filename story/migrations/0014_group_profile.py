@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_profiles(apps, schema_editor):
+    Group = apps.get_model('auth', 'Group')
+    GroupProfile = apps.get_model('story', 'GroupProfile')
+    groups = Group.objects.annotate(members=models.Count('user'))
+    GroupProfile.objects.bulk_create([
+        GroupProfile(group_id=group_id, member_count=members)
+        for group_id, members in groups.values_list('id', 'members')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('story', '0013_post_date_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_count', models.PositiveIntegerField(default=0)),
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to='auth.Group')),
+            ],
+        ),
+        migrations.RunPython(create_profiles, migrations.RunPython.noop),
+        # Lists the members of a group in user order without a sort.
+        migrations.RunSQL(
+            'CREATE INDEX story_auth_user_groups_group_user_idx '
+            'ON auth_user_groups (group_id, user_id)',
+            'DROP INDEX story_auth_user_groups_group_user_idx',
+        ),
+    ]
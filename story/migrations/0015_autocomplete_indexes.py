@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('story', '0014_group_profile'),
+    ]
+
+    # Prefix searches on the lower case names are served as index ranges.
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX story_auth_user_username_lower_idx '
+            'ON auth_user (lower(username))',
+            'DROP INDEX story_auth_user_username_lower_idx',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX story_userprofile_name_lower_idx '
+            'ON story_userprofile (lower(name))',
+            'DROP INDEX story_userprofile_name_lower_idx',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0017_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invalidation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('args', models.TextField(default='{}')),
+                ('date_created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
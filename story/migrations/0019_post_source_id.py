@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:44
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search = import_module('story.migrations.0012_search')
+
+
+def rebuild_search(apps, schema_editor):
+    # SQLite adds the column by copying the table, which drops its triggers.
+    search.drop_search(apps, schema_editor)
+    search.create_search(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0018_invalidation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='source_id',
+            field=models.CharField(editable=False, max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(rebuild_search, rebuild_search),
+    ]
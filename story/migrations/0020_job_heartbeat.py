@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:46
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_claimed_at(apps, schema_editor):
+    # Running jobs are queued again if their worker does not record a
+    # heartbeat.
+    Job = apps.get_model('story', 'Job')
+    Job.objects.filter(status='running').update(heartbeat_at=F('claimed_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0019_post_source_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_claimed_at, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User, Group
+from django.utils import timezone
+
+from .storage import blob_storage
 
 MAX_NAME_LENGTH=300
 
@@ -17,6 +22,17 @@ class Comment(models.Model):
   text = models.TextField(blank=True)
   date_posted = models.DateTimeField('date posted')
   poster = models.ForeignKey(User, on_delete=models.CASCADE)
+  post = models.ForeignKey(
+    'Post',
+    on_delete=models.CASCADE,
+    related_name = 'comments',
+    null=True
+  )
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['post', 'date_posted', 'id'])
+    ]
 
   def __str__(self):
     return "Comment by " + str(self.poster) \
@@ -25,8 +41,17 @@ class Comment(models.Model):
 
 class Post(models.Model):
   date_posted = models.DateTimeField('date posted')
+
+  # Set whenever the post or its comments change, so that pages showing the
+  # post can be revalidated without rendering them.
+  date_modified = models.DateTimeField('date modified', auto_now=True)
   description = models.TextField(blank=True)
-  file = models.FileField(upload_to='uploads/', blank=True)
+  file = models.FileField(storage=blob_storage, blank=True)
+
+  # A resized copy of an image file, made in the background after upload.
+  thumbnail = models.FileField(storage=blob_storage, blank=True, editable=False)
+  thumbnail_width = models.PositiveIntegerField(null=True, editable=False)
+  thumbnail_height = models.PositiveIntegerField(null=True, editable=False)
 
   poster = models.ForeignKey(
     User,
@@ -56,9 +81,240 @@ class Post(models.Model):
     related_name = 'views'
   )
 
-  comments = models.ManyToManyField(Comment)
+  # Maintained as comments are added and deleted, so pages never COUNT.
+  comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+  # The id of an imported post in the records it came from, so that importing
+  # the records again skips it.
+  source_id = models.CharField(
+    max_length=100,
+    null=True,
+    unique=True,
+    editable=False
+  )
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['viewed_by', '-date_posted', '-id'])
+    ]
 
   def __str__(self):
     return "Post by " + str(self.poster) \
             + ", on " + str(self.date_posted) \
             + ". Description: " + self.description
+
+class FeedEntry(models.Model):
+  """
+  A post that a user is allowed to view, written when the post or its audience
+  changes so that the index page is a single range read per user.
+  """
+  user = models.ForeignKey(
+    User,
+    on_delete=models.CASCADE,
+    related_name = 'feed_entries'
+  )
+  post = models.ForeignKey(
+    Post,
+    on_delete=models.CASCADE,
+    related_name = 'feed_entries'
+  )
+  date_posted = models.DateTimeField('date posted')
+
+  class Meta:
+    unique_together = [['user', 'post']]
+    indexes = [
+      models.Index(fields=['user', '-date_posted', '-post'])
+    ]
+
+  def __str__(self):
+    return "Feed entry for " + str(self.user_id) \
+            + ", post " + str(self.post_id)
+
+class BlobManager(models.Manager):
+  def retain(self, name, content=None):
+    """
+    Counts a new reference to a stored file.
+
+    Releases delete files with the row of the blob locked, so once the
+    reference is counted the file stays. A release that committed since the
+    file was saved may have deleted it, in which case it is written again
+    from content, the file that was saved.
+    """
+    if not blob_storage.digest_of(name):
+      return
+    with transaction.atomic():
+      updated = self.filter(name=name).update(ref_count=F('ref_count') + 1)
+      if content is not None and not blob_storage.exists(name):
+        blob_storage.save(name, content)
+      if not updated:
+        blob, created = self.get_or_create(
+          name=name,
+          defaults={'size': blob_storage.size(name)}
+        )
+        if not created:
+          self.filter(name=name).update(ref_count=F('ref_count') + 1)
+
+  def release(self, name):
+    """
+    Drops a reference to a stored file, deleting it once the last reference
+    is committed.
+    """
+    if not blob_storage.digest_of(name):
+      return
+    self.filter(name=name).update(ref_count=F('ref_count') - 1)
+    if self.filter(name=name, ref_count__lte=0).exists():
+      transaction.on_commit(lambda: self.collect(name))
+
+  def collect(self, name):
+    """
+    Deletes a stored file that has no references left, unless one was
+    counted since it was released.
+    """
+    with transaction.atomic():
+      blob = self.select_for_update().filter(name=name, ref_count__lte=0)
+      if blob.exists():
+        blob_storage.delete(name)
+        blob_storage.delete_derivatives(name)
+        blob.delete()
+
+class Blob(models.Model):
+  """
+  A file in the content addressed storage and the number of posts using it.
+  """
+  name = models.CharField(max_length=100, primary_key=True)
+  size = models.BigIntegerField()
+  ref_count = models.PositiveIntegerField(default=1)
+
+  objects = BlobManager()
+
+  def __str__(self):
+    return self.name + " (" + str(self.ref_count) + " references)"
+
+class GroupProfileManager(models.Manager):
+  def refresh_member_counts(self, group_ids):
+    """
+    Recounts the members of the given groups, creating their profiles if
+    they have none.
+    """
+    group_ids = set(group_ids)
+    existing = self.filter(group_id__in=group_ids)
+    self.bulk_create(
+      [GroupProfile(group_id=group_id) for group_id in
+       group_ids - set(existing.values_list('group_id', flat=True))],
+      ignore_conflicts=True
+    )
+    members = User.groups.through.objects.filter(group_id=OuterRef('group_id'))
+    existing.update(member_count=Coalesce(Subquery(
+      members.order_by().values('group_id').annotate(n=Count('id'))
+             .values('n')
+    ), 0))
+
+class GroupProfile(models.Model):
+  """
+  Details of a group, with its number of members maintained as they join and
+  leave so that group pages never count them.
+  """
+  group = models.OneToOneField(
+    Group,
+    on_delete=models.CASCADE,
+    related_name = 'profile'
+  )
+  member_count = models.PositiveIntegerField(default=0)
+
+  objects = GroupProfileManager()
+
+  def __str__(self):
+    return str(self.group) + " (" + str(self.member_count) + " members)"
+
+class Job(models.Model):
+  """
+  A task queued to run in the background by `manage.py run_workers`.
+  """
+  name = models.CharField(max_length=100)
+  # The arguments of the task, as a JSON list.
+  args = models.TextField(default='[]')
+  priority = models.SmallIntegerField(default=0)
+  run_at = models.DateTimeField()
+
+  statuses = [
+    ('queued', 'queued'),
+    ('running', 'running'),
+    ('done', 'done'),
+    ('failed', 'failed'),
+  ]
+  status = models.CharField(max_length=7, choices=statuses, default='queued')
+  attempts = models.PositiveSmallIntegerField(default=0)
+  max_attempts = models.PositiveSmallIntegerField(default=5)
+  claimed_by = models.CharField(max_length=100, blank=True)
+  claimed_at = models.DateTimeField(null=True, blank=True)
+  # Renewed by the worker running the job while it is alive, so that only
+  # the jobs of dead workers are queued again.
+  heartbeat_at = models.DateTimeField(null=True, blank=True)
+  finished_at = models.DateTimeField(null=True, blank=True)
+  last_error = models.TextField(blank=True)
+  date_created = models.DateTimeField(auto_now_add=True)
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['status', '-priority', 'run_at', 'id'])
+    ]
+
+  def __str__(self):
+    return self.name + " " + self.args + " (" + self.status + ")"
+
+class Notification(models.Model):
+  """
+  A post shared with a user through one of their groups. Notifications with
+  an id above the last_read_id of the user's inbox are unread.
+  """
+  user = models.ForeignKey(
+    User,
+    on_delete=models.CASCADE,
+    related_name = 'notifications'
+  )
+  post = models.ForeignKey(
+    Post,
+    on_delete=models.CASCADE,
+    related_name = 'notifications'
+  )
+  date_created = models.DateTimeField(default=timezone.now)
+
+  class Meta:
+    unique_together = [['user', 'post']]
+    indexes = [
+      models.Index(fields=['user', '-id'])
+    ]
+
+  def __str__(self):
+    return "Notification for " + str(self.user_id) \
+            + ", post " + str(self.post_id)
+
+class Inbox(models.Model):
+  """
+  The number of unread notifications of a user, kept up to date as they are
+  written and read so that polling for it is a single row read.
+  """
+  user = models.OneToOneField(
+    User,
+    on_delete=models.CASCADE,
+    primary_key=True,
+    related_name = 'inbox'
+  )
+  unread = models.PositiveIntegerField(default=0)
+  last_read_id = models.BigIntegerField(default=0)
+
+  def __str__(self):
+    return "Inbox of " + str(self.user_id) + " (" + str(self.unread) + ")"
+
+class Invalidation(models.Model):
+  """
+  A change to cached data, recorded so that every process can drop its own
+  copy. The ids are the versions that processes have caught up to.
+  """
+  kind = models.CharField(max_length=50)
+  # The arguments of the change, as a JSON object.
+  args = models.TextField(default='{}')
+  date_created = models.DateTimeField(default=timezone.now, db_index=True)
+
+  def __str__(self):
+    return str(self.id) + " " + self.kind + " " + self.args
@@ -0,0 +1,145 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+
+from .models import Post, Notification, Inbox
+from . import jobs
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+PAGE_SIZE = 50
+
+executor = None
+
+def get_executor():
+  """
+  Returns the thread that notifies users when STORY_BACKGROUND_JOBS is off,
+  starting it on first use.
+
+  A single thread notifies of one post at a time, as two runs for the same
+  post would fail on each other's notifications, and are not retried as a
+  job would be.
+  """
+  global executor
+  if executor is None:
+    executor = ThreadPoolExecutor(max_workers=1)
+  return executor
+
+def schedule(post):
+  """
+  Notifies the members of the groups a private post is shared with once it
+  is committed, so that saving the post does not wait for them: in a job
+  when STORY_BACKGROUND_JOBS is on, or else in a thread of this process.
+  """
+  if post.viewed_by != 'some':
+    return
+  if jobs.is_enabled():
+    jobs.enqueue('story.notify_post', post.id)
+  else:
+    post_id = post.id
+    transaction.on_commit(
+      lambda: get_executor().submit(notify_in_background, post_id)
+    )
+
+def notify_in_background(post_id):
+  try:
+    return notify_post(post_id)
+  except Exception:
+    logger.exception('Could not notify the viewers of post %d', post_id)
+  finally:
+    # The thread opens its own connection.
+    connection.close()
+
+def get_recipients(post):
+  """
+  Returns the ids of the members of the post's viewer groups, who can view
+  it, who have not been notified of it yet, other than its poster.
+  """
+  users = User.objects.filter(groups__views=post)
+  users = users.exclude(notifications__post=post)
+  if post.poster_id is not None:
+    users = users.exclude(id=post.poster_id)
+  return sorted(set(users.values_list('id', flat=True)))
+
+def notify_post(post_id):
+  """
+  Notifies the members of the groups a private post is shared with, in
+  batches that each write their notifications and counters together.
+
+  Saving the post again notifies only the users who joined its audience.
+  """
+  post = Post.objects.filter(pk=post_id).first()
+  if post is None or post.viewed_by != 'some':
+    return 0
+
+  user_ids = get_recipients(post)
+  for start in range(0, len(user_ids), BATCH_SIZE):
+    batch = user_ids[start:start + BATCH_SIZE]
+    with transaction.atomic():
+      # A notification written by a concurrent job fails the unique
+      # constraint, so that the job is retried rather than counted twice.
+      Notification.objects.bulk_create(
+        [Notification(user_id=user_id, post=post) for user_id in batch]
+      )
+      Inbox.objects.bulk_create(
+        [Inbox(user_id=user_id) for user_id in batch],
+        ignore_conflicts=True
+      )
+      Inbox.objects.filter(user_id__in=batch).update(unread=F('unread') + 1)
+  return len(user_ids)
+
+def post_deleting(post):
+  """
+  Takes the unread notifications of a post that is about to be deleted off
+  the counters of their users.
+  """
+  Inbox.objects.filter(
+    user__notifications__post=post,
+    user__notifications__id__gt=F('last_read_id')
+  ).update(unread=Greatest(F('unread') - 1, 0))
+
+def get_unread_count(user):
+  if not user.is_authenticated:
+    return 0
+  unread = Inbox.objects.filter(user=user).values_list('unread', flat=True)
+  return unread.first() or 0
+
+def get_notifications(user):
+  """
+  Returns the latest notifications of a user, each with its post and whether
+  it is unread.
+  """
+  last_read_id = Inbox.objects.filter(user=user) \
+                              .values_list('last_read_id', flat=True).first()
+  notifications = list(
+    Notification.objects.filter(user=user).select_related('post')
+                        .order_by('-id')[:PAGE_SIZE]
+  )
+  for notification in notifications:
+    notification.unread = notification.id > (last_read_id or 0)
+  return notifications
+
+def mark_read(user):
+  """
+  Marks all the notifications of a user as read.
+  """
+  inbox, created = Inbox.objects.get_or_create(user=user)
+  last = Notification.objects.filter(user=user).aggregate(last=Max('id'))
+  last = last['last'] or 0
+  if last <= inbox.last_read_id:
+    return
+  # Notifications written since the counter was read stay unread.
+  read = Notification.objects.filter(
+    user=user,
+    id__gt=inbox.last_read_id,
+    id__lte=last
+  ).count()
+  Inbox.objects.filter(user=user, last_read_id=inbox.last_read_id).update(
+    last_read_id=last,
+    unread=Greatest(F('unread') - read, 0)
+  )
@@ -0,0 +1,86 @@
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Post, UserProfile
+from . import caching
+
+POST_OBJECT_KEY = 'story:object:post:%d:%s'
+
+FIELDS = [field.attname for field in Post._meta.concrete_fields]
+RELATED = [
+  'knower__name',
+  'poster__username',
+  'poster__userprofile__id',
+  'poster__userprofile__name',
+]
+
+def load_record(pk):
+  """
+  Reads a post with the names of its knower and poster, and the ids of its
+  viewer groups, in two queries.
+
+  Reads from the primary database, as a record read from a lagging replica
+  would be cached under the post's new version.
+
+  Returns:
+  (values, related, viewer_ids), or None if there is no such post
+  """
+  posts = Post.objects.using(DEFAULT_DB_ALIAS).filter(pk=pk)
+  row = posts.values_list(*(FIELDS + RELATED)).first()
+  if row is None:
+    return None
+  viewers = Post.viewers.through.objects.using(DEFAULT_DB_ALIAS)
+  viewer_ids = viewers.filter(post_id=pk).values_list('group_id', flat=True)
+  return row[:len(FIELDS)], row[len(FIELDS):], sorted(viewer_ids)
+
+def from_record(record):
+  """
+  Builds a post from its record, with its knower, poster and the poster's
+  profile loaded with the fields that pages show, and its viewer group ids
+  set for the permission checks.
+  """
+  values, related, viewer_ids = record
+  knower_name, username, profile_id, name = related
+  post = Post.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+  post.knower = Group.from_db(
+    DEFAULT_DB_ALIAS,
+    ['id', 'name'],
+    [post.knower_id, knower_name]
+  )
+  if post.poster_id is not None:
+    poster = User.from_db(
+      DEFAULT_DB_ALIAS,
+      ['id', 'username'],
+      [post.poster_id, username]
+    )
+    if profile_id is None:
+      User.userprofile.related.set_cached_value(poster, None)
+    else:
+      poster.userprofile = UserProfile.from_db(
+        DEFAULT_DB_ALIAS,
+        ['id', 'user_id', 'name'],
+        [profile_id, post.poster_id, name]
+      )
+    post.poster = poster
+  post._viewer_ids_cache = frozenset(viewer_ids)
+  return post
+
+def get_post(pk):
+  """
+  Returns a post from the cache, reading it on a miss, or None if there is
+  no such post.
+
+  The record is kept under the version of the post, so that saving the post,
+  changing its viewers or comments, or changing a profile makes the next
+  read load it again.
+  """
+  pk = int(pk)
+  key = POST_OBJECT_KEY % (pk, caching.post_version(pk))
+  record = cache.get(key)
+  if record is None:
+    record = load_record(pk)
+    if record is None:
+      return None
+    cache.set(key, record, caching.get_timeout())
+  return from_record(record)
@@ -0,0 +1,63 @@
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+class InvalidCursor(ValueError):
+  pass
+
+def encode_cursor(date, pk):
+  """
+  Encodes the position of a row ordered by (date, pk) as an opaque string.
+  """
+  return '%d-%d' % ((date - EPOCH) // MICROSECOND, pk)
+
+def decode_cursor(cursor):
+  """
+  Decodes a cursor made by encode_cursor.
+
+  Returns:
+  (date, pk)
+  """
+  try:
+    micros, pk = cursor.split('-')
+    return EPOCH + int(micros) * MICROSECOND, int(pk)
+  except (ValueError, OverflowError):
+    raise InvalidCursor(cursor)
+
+def before_cursor(cursor, date_field, pk_field):
+  """
+  Returns a filter for the rows that come after the cursor when ordering by
+  (date_field, pk_field) descending.
+
+  The filter is written as a range on date_field so that an index on
+  (date_field, pk_field) is read from the cursor onwards, however deep the
+  cursor is.
+  """
+  date, pk = decode_cursor(cursor)
+  return Q(**{date_field + '__lte': date}) & (
+    Q(**{date_field + '__lt': date}) | Q(**{pk_field + '__lt': pk})
+  )
+
+def after_cursor(cursor, date_field, pk_field):
+  """
+  Returns a filter for the rows that come after the cursor when ordering by
+  (date_field, pk_field) ascending.
+  """
+  date, pk = decode_cursor(cursor)
+  return Q(**{date_field + '__gte': date}) & (
+    Q(**{date_field + '__gt': date}) | Q(**{pk_field + '__gt': pk})
+  )
+
+def next_cursor(objects, page_size, date_field='date_posted'):
+  """
+  Returns the cursor of the page following the given objects, or None if the
+  objects are the last page.
+  """
+  if len(objects) < page_size:
+    return None
+  last = objects[page_size - 1]
+  return encode_cursor(getattr(last, date_field), last.pk)
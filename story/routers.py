@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'story_primary_until'
+
+local = threading.local()
+
+def get_replicas():
+  return getattr(settings, 'STORY_REPLICAS', [])
+
+def get_pin_seconds():
+  return getattr(settings, 'STORY_REPLICA_PIN_SECONDS', 5)
+
+@contextmanager
+def primary():
+  """
+  Sends the reads of the block to the primary database, in a request that
+  would read from a replica.
+
+  Pages are cached under the versions their data had when they were read, and
+  a change bumps the versions as soon as it commits, when a lagging replica
+  may not have it yet. So pages that are cached are rendered from the primary.
+  """
+  use_replicas = getattr(local, 'use_replicas', False)
+  local.use_replicas = False
+  try:
+    yield
+  finally:
+    local.use_replicas = use_replicas and not getattr(local, 'wrote', False)
+
+class PrimaryReplicaRouter:
+  """
+  Sends writes to the primary database, and the reads of requests marked by
+  ReplicaMiddleware to a random replica from STORY_REPLICAS.
+
+  Reads outside such requests, as in management commands and background
+  threads, and reads after the request has written, go to the primary, so
+  that they never see older data than the writes they follow.
+  """
+  def db_for_read(self, model, **hints):
+    replicas = get_replicas()
+    if replicas and getattr(local, 'use_replicas', False):
+      return random.choice(replicas)
+    return DEFAULT_DB_ALIAS
+
+  def db_for_write(self, model, **hints):
+    if getattr(local, 'use_replicas', False):
+      local.use_replicas = False
+    local.wrote = True
+    return DEFAULT_DB_ALIAS
+
+  def allow_relation(self, obj1, obj2, **hints):
+    databases = [DEFAULT_DB_ALIAS] + list(get_replicas())
+    if obj1._state.db in databases and obj2._state.db in databases:
+      return True
+    return None
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    # Replicas are copies of the primary, so only the primary is migrated.
+    if db in get_replicas():
+      return False
+    return None
+
+class ReplicaMiddleware:
+  """
+  Lets the reads of safe requests go to the replicas, unless the client
+  wrote in the last STORY_REPLICA_PIN_SECONDS.
+
+  After a request writes, a cookie pins the client to the primary for that
+  window, so that they read their own writes while the replicas catch up.
+  """
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+  def __call__(self, request):
+    try:
+      pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+    except ValueError:
+      pinned_until = 0
+    local.use_replicas = request.method in ('GET', 'HEAD', 'OPTIONS') \
+                         and pinned_until < time.time()
+    local.wrote = False
+    try:
+      response = self.get_response(request)
+    finally:
+      wrote = local.wrote
+      local.use_replicas = local.wrote = False
+
+    unsafe = request.method not in ('GET', 'HEAD', 'OPTIONS')
+    if get_replicas() and (wrote or unsafe):
+      seconds = get_pin_seconds()
+      response.set_cookie(
+        PIN_COOKIE,
+        '%.3f' % (time.time() + seconds),
+        max_age=seconds,
+        httponly=True
+      )
+    return response
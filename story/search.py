@@ -0,0 +1,107 @@
+import re
+
+from django.db import connection, connections, router
+
+from .access import ObjectPermissionsBackend
+from .models import Post
+from .pagination import InvalidCursor
+
+PAGE_SIZE = 10
+
+# The matches are joined to their posts, and only those the user can view
+# are kept, so that the permission check runs on the matched rows alone.
+SEARCH_SQL = '''
+  SELECT story_search.post_id, min(story_search.rank) AS post_rank
+  FROM story_search
+  JOIN %(post)s AS post ON post.id = story_search.post_id
+  WHERE story_search MATCH %%s AND (%(viewable)s)
+  GROUP BY story_search.post_id
+  %(having)s
+  ORDER BY post_rank, story_search.post_id
+  LIMIT %%s
+'''
+PUBLIC_SQL = "post.viewed_by = 'all'"
+VIEWERS_SQL = '''
+  post.viewed_by = 'some' AND EXISTS (
+    SELECT 1 FROM %(viewers)s AS viewer
+    WHERE viewer.post_id = post.id AND viewer.group_id IN (%(group_ids)s)
+  )
+'''
+AFTER_SQL = 'HAVING post_rank > %s OR (post_rank = %s AND post_id > %s)'
+
+def is_available():
+  return connection.vendor == 'sqlite'
+
+def match_expression(query):
+  """
+  Returns an FTS5 expression matching every word of the query, with the
+  words quoted so that user input cannot use the query syntax.
+  """
+  words = re.findall(r'\w+', query)
+  return ' '.join('"%s"' % word for word in words)
+
+def encode_cursor(rank, pk):
+  return '%r:%d' % (rank, pk)
+
+def decode_cursor(cursor):
+  try:
+    rank, pk = cursor.split(':')
+    return float(rank), int(pk)
+  except ValueError:
+    raise InvalidCursor(cursor)
+
+def search_posts(user, query, after=None, limit=PAGE_SIZE):
+  """
+  Returns the posts whose description or comments match the query and that
+  the user is allowed to view, best match first.
+
+  Posts are ranked by the bm25 score of their best matching text. Matches
+  are kept if their post is public, or shared with one of the user's
+  groups, in the same query.
+
+  Arguments:
+  user : the searching user, or None for an anonymous visitor
+  query : the words to search for
+  after : a pagination cursor; only results after it are returned
+
+  Returns:
+  (posts, next_cursor): the matching posts, and the cursor of the next page
+  or None on the last page.
+  """
+  expression = match_expression(query)
+  if not expression or not is_available():
+    return [], None
+
+  group_ids = []
+  if user is not None:
+    group_ids = sorted(ObjectPermissionsBackend().get_group_ids(user))
+  viewable = PUBLIC_SQL
+  if group_ids:
+    viewable += ' OR ' + VIEWERS_SQL % {
+      'viewers': Post.viewers.through._meta.db_table,
+      'group_ids': ', '.join(['%s'] * len(group_ids)),
+    }
+
+  params = [expression] + group_ids
+  having = ''
+  if after:
+    rank, pk = decode_cursor(after)
+    having = AFTER_SQL
+    params += [rank, rank, pk]
+  params.append(limit)
+
+  sql = SEARCH_SQL % {
+    'post': Post._meta.db_table,
+    'viewable': viewable,
+    'having': having,
+  }
+  with connections[router.db_for_read(Post)].cursor() as cursor:
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+  posts = Post.objects.in_bulk([post_id for post_id, rank in rows])
+  results = [posts[post_id] for post_id, rank in rows if post_id in posts]
+  cursor = None
+  if len(rows) == limit:
+    cursor = encode_cursor(rows[-1][1], rows[-1][0])
+  return results, cursor
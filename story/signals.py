@@ -0,0 +1,231 @@
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, \
+                                     post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Post, Blob, Comment, GroupProfile, UserProfile
+from .access import invalidate_group_ids
+from . import caching, feed, jobs, live, notifications, visibility
+
+def fan_out(post):
+  """
+  Fans out a post now, or as a job when STORY_BACKGROUND_JOBS is on.
+  """
+  if jobs.is_enabled():
+    jobs.enqueue('story.fan_out_post', post.id, priority=1)
+  else:
+    feed.fan_out_post(post)
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+  instance._previous = (None, None, None)
+  # An uploaded file, kept to write it again if its blob was deleted since
+  # it was saved.
+  instance._upload = None
+  if instance.file and not instance.file._committed:
+    instance._upload = instance.file.file
+  if instance.pk:
+    previous = Post.objects.filter(pk=instance.pk)
+    instance._previous = previous.values_list(
+      'file', 'knower_id', 'viewed_by'
+    ).first() or instance._previous
+
+def publish(post, group_ids=()):
+  """
+  Sends a post to the live feeds of the clients that can view it, once it is
+  committed.
+  """
+  group_ids = list(group_ids)
+  transaction.on_commit(lambda: live.post_published(post, group_ids))
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+  previous_file, previous_knower_id, previous_viewed_by = instance._previous
+  if instance.file.name != previous_file:
+    Blob.objects.retain(instance.file.name, instance._upload)
+    Blob.objects.release(previous_file)
+
+  # The audience of a post only changes with viewed_by, or with its viewers,
+  # which post_viewers_changed fans out.
+  if created or instance.viewed_by != previous_viewed_by:
+    fan_out(instance)
+  notifications.schedule(instance)
+  if created:
+    publish(instance)
+
+  group_ids = set(instance.viewers.values_list('id', flat=True))
+  group_ids.update([instance.knower_id, previous_knower_id])
+  group_ids.discard(None)
+  caching.posts_changed(
+    [instance.id],
+    group_ids,
+    'all' in (instance.viewed_by, previous_viewed_by)
+  )
+
+  visibility.update('set_public', instance.id, instance.viewed_by == 'all')
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+  instance._viewer_ids = list(instance.viewers.values_list('id', flat=True))
+  notifications.post_deleting(instance)
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+  Blob.objects.release(instance.file.name)
+  caching.posts_changed(
+    [instance.id],
+    instance._viewer_ids + [instance.knower_id],
+    instance.viewed_by == 'all'
+  )
+
+  visibility.update('remove_post', instance.id)
+
+@receiver(m2m_changed, sender=Post.viewers.through)
+def post_viewers_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action == 'pre_clear':
+    if reverse:
+      instance._cleared_ids = list(instance.views.values_list('id', flat=True))
+    else:
+      instance._cleared_ids = list(
+        instance.viewers.values_list('id', flat=True)
+      )
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  if action == 'post_clear':
+    pk_set = instance._cleared_ids
+  if reverse:
+    caching.posts_changed(pk_set, [instance.id])
+  else:
+    caching.posts_changed([instance.id], pk_set)
+
+  if reverse:
+    post_ids, group_ids = list(pk_set), [instance.id]
+  else:
+    post_ids, group_ids = [instance.id], list(pk_set)
+  if action == 'post_add':
+    visibility.update('add_viewers', post_ids, group_ids)
+  else:
+    visibility.update('remove_viewers', post_ids, group_ids)
+
+  # Public posts were published when they were created.
+  if not reverse:
+    fan_out(instance)
+    if action == 'post_add' and instance.viewed_by == 'some':
+      notifications.schedule(instance)
+      publish(instance, pk_set)
+    return
+  for post in Post.objects.filter(id__in=pk_set):
+    fan_out(post)
+    if action == 'post_add' and post.viewed_by == 'some':
+      notifications.schedule(post)
+      publish(post, [instance.id])
+
+def names_changed(created, update_fields, field):
+  """
+  Whether saving a user or group may have changed the name that cached
+  posts show, which logins, saving only last_login, do not.
+  """
+  return not created and (update_fields is None or field in update_fields)
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+  if created:
+    feed.sync_user_feed(instance)
+  if names_changed(created, update_fields, 'username'):
+    caching.profiles_changed()
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+  if action == 'pre_clear':
+    if reverse:
+      instance._cleared_user_ids = list(
+        instance.user_set.values_list('id', flat=True)
+      )
+    else:
+      instance._cleared_group_ids = list(
+        instance.groups.values_list('id', flat=True)
+      )
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+
+  if not reverse:
+    if action == 'post_clear':
+      pk_set = instance._cleared_group_ids
+    GroupProfile.objects.refresh_member_counts(pk_set)
+    instance.__dict__.pop('_group_ids_cache', None)
+    invalidate_group_ids([instance.id])
+    live.memberships_changed([instance.id])
+    feed.sync_user_feed(instance)
+    return
+  if action == 'post_clear':
+    pk_set = instance._cleared_user_ids
+  GroupProfile.objects.refresh_member_counts([instance.id])
+  invalidate_group_ids(pk_set)
+  live.memberships_changed(pk_set)
+  if action == 'post_add':
+    feed.add_group_posts(instance, pk_set)
+  else:
+    feed.remove_group_posts(instance, pk_set)
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+  instance._deleted_group_ids = list(
+    instance.groups.values_list('id', flat=True)
+  )
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+  # The memberships are deleted without m2m_changed.
+  GroupProfile.objects.refresh_member_counts(instance._deleted_group_ids)
+  live.memberships_changed([instance.id])
+  # Their posts are kept without a poster.
+  caching.profiles_changed()
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, update_fields, **kwargs):
+  if created:
+    GroupProfile.objects.refresh_member_counts([instance.id])
+  if names_changed(created, update_fields, 'name'):
+    caching.profiles_changed()
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+  instance._deleted_user_ids = list(
+    instance.user_set.values_list('id', flat=True)
+  )
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+  invalidate_group_ids(instance._deleted_user_ids)
+  live.memberships_changed(instance._deleted_user_ids)
+
+  visibility.update('remove_group', instance.id)
+  feed.rebuild_feed(User.objects.filter(id__in=instance._deleted_user_ids))
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+  if not instance.post_id:
+    return
+  changes = {'date_modified': timezone.now()}
+  if created:
+    changes['comment_count'] = F('comment_count') + 1
+  # Updated in place so that the post's own save signals do not fire.
+  Post.objects.filter(pk=instance.post_id).update(**changes)
+  caching.posts_changed([instance.post_id])
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+  if instance.post_id:
+    Post.objects.filter(pk=instance.post_id).update(
+      comment_count=F('comment_count') - 1,
+      date_modified=timezone.now()
+    )
+    caching.posts_changed([instance.post_id])
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+  caching.profiles_changed()
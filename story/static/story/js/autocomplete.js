@@ -0,0 +1,26 @@
+/* Fills a hidden user id field from a search box that suggests users. */
+$(function() {
+  $('[data-autocomplete-url]').each(function() {
+    var search = $(this);
+    var field = $('#' + search.data('autocomplete-field'));
+    var list = $('#' + search.attr('list'));
+    var users = {};
+
+    search.on('input', function() {
+      var label = search.val();
+      field.val(users[label] || '');
+      if (users[label] || !label) {
+        return;
+      }
+      $.getJSON(search.data('autocomplete-url'), {q: label}, function(data) {
+        list.empty();
+        users = {};
+        $.each(data.users, function(i, user) {
+          var option = user.name + ' (' + user.username + ')';
+          users[option] = user.id;
+          list.append($('<option>').attr('value', option));
+        });
+      });
+    });
+  });
+});
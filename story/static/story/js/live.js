@@ -0,0 +1,19 @@
+/* Shows a link to reload the feed when new posts are pushed. */
+$(function() {
+  var banner = $('[data-live-url]');
+  if (!banner.length || !window.EventSource) {
+    return;
+  }
+
+  var count = 0;
+  var source = new EventSource(banner.data('live-url'));
+  source.addEventListener('post', function() {
+    count += 1;
+    banner.find('a').text(count + (count === 1 ? ' new post' : ' new posts'));
+    banner.prop('hidden', false);
+  });
+  source.addEventListener('reload', function() {
+    banner.find('a').text('New posts');
+    banner.prop('hidden', false);
+  });
+});
@@ -0,0 +1,20 @@
+/* Polls the number of unread notifications while the page is visible. */
+$(function() {
+  var counter = $('[data-unread-url]');
+  if (!counter.length) {
+    return;
+  }
+
+  function poll() {
+    if (document.hidden) {
+      return;
+    }
+    $.getJSON(counter.data('unread-url'), function(data) {
+      counter.text(data.unread ? '(' + data.unread + ')' : '');
+    });
+  }
+
+  poll();
+  setInterval(poll, 30000);
+  $(document).on('visibilitychange', poll);
+});
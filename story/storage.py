@@ -0,0 +1,86 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIRECTORY = 'blobs'
+DERIVATIVE_DIRECTORY = 'derivatives'
+MAX_EXTENSION_LENGTH = 10
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+  """
+  A file system storage that names each file after the SHA-256 of its content.
+
+  Files are hashed while they are streamed to a temporary file, then moved to
+  blobs/<aa>/<bb>/<digest><extension>. A file whose content is already stored
+  is not written again, and the name of the stored copy is returned instead.
+  Sharding by the first two bytes of the digest keeps every directory small.
+  """
+  def get_available_name(self, name, max_length=None):
+    # The name is replaced by the digest of the content when it is saved.
+    return name
+
+  def blob_name(self, digest, extension):
+    return '/'.join(
+      [BLOB_DIRECTORY, digest[:2], digest[2:4], digest + extension]
+    )
+
+  def digest_of(self, name):
+    """
+    Returns the digest of a file saved by this storage, or None.
+    """
+    if not name or not name.startswith(BLOB_DIRECTORY + '/'):
+      return None
+    return os.path.splitext(os.path.basename(name))[0]
+
+  def derivative_name(self, name, variant):
+    """
+    Returns the name of a derived version of a stored file, such as a
+    thumbnail. Derivatives of a blob are shared by every post using it.
+    """
+    digest = self.digest_of(name)
+    if digest is None:
+      digest = hashlib.sha256(name.encode()).hexdigest()
+    return '/'.join(
+      [DERIVATIVE_DIRECTORY, digest[:2], digest[2:4], digest, variant]
+    )
+
+  def delete_derivatives(self, name):
+    directory = os.path.dirname(self.path(self.derivative_name(name, '')))
+    shutil.rmtree(directory, ignore_errors=True)
+
+  def _save(self, name, content):
+    extension = os.path.splitext(name)[1].lower()
+    if len(extension) > MAX_EXTENSION_LENGTH:
+      extension = ''
+
+    directory = self.path(os.path.join(BLOB_DIRECTORY, 'tmp'))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory)
+    try:
+      digest = hashlib.sha256()
+      with os.fdopen(fd, 'wb') as f:
+        for chunk in content.chunks():
+          digest.update(chunk)
+          f.write(chunk)
+
+      name = self.blob_name(digest.hexdigest(), extension)
+      path = self.path(name)
+      if os.path.exists(path):
+        os.remove(temporary)
+      else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.file_permissions_mode is not None:
+          os.chmod(temporary, self.file_permissions_mode)
+        os.replace(temporary, path)
+    except BaseException:
+      if os.path.exists(temporary):
+        os.remove(temporary)
+      raise
+    return name
+
+blob_storage = ContentAddressedStorage()
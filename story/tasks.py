@@ -0,0 +1,21 @@
+from .models import Post
+from .jobs import task
+from . import caching, derivatives, feed, notifications
+
+@task('story.fan_out_post')
+def fan_out_post(post_id):
+  post = Post.objects.filter(pk=post_id).first()
+  if post is not None:
+    feed.fan_out_post(post)
+    # Feeds rendered since the post was saved were cached without it.
+    caching.post_changed(post)
+
+@task('story.render_thumbnail')
+def render_thumbnail(post_id):
+  post = Post.objects.filter(pk=post_id).first()
+  if post is not None:
+    derivatives.render_post_thumbnail(post)
+
+@task('story.notify_post')
+def notify_post(post_id):
+  notifications.notify_post(post_id)
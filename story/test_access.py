@@ -1,15 +1,19 @@
 from django.core.files import File
 from django.db.utils import IntegrityError
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, Client, \
+                        override_settings
 from django.utils import timezone
 
 from django.contrib.auth.models import User, Group
 from .models import Post
-from .access import ObjectPermissionsBackend
+from .access import ObjectPermissionsBackend, GROUP_IDS_KEY
 
 class PermissionsTests(TestCase):
   def setUp(self):
     self.backend = ObjectPermissionsBackend()
+    cache.clear()
 
     user1 = User.objects.create(username='user1')
     user2 = User.objects.create(username='user2')
@@ -85,3 +89,92 @@ class PermissionsTests(TestCase):
     self.assertFalse(
       self.backend.has_perm(user2, 'story.change_post', p)
     )
+
+  def test_filter_viewable(self):
+    group1 = Group.objects.get(name='group1')
+    group2 = Group.objects.get(name='group2')
+    public = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = group1,
+      viewed_by = 'all',
+    )
+    private1 = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = group1,
+      viewed_by = 'some',
+    )
+    private1.viewers.add(group1)
+    private2 = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = group2,
+      viewed_by = 'some',
+    )
+    private2.viewers.add(group2)
+    posts = list(Post.objects.order_by('id'))
+
+    # The whole list is resolved with a constant number of queries.
+    user1 = User.objects.get(username='user1')
+    with self.assertNumQueries(2):
+      viewable = self.backend.filter_viewable(user1, posts)
+    self.assertEqual(viewable, [public, private1])
+
+    # The user's groups are remembered for the rest of the request.
+    with self.assertNumQueries(0):
+      changeable = self.backend.filter_changeable(user1, posts)
+    self.assertEqual(changeable, [public, private1])
+
+    user2 = User.objects.get(username='user2')
+    self.assertEqual(
+      self.backend.filter_viewable(user2, posts),
+      [public, private2]
+    )
+    self.assertEqual(self.backend.filter_changeable(user2, posts), [private2])
+
+  def test_group_ids_invalidated(self):
+    user1 = User.objects.get(username='user1')
+    group1 = Group.objects.get(name='group1')
+    group2 = Group.objects.get(name='group2')
+    group3 = Group.objects.get(name='group3')
+    p = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = group2,
+      viewed_by = 'all',
+    )
+    self.assertEqual(
+      self.backend.get_group_ids(user1),
+      {group1.id, group3.id}
+    )
+    self.assertFalse(self.backend.has_perm(user1, 'story.change_post', p))
+
+    user1.groups.add(group2)
+    self.assertTrue(self.backend.has_perm(user1, 'story.change_post', p))
+
+  @override_settings(STORY_GROUP_IDS_TIMEOUT=60)
+  def test_group_ids_cached_between_requests(self):
+    group2 = Group.objects.get(name='group2')
+    self.backend.get_group_ids(User.objects.get(username='user1'))
+
+    user1 = User.objects.get(username='user1')
+    with self.assertNumQueries(0):
+      self.backend.get_group_ids(user1)
+
+    group2.user_set.add(user1)
+    user1 = User.objects.get(username='user1')
+    self.assertIn(group2.id, self.backend.get_group_ids(user1))
+
+@override_settings(STORY_GROUP_IDS_TIMEOUT=60)
+class GroupIdsCacheTests(TransactionTestCase):
+  """
+  Cached group ids are dropped when the change to the memberships commits.
+  """
+  def test_read_before_commit(self):
+    cache.clear()
+    backend = ObjectPermissionsBackend()
+    user = User.objects.create(username='user')
+    group = Group.objects.create(name='group')
+    with transaction.atomic():
+      group.user_set.add(user)
+      # A concurrent request that read the groups before the commit.
+      cache.set(GROUP_IDS_KEY % user.id, frozenset(), 60)
+    user = User.objects.get(pk=user.pk)
+    self.assertEqual(backend.get_group_ids(user), {group.id})
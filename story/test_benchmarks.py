@@ -0,0 +1,52 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+from .benchmarks import data, scenarios
+from .models import Post
+
+CONFIG = dict(data.DEFAULTS, users=10, groups=4, posts=30)
+
+class BenchmarkTests(TestCase):
+  """
+  The benchmarks run on the same generated data for the same seed.
+  """
+  def setUp(self):
+    cache.clear()
+
+  def test_records(self):
+    self.assertEqual(
+      list(data.records(CONFIG)),
+      list(data.records(CONFIG))
+    )
+    self.assertNotEqual(
+      list(data.records(CONFIG)),
+      list(data.records(dict(CONFIG, seed=1)))
+    )
+
+  def test_generate(self):
+    data.generate(CONFIG)
+    self.assertEqual(User.objects.count(), 10)
+    self.assertEqual(Post.objects.count(), 30)
+    self.assertTrue(Post.objects.filter(viewed_by='some').exists())
+
+  def test_run(self):
+    data.generate(CONFIG)
+    results = scenarios.run(samples=3)
+    self.assertEqual(set(results), set(scenarios.SCENARIOS))
+    for result in results.values():
+      self.assertEqual(result['samples'], 3)
+      self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+  def test_cold_cache(self):
+    # The cache of the site is left alone.
+    data.generate(CONFIG)
+    cache.set('story:test', 1)
+    scenarios.run(['PostView'], samples=2, cold_cache=True)
+    self.assertEqual(cache.get('story:test'), 1)
+
+  def test_percentile(self):
+    samples = list(range(1, 101))
+    self.assertEqual(scenarios.percentile(samples, 50), 50)
+    self.assertEqual(scenarios.percentile(samples, 99), 99)
+    self.assertEqual(scenarios.percentile([7], 95), 7)
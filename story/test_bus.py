@@ -0,0 +1,148 @@
+import json
+import time
+
+from django.db import transaction
+
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Invalidation, Post, UserProfile
+from .visibility import VisibilityIndex, bitmap
+from .testing import notify_inline
+from . import bus, caching, visibility
+
+def send_from_other_process(kind, **kwargs):
+  return Invalidation.objects.create(kind=kind, args=json.dumps(kwargs))
+
+@notify_inline
+@override_settings(STORY_INVALIDATION_BUS=True)
+class InvalidationBusTests(TransactionTestCase):
+  """
+  Each process applies the invalidations sent by the others on its next check,
+  at most once per interval.
+
+  Changes are sent when their transaction commits, so these tests commit.
+  """
+  def setUp(self):
+    state, bus.state = bus.state, bus.State()
+    self.addCleanup(setattr, bus, 'state', state)
+    self.calls = []
+    bus.register('test', lambda **kwargs: self.calls.append(kwargs))
+    self.addCleanup(bus.handlers.pop, 'test')
+    bus.check()
+
+  def test_replay(self):
+    key = caching.POST_VERSION_KEY % 1
+    version = caching.get_versions([key])[key]
+    send_from_other_process('fragments', keys=[key])
+    send_from_other_process('test', value=1)
+    bus.check(force=True)
+    self.assertNotEqual(caching.get_versions([key])[key], version)
+    self.assertEqual(self.calls, [{'value': 1}])
+
+    # Changes are applied once.
+    bus.check(force=True)
+    self.assertEqual(self.calls, [{'value': 1}])
+
+  def test_own_changes(self):
+    bus.send('test', value=1)
+    self.assertTrue(Invalidation.objects.filter(kind='test').exists())
+    bus.check(force=True)
+    self.assertEqual(self.calls, [])
+
+  def test_late_commit(self):
+    # A change with a lower id that commits after a change with a higher id
+    # was applied is still applied, once.
+    late = send_from_other_process('test', value=1)
+    send_from_other_process('test', value=2)
+    bus.state.seen.add(late.id + 1)
+    bus.state.last_id = late.id + 1
+    bus.check(force=True)
+    self.assertEqual(self.calls, [{'value': 1}])
+    bus.check(force=True)
+    self.assertEqual(self.calls, [{'value': 1}])
+
+    # Changes older than the window are not read again.
+    old = timezone.now() - timezone.timedelta(seconds=bus.get_window() + 1)
+    Invalidation.objects.update(date_created=old)
+    with self.assertNumQueries(1):
+      bus.check(force=True)
+    self.assertEqual(bus.state.seen, set())
+
+  def test_rolled_back(self):
+    class RolledBack(Exception):
+      pass
+    with self.assertRaises(RolledBack):
+      with transaction.atomic():
+        bus.send('test', value=1)
+        raise RolledBack()
+    self.assertFalse(Invalidation.objects.filter(kind='test').exists())
+
+  def test_interval(self):
+    send_from_other_process('test', value=1)
+    with self.assertNumQueries(0):
+      bus.check()
+    self.assertEqual(self.calls, [])
+    bus.state.last_check -= bus.get_interval()
+    bus.check()
+    self.assertEqual(self.calls, [{'value': 1}])
+
+  def test_missed(self):
+    resets = []
+    bus.on_reset(lambda: resets.append(True))
+    self.addCleanup(bus.resets.pop)
+
+    send_from_other_process('test', value=1)
+    bus.state.last_check -= bus.get_retention() + 1
+    bus.check()
+    self.assertEqual(resets, [True])
+    self.assertEqual(self.calls, [])
+
+  def test_prune(self):
+    old = timezone.now() - timezone.timedelta(seconds=bus.get_retention() + 1)
+    for i in range(3):
+      send_from_other_process('test', value=i)
+    Invalidation.objects.update(date_created=old)
+    self.assertEqual(bus.prune(), 2)
+    # The latest change is kept.
+    self.assertEqual(Invalidation.objects.count(), 1)
+
+  @override_settings(STORY_VISIBILITY_INDEX=True)
+  def test_visibility(self):
+    index = VisibilityIndex()
+    index.warm = True
+    self.addCleanup(setattr, visibility, 'index', visibility.index)
+    visibility.index = index
+
+    group = Group.objects.create(name='group')
+    post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = group,
+      viewed_by = 'some',
+    )
+    Post.viewers.through.objects.create(post=post, group=group)
+    # Changes to posts are read again from the database, so a change sent
+    # before another that committed first does not undo it.
+    send_from_other_process('visibility', method='remove_viewers',
+                            args=[[post.id], [group.id]])
+    send_from_other_process('visibility', method='remove_group',
+                            args=[group.id + 1])
+    index.groups[group.id + 1] = bitmap([post.id])
+    bus.check(force=True)
+    self.assertEqual(index.viewable_mask([group.id]), bitmap([post.id]))
+    self.assertEqual(index.groups, {group.id: bitmap([post.id])})
+
+  def test_profiles(self):
+    user = User.objects.create(username='poster')
+    post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = Group.objects.create(name='group'),
+      poster = user,
+      viewed_by = 'all',
+    )
+    version = caching.post_version(post.id)
+    UserProfile.objects.create(user=user, name='Poster',
+                               dob=timezone.now(), date_joined=timezone.now())
+    self.assertNotEqual(caching.post_version(post.id), version)
+    self.assertTrue(Invalidation.objects.filter(kind='fragments').exists())
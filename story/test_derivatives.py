@@ -0,0 +1,125 @@
+import io
+import mock
+import shutil
+import tempfile
+import threading
+import unittest
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.templatetags.static import static
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import Group
+from .models import Post
+from .storage import blob_storage
+from . import derivatives
+
+def image_content(size):
+  image = derivatives.Image.new('RGB', size, (255, 0, 0))
+  content = io.BytesIO()
+  image.save(content, 'PNG')
+  return ContentFile(content.getvalue())
+
+@unittest.skipIf(derivatives.Image is None, 'Pillow is not installed.')
+class ThumbnailTests(TestCase):
+  """
+  Image posts get a thumbnail that is shown once it has been rendered.
+  """
+  def setUp(self):
+    self.media_root = tempfile.mkdtemp()
+    self.settings = override_settings(MEDIA_ROOT=self.media_root)
+    self.settings.enable()
+
+    self.group = Group.objects.create(name='group')
+    self.post = Post(
+      date_posted = timezone.now(),
+      knower = self.group,
+      viewed_by = 'all',
+    )
+    self.post.file.save('photo.png', image_content((1280, 720)))
+    self.url = reverse('story:post_thumbnail', kwargs={'pk': self.post.id})
+
+  def tearDown(self):
+    self.settings.disable()
+    shutil.rmtree(self.media_root)
+
+  def render(self):
+    name = blob_storage.derivative_name(self.post.file.name,
+                                        derivatives.THUMBNAIL)
+    size = derivatives.render_thumbnail(
+      self.post.file.path,
+      blob_storage.path(name)
+    )
+    derivatives.record(self.post.id, self.post.file.name, name, size)
+    self.post.refresh_from_db()
+
+  def test_render(self):
+    self.render()
+    self.assertEqual(
+      (self.post.thumbnail_width, self.post.thumbnail_height),
+      (640, 360)
+    )
+    with self.post.thumbnail.open('rb') as f:
+      self.assertEqual(f.read(3), b'\xff\xd8\xff')
+
+  def test_changed_file(self):
+    # A thumbnail of a file that has since been replaced is not recorded.
+    name = self.post.file.name
+    self.post.file.save('other.png', image_content((10, 10)))
+    derivatives.record(self.post.id, name, 'stale.jpg', (1, 1))
+    self.post.refresh_from_db()
+    self.assertFalse(self.post.thumbnail)
+
+  def test_placeholder(self):
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 302)
+    self.assertTrue(response.url.endswith(derivatives.PLACEHOLDER))
+    self.assertIn('max-age=60', response['Cache-Control'])
+
+    self.render()
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+  def test_schedule(self):
+    # The result is recorded from a thread of the executor, which cannot see
+    # the test transaction.
+    recorded = threading.Event()
+    with mock.patch.object(derivatives, 'record',
+                           side_effect=lambda *args: recorded.set()) as record:
+      future = derivatives.schedule(self.post)
+      self.assertEqual(future.result(timeout=30), (640, 360))
+      self.assertTrue(recorded.wait(timeout=30))
+
+    name = blob_storage.derivative_name(self.post.file.name,
+                                        derivatives.THUMBNAIL)
+    record.assert_called_once_with(
+      self.post.id,
+      self.post.file.name,
+      name,
+      (640, 360)
+    )
+    self.assertTrue(blob_storage.exists(name))
+
+  def test_feed(self):
+    # Posts without an image show the placeholder without a request for it.
+    cache.clear()
+    other = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = self.group,
+      viewed_by = 'all',
+    )
+    response = self.client.get(reverse('story:index'))
+    self.assertContains(response, self.url)
+    self.assertNotContains(
+      response,
+      reverse('story:post_thumbnail', kwargs={'pk': other.id})
+    )
+    self.assertContains(response, static(derivatives.PLACEHOLDER))
+
+  def test_not_an_image(self):
+    self.post.file.save('story.txt', ContentFile(b'text'))
+    self.assertIsNone(derivatives.schedule(self.post))
@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Comment, Post
+
+class ExportTests(TestCase):
+  """
+  The posts known by a group are exported with their comments and files,
+  without the posts the exporting user cannot view.
+  """
+  def setUp(self):
+    self.media_root = tempfile.mkdtemp()
+    self.settings = override_settings(MEDIA_ROOT=self.media_root)
+    self.settings.enable()
+
+    self.user = User.objects.create(username='user')
+    self.group = Group.objects.create(name='group')
+    self.other = Group.objects.create(name='other')
+    self.group.user_set.add(self.user)
+
+    self.public = self.add_post('Public story', 'all')
+    self.public.file.save('story.txt', ContentFile(b'once upon a time'))
+    self.private = self.add_post('Private story', 'some', [self.group])
+    self.hidden = self.add_post('Hidden story', 'some', [self.other])
+    Comment.objects.create(
+      post = self.public,
+      poster = self.user,
+      text = 'A comment',
+      date_posted = timezone.now(),
+    )
+    self.url = reverse('story:export_group', kwargs={'pk': self.group.id})
+    self.client.force_login(self.user)
+
+  def tearDown(self):
+    self.settings.disable()
+    shutil.rmtree(self.media_root)
+
+  def add_post(self, description, viewed_by, viewers=()):
+    post = Post.objects.create(
+      description = description,
+      knower = self.group,
+      viewed_by = viewed_by,
+      date_posted = timezone.now(),
+    )
+    post.viewers.add(*viewers)
+    return post
+
+  def read_records(self, data):
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+  def test_ndjson(self):
+    response = self.client.get(self.url)
+    self.assertTrue(response.streaming)
+    records = self.read_records(b''.join(response.streaming_content))
+    self.assertEqual(
+      [record['description'] for record in records],
+      ['Public story', 'Private story']
+    )
+    self.assertEqual(records[0]['comments'][0]['text'], 'A comment')
+    self.assertEqual(records[1]['viewers'], ['group'])
+
+  def test_zip(self):
+    response = self.client.get(self.url, {'format': 'zip'})
+    data = b''.join(response.streaming_content)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+      records = self.read_records(archive.read('posts.ndjson'))
+      self.assertEqual(len(records), 2)
+      self.assertEqual(
+        archive.read(records[0]['file']),
+        b'once upon a time'
+      )
+
+  def test_zip_missing_file(self):
+    # A missing file is left out of a valid archive.
+    name = self.public.file.name
+    os.remove(self.public.file.path)
+    response = self.client.get(self.url, {'format': 'zip'})
+    data = b''.join(response.streaming_content)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+      self.assertIsNone(archive.testzip())
+      self.assertEqual(archive.namelist(), ['posts.ndjson'])
+      records = self.read_records(archive.read('posts.ndjson'))
+      self.assertIsNone(records[0]['file'])
+      self.assertEqual(
+        records[0]['missing_file'],
+        'files/%d/%s' % (self.public.id, os.path.basename(name))
+      )
+
+  def test_login_required(self):
+    self.client.logout()
+    self.assertEqual(self.client.get(self.url).status_code, 302)
+
+  def test_command(self):
+    output = os.path.join(self.media_root, 'export.ndjson')
+    call_command('export_group', 'group', output=output)
+    with open(output, 'rb') as f:
+      self.assertEqual(len(self.read_records(f.read())), 3)
+
+    call_command('export_group', 'group', output=output, user='user')
+    with open(output, 'rb') as f:
+      self.assertEqual(len(self.read_records(f.read())), 2)
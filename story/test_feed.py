@@ -0,0 +1,115 @@
+from io import StringIO
+
+import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post, FeedEntry
+from . import feed
+
+class FeedTests(TestCase):
+  """
+  The feed of a user holds exactly the posts the user is allowed to view.
+  """
+  def setUp(self):
+    self.user1 = User.objects.create(username='user1')
+    self.user2 = User.objects.create(username='user2')
+
+    self.group1 = Group.objects.create(name='group1')
+    self.group1.user_set.add(self.user1)
+
+    self.group2 = Group.objects.create(name='group2')
+    self.group2.user_set.add(self.user2)
+
+  def add_post(self, viewed_by, viewers=()):
+    post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = self.group1,
+      viewed_by = viewed_by,
+    )
+    post.viewers.add(*viewers)
+    return post
+
+  def feed_ids(self, user):
+    return set(p.id for p in feed.get_feed(user))
+
+  def assertConsistent(self, *users):
+    for user in users:
+      self.assertEqual(feed.check_user_feed(user), (set(), set()))
+
+  def test_public_post(self):
+    post = self.add_post('all')
+    self.assertEqual(self.feed_ids(self.user1), {post.id})
+    self.assertEqual(self.feed_ids(self.user2), {post.id})
+
+    # Users registered later also see public posts.
+    user3 = User.objects.create(username='user3')
+    self.assertEqual(self.feed_ids(user3), {post.id})
+
+  def test_private_post_viewers(self):
+    post = self.add_post('some', [self.group1])
+    self.assertEqual(self.feed_ids(self.user1), {post.id})
+    self.assertEqual(self.feed_ids(self.user2), set())
+
+    post.viewers.add(self.group2)
+    self.assertEqual(self.feed_ids(self.user2), {post.id})
+
+    post.viewers.remove(self.group1)
+    self.assertEqual(self.feed_ids(self.user1), set())
+
+    self.group2.views.clear()
+    self.assertEqual(self.feed_ids(self.user2), set())
+    self.assertConsistent(self.user1, self.user2)
+
+  def test_visibility_change(self):
+    post = self.add_post('some', [self.group1])
+    post.viewed_by = 'all'
+    post.save()
+    self.assertEqual(self.feed_ids(self.user2), {post.id})
+
+    post.viewed_by = 'some'
+    post.save()
+    self.assertEqual(self.feed_ids(self.user2), set())
+    self.assertConsistent(self.user1, self.user2)
+
+  def test_edit(self):
+    post = self.add_post('all')
+    post.description = 'Edited'
+    # Editing the text of a post does not read its audience again.
+    with mock.patch.object(feed, 'fan_out_post') as fan_out_post:
+      post.save()
+    fan_out_post.assert_not_called()
+    self.assertEqual(self.feed_ids(self.user2), {post.id})
+
+  def test_membership_change(self):
+    post = self.add_post('some', [self.group1])
+    self.user2.groups.add(self.group1)
+    self.assertEqual(self.feed_ids(self.user2), {post.id})
+
+    self.group1.user_set.clear()
+    self.assertEqual(self.feed_ids(self.user1), set())
+    self.assertEqual(self.feed_ids(self.user2), set())
+
+    self.user1.groups.add(self.group1)
+    self.group1.delete()
+    self.assertEqual(self.feed_ids(self.user1), set())
+    self.assertConsistent(self.user1, self.user2)
+
+  def test_feed_order(self):
+    posts = [self.add_post('all') for i in range(3)]
+    ordered = list(feed.get_feed(self.user1))
+    self.assertEqual(ordered, posts[::-1])
+
+  def test_rebuild_command(self):
+    post = self.add_post('some', [self.group1])
+    FeedEntry.objects.all().delete()
+    with self.assertRaises(CommandError):
+      call_command('rebuild_feed', check=True, stdout=StringIO())
+
+    call_command('rebuild_feed', stdout=StringIO())
+    self.assertEqual(self.feed_ids(self.user1), {post.id})
+    self.assertConsistent(self.user1, self.user2)
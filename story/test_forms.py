@@ -11,7 +11,7 @@ import requests
 
 from django.contrib.auth.models import User, Group
 from .models import UserProfile, Post, Comment
-from .forms import PostForm
+from .forms import PostForm, AddUserToGroupForm
 
 class PostFormTest(TestCase):
   def setUp(self):
@@ -46,3 +46,28 @@ class PostFormTest(TestCase):
     }
     form = PostForm(data=data)
     self.assertTrue(form.is_valid())
+
+class AddUserToGroupFormTest(TestCase):
+  def setUp(self):
+    self.member = User.objects.create(username='member')
+    self.user = User.objects.create(username='user')
+    self.group = Group.objects.create(name='group')
+    self.group.user_set.add(self.member)
+
+  def test_user_id(self):
+    """
+    The joining user is given by id, and cannot already be a member.
+    """
+    form = AddUserToGroupForm({'joining_user': self.user.id}, group=self.group)
+    self.assertTrue(form.is_valid())
+    self.assertEqual(form.cleaned_data['joining_user'], self.user)
+
+    form = AddUserToGroupForm({'joining_user': self.member.id},
+                              group=self.group)
+    self.assertFalse(form.is_valid())
+
+  def test_no_user_list(self):
+    """
+    The form does not list the users.
+    """
+    self.assertNotIn('member', str(AddUserToGroupForm(group=self.group)))
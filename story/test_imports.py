@@ -0,0 +1,155 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from django.contrib.auth.models import User, Group
+from .models import UserProfile, Post
+from . import feed, imports
+
+def ndjson(*records):
+  return [json.dumps(record) + '\n' for record in records]
+
+class ImportTests(TestCase):
+  """
+  Users, groups, profiles and posts are imported in bulk from NDJSON.
+  """
+  def setUp(self):
+    self.existing = User.objects.create(username='existing')
+    self.records = ndjson(
+      {'model': 'group', 'name': 'readers'},
+      {'model': 'user', 'username': 'alice', 'groups': ['readers'],
+       'password': make_password('secret')},
+      {'model': 'user', 'username': 'bob'},
+      {'model': 'profile', 'username': 'alice', 'name': 'Alice',
+       'dob': '1990-01-01T00:00:00'},
+      {'model': 'post', 'description': 'A public story', 'knower': 'readers',
+       'poster': 'alice', 'date_posted': '2019-06-01T12:00:00Z'},
+      {'model': 'post', 'description': 'A private story', 'knower': 'readers',
+       'viewed_by': 'some', 'viewers': ['readers'],
+       'date_posted': '2019-06-02T12:00:00Z'},
+    )
+
+  def test_import(self):
+    # Records refer to rows in the same chunk and in earlier chunks.
+    for batch_size in (2, 100):
+      with self.subTest(batch_size=batch_size):
+        totals = imports.import_records(self.records, batch_size)
+        self.assertEqual(
+          totals,
+          {'group': 1, 'user': 2, 'profile': 1, 'post': 2}
+        )
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('secret'))
+        self.assertFalse(
+          User.objects.get(username='bob').has_usable_password()
+        )
+        self.assertEqual(alice.userprofile.name, 'Alice')
+        self.assertEqual(
+          list(alice.groups.values_list('name', flat=True)),
+          ['readers']
+        )
+        self.assertEqual(
+          Group.objects.get(name='readers').profile.member_count,
+          1
+        )
+        private = Post.objects.get(description='A private story')
+        self.assertEqual(
+          list(private.viewers.values_list('name', flat=True)),
+          ['readers']
+        )
+
+        # The feeds of new and existing users include the imported posts.
+        for user in User.objects.all():
+          self.assertEqual(feed.check_user_feed(user), (set(), set()))
+        self.assertEqual(len(feed.get_feed(alice)), 2)
+        self.assertEqual(len(feed.get_feed(self.existing)), 1)
+
+        Post.objects.all().delete()
+        UserProfile.objects.all().delete()
+        User.objects.exclude(pk=self.existing.pk).delete()
+        Group.objects.all().delete()
+
+  def test_fan_out(self):
+    # The posts of a chunk are fanned out together, not one at a time.
+    records = [
+      {'model': 'post', 'description': 'Story %d' % i, 'knower': 'readers',
+       'viewed_by': ('all', 'some')[i % 2], 'viewers': ['readers'],
+       'date_posted': '2019-06-01T12:00:%02dZ' % i}
+      for i in range(6)
+    ]
+    imports.import_records(self.records)
+    with mock.patch.object(feed, 'fan_out_post') as fan_out_post:
+      imports.import_records(ndjson(*records))
+    fan_out_post.assert_not_called()
+    for user in User.objects.all():
+      self.assertEqual(feed.check_user_feed(user), (set(), set()))
+    self.assertEqual(
+      len(feed.get_feed(User.objects.get(username='alice'))),
+      8
+    )
+    self.assertEqual(len(feed.get_feed(self.existing)), 4)
+
+  def test_existing_rows(self):
+    imports.import_records(self.records)
+    totals = imports.import_records(self.records)
+    self.assertEqual(totals, {'group': 0, 'user': 0, 'profile': 0, 'post': 0})
+    self.assertEqual(Post.objects.count(), 2)
+
+  def test_source_ids(self):
+    # Posts are skipped by the id they were exported with, whatever else
+    # changed, and within a chunk.
+    records = ndjson(
+      {'model': 'group', 'name': 'writers'},
+      {'model': 'post', 'id': 7, 'description': 'First', 'knower': 'writers',
+       'date_posted': '2019-06-01T12:00:00Z'},
+      {'model': 'post', 'id': 8, 'description': 'Second', 'knower': 'writers',
+       'viewed_by': 'some', 'viewers': ['writers'],
+       'date_posted': '2019-06-02T12:00:00Z'},
+      {'model': 'post', 'id': 7, 'description': 'Again', 'knower': 'writers',
+       'date_posted': '2019-06-01T12:00:00Z'},
+    )
+    self.assertEqual(imports.import_records(records)['post'], 2)
+    self.assertEqual(imports.import_records(records)['post'], 0)
+    second = Post.objects.get(source_id='8')
+    self.assertEqual(second.description, 'Second')
+    self.assertEqual(
+      list(second.viewers.values_list('name', flat=True)),
+      ['writers']
+    )
+    self.assertFalse(Post.objects.filter(description='Again').exists())
+
+  def test_plain_password(self):
+    records = ndjson({'model': 'user', 'username': 'eve', 'password': 'x'})
+    with self.assertRaises(imports.InvalidRecord):
+      imports.import_records(records)
+
+  def test_invalid_record(self):
+    # The chunks before the invalid record stay imported.
+    records = self.records + ndjson({'model': 'post', 'knower': 'nobody',
+                                     'date_posted': '2019-06-03T12:00:00Z'})
+    with self.assertRaisesMessage(imports.InvalidRecord, 'Line 7'):
+      imports.import_records(records, batch_size=4)
+    self.assertTrue(User.objects.filter(username='alice').exists())
+    self.assertFalse(Post.objects.exists())
+
+  def test_command(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.ndjson',
+                                     delete=False) as f:
+      f.writelines(self.records)
+    self.addCleanup(os.remove, f.name)
+
+    out = StringIO()
+    call_command('import_yarns', f.name, stdout=out)
+    self.assertIn('2 posts', out.getvalue())
+    self.assertIn('rows/sec', out.getvalue())
+
+    with self.assertRaises(CommandError):
+      call_command('import_yarns', f.name + '.missing', stdout=out)
@@ -0,0 +1,235 @@
+import contextlib
+import datetime
+import threading
+from io import StringIO
+
+import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Job, Post, FeedEntry
+from . import bus, jobs
+
+ran = []
+
+@jobs.task('test.record')
+def record(value):
+  ran.append(value)
+
+@jobs.task('test.fail')
+def fail():
+  raise ValueError('Failed')
+
+class JobTests(TestCase):
+  """
+  Jobs are claimed once, run by priority, and retried with backoff.
+  """
+  def setUp(self):
+    del ran[:]
+
+  def test_enqueue(self):
+    job = jobs.enqueue('test.record', 1, delay=60)
+    self.assertEqual(job.status, 'queued')
+    self.assertEqual(job.args, '[1]')
+    with self.assertRaises(KeyError):
+      jobs.enqueue('test.unknown')
+
+  def test_claim(self):
+    jobs.enqueue('test.record', 'later', delay=60)
+    low = jobs.enqueue('test.record', 'low')
+    high = jobs.enqueue('test.record', 'high', priority=5)
+
+    # Jobs that are not due yet are not claimed.
+    self.assertEqual(jobs.claim('first', 10), [high.id, low.id])
+    self.assertEqual(jobs.claim('second', 10), [])
+    self.assertEqual(Job.objects.get(id=high.id).claimed_by, 'first')
+
+  def test_requeue_stale(self):
+    job = jobs.enqueue('test.record', 1)
+    jobs.claim('worker', 1)
+    self.assertEqual(jobs.requeue_stale(600), 0)
+    stale = timezone.now() - datetime.timedelta(seconds=601)
+    Job.objects.filter(id=job.id).update(claimed_at=stale, heartbeat_at=stale)
+
+    # A job that runs long is kept while its worker records heartbeats.
+    self.assertEqual(jobs.heartbeat('worker'), 1)
+    self.assertEqual(jobs.requeue_stale(600), 0)
+
+    Job.objects.filter(id=job.id).update(heartbeat_at=stale)
+    self.assertEqual(jobs.requeue_stale(600), 1)
+    self.assertEqual(jobs.claim('other', 1), [job.id])
+    job.refresh_from_db()
+    self.assertEqual(job.attempts, 1)
+
+  def test_lost_worker(self):
+    # A job whose worker keeps dying fails once it has no attempts left.
+    job = jobs.enqueue('test.record', 1, max_attempts=2)
+    stale = timezone.now() - datetime.timedelta(seconds=601)
+    for status in ('queued', 'failed'):
+      self.assertEqual(jobs.claim('worker', 1), [job.id])
+      Job.objects.filter(id=job.id).update(heartbeat_at=stale)
+      self.assertEqual(jobs.requeue_stale(600), 1)
+      job.refresh_from_db()
+      self.assertEqual(job.status, status)
+    self.assertEqual(job.attempts, 2)
+    self.assertIn('lost', job.last_error)
+    self.assertIsNotNone(job.finished_at)
+    self.assertEqual(jobs.claim('worker', 1), [])
+
+  def test_run(self):
+    job = jobs.enqueue('test.record', 'value')
+    succeeded, wait_time, duration = jobs.run_job(job.id)
+    self.assertTrue(succeeded)
+    self.assertEqual(ran, ['value'])
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.attempts), ('done', 1))
+
+  def test_retry(self):
+    job = jobs.enqueue('test.fail', max_attempts=2)
+
+    before = timezone.now()
+    with self.assertLogs('story.jobs', 'WARNING'):
+      self.assertFalse(jobs.run_job(job.id)[0])
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.attempts), ('queued', 1))
+    self.assertIn('ValueError', job.last_error)
+    self.assertGreaterEqual(
+      job.run_at,
+      before + datetime.timedelta(seconds=jobs.BACKOFF_SECONDS)
+    )
+
+    with self.assertLogs('story.jobs', 'WARNING'):
+      self.assertFalse(jobs.run_job(job.id)[0])
+    job.refresh_from_db()
+    self.assertEqual((job.status, job.attempts), ('failed', 2))
+    self.assertIsNotNone(job.finished_at)
+
+  def test_backoff(self):
+    self.assertEqual(
+      [jobs.backoff(attempts) for attempts in (1, 2, 3)],
+      [jobs.BACKOFF_SECONDS, 2 * jobs.BACKOFF_SECONDS, 4 * jobs.BACKOFF_SECONDS]
+    )
+    self.assertEqual(jobs.backoff(100), jobs.MAX_BACKOFF_SECONDS)
+
+  @override_settings(STORY_BACKGROUND_JOBS=True)
+  def test_background_fan_out(self):
+    user = User.objects.create(username='reader')
+    post = Post.objects.create(
+      description='Queued',
+      knower=Group.objects.create(name='knowers'),
+      viewed_by='all',
+      date_posted=timezone.now()
+    )
+    self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+    self.client.force_login(user)
+    response = self.client.get(reverse('story:index'))
+    self.assertNotContains(response, 'Queued')
+
+    job = Job.objects.get(name='story.fan_out_post')
+    self.assertTrue(jobs.run_job(job.id)[0])
+    self.assertTrue(FeedEntry.objects.filter(post=post, user=user).exists())
+    # The feed cached before the job ran is dropped.
+    response = self.client.get(
+      reverse('story:index'),
+      HTTP_IF_NONE_MATCH=response['ETag']
+    )
+    self.assertContains(response, 'Queued')
+
+@contextlib.contextmanager
+def serialized_queries():
+  """
+  Runs the queries of all threads one at a time, reading uncommitted data.
+
+  The test database is SQLite shared in memory, where a query fails rather
+  than waits while another connection writes, or has a read unfinished.
+  Jobs and claims still interleave between their queries, which run in
+  autocommit.
+  """
+  lock = threading.Lock()
+  execute = SQLiteCursorWrapper.execute
+  executemany = SQLiteCursorWrapper.executemany
+
+  def serialized(method):
+    def run(*args, **kwargs):
+      with lock:
+        return method(*args, **kwargs)
+    return run
+
+  def read_uncommitted(connection, value=1, **kwargs):
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA read_uncommitted = %d' % value)
+
+  read_uncommitted(connection)
+  connection_created.connect(read_uncommitted)
+  try:
+    with mock.patch.object(SQLiteCursorWrapper, 'execute',
+                           serialized(execute)), \
+         mock.patch.object(SQLiteCursorWrapper, 'executemany',
+                           serialized(executemany)):
+      yield
+  finally:
+    connection_created.disconnect(read_uncommitted)
+    read_uncommitted(connection, 0)
+
+class WorkerTests(TransactionTestCase):
+  """
+  Workers run every due job on their pool and report metrics.
+  """
+  def setUp(self):
+    del ran[:]
+
+  def test_burst(self):
+    for value in range(20):
+      jobs.enqueue('test.record', value)
+    jobs.enqueue('test.fail', max_attempts=1)
+
+    worker = jobs.Worker(concurrency=4, poll_interval=0.01)
+    with serialized_queries(), self.assertLogs('story.jobs', 'WARNING'):
+      worker.run(burst=True)
+    self.assertEqual(sorted(ran), list(range(20)))
+    summary = worker.metrics.summary()
+    self.assertEqual((summary['processed'], summary['failed']), (21, 1))
+    self.assertEqual(Job.objects.filter(status='done').count(), 20)
+
+  def test_workers(self):
+    # Workers claiming at once run each job exactly once.
+    for value in range(60):
+      jobs.enqueue('test.record', value)
+    workers = [jobs.Worker(concurrency=4, poll_interval=0.01)
+               for i in range(3)]
+    threads = [threading.Thread(target=worker.run, kwargs={'burst': True})
+               for worker in workers]
+    with serialized_queries():
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    self.assertEqual(sorted(ran), list(range(60)))
+    self.assertEqual(Job.objects.filter(status='done').count(), 60)
+    self.assertEqual(
+      sum(worker.metrics.summary()['processed'] for worker in workers),
+      60
+    )
+
+  def test_invalidations(self):
+    # Workers apply the invalidations of other processes before jobs read
+    # their caches.
+    jobs.enqueue('test.record', 1)
+    with mock.patch.object(bus, 'check') as check:
+      jobs.Worker(concurrency=1).run(burst=True)
+    self.assertEqual(ran, [1])
+    self.assertGreaterEqual(check.call_count, 2)
+
+  def test_command(self):
+    jobs.enqueue('test.record', 1)
+    out = StringIO()
+    call_command('run_workers', '--burst', stdout=out)
+    self.assertEqual(ran, [1])
+    self.assertIn('Ran 1 jobs, 0 failed', out.getvalue())
@@ -0,0 +1,164 @@
+import asyncio
+
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post
+from .testing import notify_inline
+from . import live
+
+@notify_inline
+class HubTests(TransactionTestCase):
+  """
+  New posts are sent to the subscriptions that can view them, with limits on
+  connections and queued events.
+  """
+  def setUp(self):
+    self.group = Group.objects.create(name='group')
+    self.other = Group.objects.create(name='other')
+    self.member = live.hub.subscribe([self.group.id])
+    self.anonymous = live.hub.subscribe([])
+    self.addCleanup(live.hub.unsubscribe, self.member)
+    self.addCleanup(live.hub.unsubscribe, self.anonymous)
+
+  def create_post(self, viewed_by):
+    # Posts are published once committed, so these tests run without a
+    # wrapping transaction.
+    post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = self.group,
+      viewed_by = viewed_by,
+    )
+    if viewed_by == 'some':
+      post.viewers.add(self.group)
+    return post
+
+  def test_publish(self):
+    public = self.create_post('all')
+    private = self.create_post('some')
+    self.assertEqual(
+      self.member.pop_all(),
+      live.format_event('post', {'id': public.id}, public.id)
+      + live.format_event('post', {'id': private.id}, private.id)
+    )
+    self.assertEqual(
+      self.anonymous.pop_all(),
+      live.format_event('post', {'id': public.id}, public.id)
+    )
+    self.assertFalse(self.anonymous.ready.is_set())
+
+  def test_public_viewers(self):
+    # Public posts are published once, when they are created.
+    post = self.create_post('all')
+    post.viewers.add(self.other)
+    self.assertEqual(
+      self.member.pop_all(),
+      live.format_event('post', {'id': post.id}, post.id)
+    )
+
+  def test_membership_change(self):
+    user = User.objects.create(username='user')
+    subscription = live.hub.subscribe([], user_id=user.id)
+    self.addCleanup(live.hub.unsubscribe, subscription)
+    user.groups.add(self.group)
+    self.assertTrue(subscription.closed)
+    self.assertNotIn(subscription, live.hub.subscriptions)
+    self.assertNotIn(user.id, live.hub.by_user)
+    self.assertFalse(self.member.closed)
+
+    # The stream ends, so that the client reconnects with its new groups.
+    self.assertEqual(list(live.stream(subscription)), [live.RETRY, b''])
+
+  @override_settings(STORY_LIVE_QUEUE_SIZE=2)
+  def test_overflow(self):
+    for post_id in range(3):
+      live.hub.publish(post_id, True)
+    self.assertEqual(self.member.pop_all(), live.format_event('reload'))
+    live.hub.publish(4, True)
+    self.assertIn(b'id: 4', self.member.pop_all())
+
+  def test_max_connections(self):
+    with self.settings(STORY_LIVE_MAX_CONNECTIONS=len(live.hub)):
+      self.assertIsNone(live.hub.subscribe([]))
+    live.hub.unsubscribe(self.member)
+    self.assertNotIn(self.member, live.hub.by_group.get(self.group.id, ()))
+
+@override_settings(STORY_LIVE_FEED=True)
+class LiveFeedViewTest(TransactionTestCase):
+  """
+  The live feed streams events over WSGI, and over ASGI without a thread,
+  when STORY_LIVE_FEED is on.
+  """
+  def setUp(self):
+    self.user = User.objects.create_user(username='user', password='secret')
+    self.group = Group.objects.create(name='group')
+    self.user.groups.add(self.group)
+
+  def test_index(self):
+    response = self.client.get(reverse('story:index'))
+    self.assertContains(response, reverse('story:live_feed'))
+    self.assertContains(response, 'live.js')
+
+  @override_settings(STORY_LIVE_FEED=False)
+  def test_off(self):
+    response = self.client.get(reverse('story:index'))
+    self.assertNotContains(response, reverse('story:live_feed'))
+    self.assertNotContains(response, 'live.js')
+    response = self.client.get(reverse('story:live_feed'))
+    self.assertEqual(response.status_code, 404)
+
+  @override_settings(STORY_LIVE_HEARTBEAT=0.01, STORY_LIVE_MAX_SECONDS=0.05)
+  def test_wsgi(self):
+    self.client.force_login(self.user)
+    response = self.client.get(reverse('story:live_feed'))
+    self.assertEqual(response['Content-Type'], 'text/event-stream')
+    chunks = iter(response.streaming_content)
+    self.assertEqual(next(chunks), live.RETRY)
+    self.assertEqual(len(live.hub), 1)
+
+    live.hub.publish(7, False, [self.group.id])
+    self.assertIn(b'id: 7', next(chunks))
+    self.assertIn(live.HEARTBEAT, list(chunks))
+    self.assertEqual(len(live.hub), 0)
+
+  @override_settings(STORY_LIVE_HEARTBEAT=0.01)
+  def test_asgi(self):
+    self.client.force_login(self.user)
+    cookie = '%s=%s' % (
+      'sessionid',
+      self.client.cookies['sessionid'].value
+    )
+    scope = {
+      'type': 'http',
+      'path': live.PATH,
+      'headers': [(b'cookie', cookie.encode())],
+    }
+    sent = []
+
+    async def run():
+      disconnected = asyncio.Event()
+
+      async def receive():
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+      async def send(message):
+        sent.append(message)
+        if message.get('body') == live.RETRY:
+          # Published from another thread, as a post saved by a view is.
+          loop = asyncio.get_running_loop()
+          await loop.run_in_executor(
+            None,
+            live.hub.publish, 8, False, [self.group.id]
+          )
+        elif b'id: 8' in message.get('body', b''):
+          disconnected.set()
+
+      await live.LiveApplication()(scope, receive, send)
+
+    asyncio.run(run())
+    self.assertEqual(sent[0]['status'], 200)
+    self.assertTrue(any(b'id: 8' in m.get('body', b'') for m in sent))
+    self.assertEqual(len(live.hub), 0)
@@ -0,0 +1,133 @@
+import os
+import tempfile
+from io import StringIO
+
+import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models.signals import m2m_changed
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post, GroupProfile
+from . import feed, membership
+
+class BulkMembershipTests(TestCase):
+  """
+  Many users are added to or removed from a group at once, with one
+  membership change sent for all of them.
+  """
+  def setUp(self):
+    self.group = Group.objects.create(name='group')
+    self.other = Group.objects.create(name='other')
+    self.users = [User.objects.create(username='user%d' % i) for i in range(20)]
+    self.user_ids = set(user.id for user in self.users)
+    self.post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = self.group,
+      viewed_by = 'some',
+    )
+    self.post.viewers.add(self.group, self.other)
+
+  def assertConsistent(self):
+    # Fresh objects, as group ids are memoized on the user.
+    for user in User.objects.filter(id__in=self.user_ids):
+      self.assertEqual(feed.check_user_feed(user), (set(), set()))
+
+  def test_parse_users(self):
+    lines = ['username,name', 'alice,Alice', '12', '', ' bob ']
+    self.assertEqual(
+      membership.parse_users(lines),
+      (set(), {'alice', '12', 'bob'})
+    )
+    self.assertEqual(
+      membership.parse_users(['12', 'username', '34'], 'id'),
+      ({12}, {'34'})
+    )
+    with self.assertRaises(ValueError):
+      membership.parse_users(['id', 'alice'])
+
+  def test_resolve_users(self):
+    user_ids, unknown = membership.resolve_users(
+      {self.users[0].id, 999999},
+      {'user1', 'nobody'}
+    )
+    self.assertEqual(user_ids, {self.users[0].id, self.users[1].id})
+    self.assertEqual(unknown, {999999, 'nobody'})
+
+  def test_add_and_remove(self):
+    receiver = mock.Mock()
+    m2m_changed.connect(receiver, sender=User.groups.through)
+    self.addCleanup(m2m_changed.disconnect, receiver,
+                    sender=User.groups.through)
+
+    self.users[0].groups.add(self.group)
+    receiver.reset_mock()
+    added = membership.add_members(self.group, self.user_ids)
+    self.assertEqual(added, self.user_ids - {self.users[0].id})
+    self.assertEqual(
+      [call[1]['action'] for call in receiver.call_args_list],
+      ['pre_add', 'post_add']
+    )
+    self.assertEqual(self.group.user_set.count(), 20)
+    self.assertEqual(self.group.profile.member_count, 20)
+    self.assertConsistent()
+
+    # Users who also view the post through another group keep it.
+    self.users[1].groups.add(self.other)
+    removed = membership.remove_members(self.group, self.user_ids)
+    self.assertEqual(removed, self.user_ids)
+    self.assertEqual(GroupProfile.objects.get(group=self.group).member_count, 0)
+    self.assertConsistent()
+    self.assertEqual(len(feed.get_feed(self.users[1])), 1)
+    self.assertEqual(len(feed.get_feed(self.users[2])), 0)
+
+  def test_view(self):
+    self.users[0].groups.add(self.group)
+    self.client.force_login(self.users[0])
+    url = reverse('story:bulk_group_members', kwargs={'pk': self.group.id})
+    response = self.client.post(url, {
+      'action': 'add',
+      'users': 'user1\nuser2',
+      'file': SimpleUploadedFile('users.csv', b'id\n%d\n' % self.users[3].id),
+    })
+    self.assertEqual(response.status_code, 302)
+    self.assertEqual(
+      set(self.group.user_set.values_list('username', flat=True)),
+      {'user0', 'user1', 'user2', 'user3'}
+    )
+
+    response = self.client.post(url, {'action': 'add', 'users': 'nobody'})
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('nobody', str(response.context['form'].errors))
+
+    response = self.client.post(url, {
+      'action': 'remove',
+      'column': 'id',
+      'users': 'user1',
+    })
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('user1', str(response.context['form'].errors))
+
+  def test_view_requires_membership(self):
+    self.client.force_login(self.users[0])
+    url = reverse('story:bulk_group_members', kwargs={'pk': self.group.id})
+    response = self.client.post(url, {'action': 'add', 'users': 'user0'})
+    self.assertEqual(response.status_code, 403)
+    self.assertFalse(self.group.user_set.exists())
+
+  def test_command(self):
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+      f.write('username\nuser1\nuser2\n')
+    self.addCleanup(os.remove, f.name)
+
+    out = StringIO()
+    call_command('group_members', 'group', 'add', f.name, stdout=out)
+    self.assertIn('Added 2 users', out.getvalue())
+    call_command('group_members', 'group', 'remove', f.name, stdout=out)
+    self.assertIn('Removed 2 users', out.getvalue())
+    with self.assertRaises(CommandError):
+      call_command('group_members', 'nogroup', 'add', f.name, stdout=out)
@@ -1,16 +1,18 @@
 from django.core.files import File
 from django.db.utils import IntegrityError
 from django.http import HttpResponse, HttpResponseRedirect
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
 import datetime
 import mock
 import requests
+import shutil
+import tempfile
 
 from django.contrib.auth.models import User, Group
-from .models import UserProfile, Post, Comment
+from .models import UserProfile, Post, Comment, GroupProfile
 
 class UserProfileModelTests(TestCase):
   def setUp(self):
@@ -58,6 +60,14 @@ class PostModelTests(TestCase):
   def setUp(self):
     user1 = User.objects.create(username='user1')
     group1 = Group.objects.create(name='group1')
+    # Saved files are written to the storage.
+    self.media_root = tempfile.mkdtemp()
+    self.settings = override_settings(MEDIA_ROOT=self.media_root)
+    self.settings.enable()
+
+  def tearDown(self):
+    self.settings.disable()
+    shutil.rmtree(self.media_root)
 
   def test_attributes(self):
     """
@@ -116,3 +126,35 @@ class PostModelTests(TestCase):
       # Omit viewed_by
     )
     self.assertEqual(p.viewed_by, 'all')
+
+class GroupProfileModelTests(TestCase):
+  """
+  Each group has a profile with its number of members, kept up to date as
+  members join and leave.
+  """
+  def setUp(self):
+    self.group = Group.objects.create(name='group')
+    self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+
+  def member_count(self):
+    return GroupProfile.objects.get(group=self.group).member_count
+
+  def test_created(self):
+    self.assertEqual(self.member_count(), 0)
+
+  def test_add_and_remove(self):
+    self.group.user_set.add(*self.users)
+    self.assertEqual(self.member_count(), 3)
+    self.group.user_set.add(self.users[0])
+    self.assertEqual(self.member_count(), 3)
+    self.users[0].groups.remove(self.group)
+    self.assertEqual(self.member_count(), 2)
+    self.users[1].groups.clear()
+    self.assertEqual(self.member_count(), 1)
+    self.group.user_set.clear()
+    self.assertEqual(self.member_count(), 0)
+
+  def test_user_deleted(self):
+    self.group.user_set.add(*self.users)
+    self.users[0].delete()
+    self.assertEqual(self.member_count(), 2)
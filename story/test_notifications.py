@@ -0,0 +1,194 @@
+import mock
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post, Job, Notification, Inbox
+from . import bus, jobs, notifications
+
+@override_settings(STORY_BACKGROUND_JOBS=True)
+class NotificationTests(TestCase):
+  """
+  Members of the groups a private post is shared with are notified by a job,
+  and their unread counters follow their notifications.
+  """
+  def setUp(self):
+    self.knowers = Group.objects.create(name='knowers')
+    self.viewers = Group.objects.create(name='viewers')
+    self.poster = User.objects.create(username='poster')
+    self.reader = User.objects.create(username='reader')
+    self.knower = User.objects.create(username='knower')
+    self.outsider = User.objects.create(username='outsider')
+    self.poster.groups.add(self.knowers)
+    self.reader.groups.add(self.viewers, self.knowers)
+    self.knower.groups.add(self.knowers)
+
+  def create_post(self, viewed_by='some'):
+    post = Post.objects.create(
+      description = 'A story',
+      date_posted = timezone.now(),
+      knower = self.knowers,
+      poster = self.poster,
+      viewed_by = viewed_by,
+    )
+    post.viewers.add(self.viewers)
+    return post
+
+  def run_jobs(self):
+    for job_id in jobs.claim('test', 100):
+      self.assertTrue(jobs.run_job(job_id)[0])
+
+  def unread(self, user):
+    return notifications.get_unread_count(user)
+
+  def test_notify(self):
+    post = self.create_post()
+    # Nothing is written until the job runs.
+    self.assertFalse(Notification.objects.exists())
+    self.assertTrue(Job.objects.filter(name='story.notify_post').exists())
+
+    self.run_jobs()
+    self.assertEqual(
+      list(Notification.objects.values_list('user_id', 'post_id')),
+      [(self.reader.id, post.id)]
+    )
+    self.assertEqual(self.unread(self.reader), 1)
+    self.assertEqual(self.unread(self.poster), 0)
+    self.assertEqual(self.unread(self.outsider), 0)
+    # Members of the knower group who are not viewers cannot view the post.
+    self.assertEqual(self.unread(self.knower), 0)
+
+    # Saving the post again only notifies new viewers.
+    self.outsider.groups.add(self.viewers)
+    post.save()
+    self.run_jobs()
+    self.assertEqual(self.unread(self.reader), 1)
+    self.assertEqual(self.unread(self.outsider), 1)
+
+  def test_public_post(self):
+    self.create_post(viewed_by='all')
+    self.run_jobs()
+    self.assertFalse(Notification.objects.exists())
+
+  def test_batches(self):
+    users = [User.objects.create(username='user%d' % i) for i in range(7)]
+    self.viewers.user_set.add(*users)
+    post = self.create_post()
+    notifications.BATCH_SIZE, batch_size = 3, notifications.BATCH_SIZE
+    try:
+      self.assertEqual(notifications.notify_post(post.id), 8)
+    finally:
+      notifications.BATCH_SIZE = batch_size
+    self.assertEqual(Inbox.objects.filter(unread=1).count(), 8)
+
+  def test_mark_read(self):
+    first = self.create_post()
+    self.run_jobs()
+    notifications.mark_read(self.reader)
+    self.assertEqual(self.unread(self.reader), 0)
+
+    second = self.create_post()
+    self.run_jobs()
+    self.assertEqual(
+      [(n.post_id, n.unread)
+       for n in notifications.get_notifications(self.reader)],
+      [(second.id, True), (first.id, False)]
+    )
+
+    # Deleting a post takes its unread notifications off the counters.
+    second.delete()
+    self.assertEqual(self.unread(self.reader), 0)
+    first.delete()
+    self.assertEqual(self.unread(self.reader), 0)
+
+  def test_views(self):
+    self.create_post()
+    self.run_jobs()
+    url = reverse('story:unread_count_api')
+
+    response = self.client.get(url)
+    self.assertEqual(response.json(), {'unread': 0})
+
+    self.client.force_login(self.reader)
+    # Caught up with the invalidation bus, so that the request does not check
+    # it.
+    bus.check(force=True)
+    with self.assertNumQueries(3):
+      # The session, the user, then the counter.
+      response = self.client.get(url)
+    self.assertEqual(response.json(), {'unread': 1})
+    self.assertIn('no-cache', response['Cache-Control'])
+
+    response = self.client.get(reverse('story:notifications'))
+    self.assertContains(response, 'A story')
+    self.assertEqual(len(response.context['notifications']), 1)
+
+    self.client.post(reverse('story:notifications'))
+    self.assertEqual(self.client.get(url).json(), {'unread': 0})
+
+@override_settings(STORY_BACKGROUND_JOBS=False)
+class InlineNotificationTests(TransactionTestCase):
+  """
+  Without background jobs, viewers are notified by a thread of the process
+  once the post commits, after the request has returned.
+  """
+  def setUp(self):
+    self.viewers = Group.objects.create(name='viewers')
+    self.poster = User.objects.create(username='poster')
+    self.reader = User.objects.create(username='reader')
+    self.poster.groups.add(self.viewers)
+    self.reader.groups.add(self.viewers)
+
+  def test_notify(self):
+    with transaction.atomic():
+      post = Post.objects.create(
+        description = 'A story',
+        date_posted = timezone.now(),
+        knower = self.viewers,
+        poster = self.poster,
+        viewed_by = 'some',
+      )
+      post.viewers.add(self.viewers)
+      self.assertFalse(Notification.objects.exists())
+
+    # The thread notifies of one post at a time, in order.
+    notifications.get_executor().submit(lambda: None).result(timeout=30)
+    self.assertFalse(Job.objects.exists())
+    self.assertEqual(
+      list(Notification.objects.values_list('user_id', 'post_id')),
+      [(self.reader.id, post.id)]
+    )
+    self.assertEqual(notifications.get_unread_count(self.reader), 1)
+
+  def test_edit_post(self):
+    self.client.force_login(self.poster)
+    submitted = []
+    executor = mock.Mock()
+    executor.submit.side_effect = lambda *args: submitted.append(args)
+    with mock.patch.object(notifications, 'get_executor',
+                           return_value=executor):
+      response = self.client.post(reverse('story:upload_post'), {
+        'description': 'A story',
+        'knower': self.viewers.id,
+        'viewed_by': 'some',
+        'viewers': [self.viewers.id],
+      })
+    self.assertEqual(response.status_code, 302)
+    # The request returned before any notification was written.
+    self.assertFalse(Notification.objects.exists())
+
+    # Once when the post is saved, and once when its viewers are.
+    post = Post.objects.get()
+    self.assertEqual(
+      set(submitted),
+      {(notifications.notify_in_background, post.id)}
+    )
+    for function, post_id in submitted:
+      function(post_id)
+    self.assertEqual(
+      list(Notification.objects.values_list('user_id', 'post_id')),
+      [(self.reader.id, post.id)]
+    )
@@ -0,0 +1,123 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post, Comment, UserProfile
+from . import bus, objects
+
+class PostObjectCacheTests(TestCase):
+  """
+  Posts are read through a cache that holds what the post page and its
+  permission checks need, until the post, its viewers, its comments or a
+  profile change.
+  """
+  def setUp(self):
+    cache.clear()
+    self.knowers = Group.objects.create(name='knowers')
+    self.viewers = Group.objects.create(name='viewers')
+    self.poster = User.objects.create_user(username='poster',
+                                           password='secret')
+    self.poster.groups.add(self.viewers)
+    self.profile = UserProfile.objects.create(
+      user = self.poster,
+      name = 'Poster',
+      dob = timezone.now(),
+      date_joined = timezone.now(),
+    )
+    self.post = Post.objects.create(
+      description = 'A story',
+      date_posted = timezone.now(),
+      knower = self.knowers,
+      poster = self.poster,
+      viewed_by = 'some',
+    )
+    self.post.viewers.add(self.viewers)
+
+  def test_get_post(self):
+    with self.assertNumQueries(2):
+      post = objects.get_post(self.post.id)
+    with self.assertNumQueries(0):
+      post = objects.get_post(self.post.id)
+      self.assertEqual(post.description, 'A story')
+      self.assertEqual(post.knower.name, 'knowers')
+      self.assertEqual(post.poster.userprofile.name, 'Poster')
+      self.assertEqual(post._viewer_ids_cache, {self.viewers.id})
+    self.assertIsNone(objects.get_post(0))
+
+  def test_no_profile(self):
+    self.profile.delete()
+    post = objects.get_post(self.post.id)
+    with self.assertNumQueries(0):
+      self.assertFalse(hasattr(post.poster, 'userprofile'))
+
+  def test_invalidation(self):
+    objects.get_post(self.post.id)
+
+    self.post.description = 'Changed'
+    self.post.save()
+    self.assertEqual(objects.get_post(self.post.id).description, 'Changed')
+
+    self.post.viewers.add(self.knowers)
+    self.assertEqual(
+      objects.get_post(self.post.id)._viewer_ids_cache,
+      {self.viewers.id, self.knowers.id}
+    )
+
+    Comment.objects.create(post=self.post, poster=self.poster,
+                           date_posted=timezone.now())
+    self.assertEqual(objects.get_post(self.post.id).comment_count, 1)
+
+    self.profile.name = 'Renamed'
+    self.profile.save()
+    self.assertEqual(
+      objects.get_post(self.post.id).poster.userprofile.name,
+      'Renamed'
+    )
+
+    self.poster.username = 'renamed'
+    self.poster.save()
+    self.assertEqual(objects.get_post(self.post.id).poster.username, 'renamed')
+
+    self.knowers.name = 'renamed knowers'
+    self.knowers.save()
+    self.assertEqual(
+      objects.get_post(self.post.id).knower.name,
+      'renamed knowers'
+    )
+
+    post_id = self.post.id
+    self.post.delete()
+    self.assertIsNone(objects.get_post(post_id))
+
+  def test_login(self):
+    # Logging in saves only last_login, which cached posts do not show.
+    objects.get_post(self.post.id)
+    self.client.login(username='poster', password='secret')
+    with self.assertNumQueries(0):
+      objects.get_post(self.post.id)
+
+  def test_permissions(self):
+    post = objects.get_post(self.post.id)
+    user = User.objects.get(pk=self.poster.pk)
+    # Only the user's groups are read, not the viewers.
+    with self.assertNumQueries(1):
+      self.assertTrue(user.has_perm('story.view_post', post))
+    self.assertFalse(
+      User.objects.create(username='other').has_perm('story.view_post', post)
+    )
+
+  def test_post_view(self):
+    self.client.login(username='poster', password='secret')
+    url = reverse('story:post', kwargs={'pk': self.post.id})
+    self.client.get(url)
+
+    # The session, the user and their groups. The post and its rendered body
+    # come from the caches. The invalidation bus is caught up, so that the
+    # request does not check it.
+    bus.check(force=True)
+    with self.assertNumQueries(3):
+      response = self.client.get(url)
+    self.assertContains(response, 'A story')
+    self.assertContains(response, 'Poster')
@@ -0,0 +1,88 @@
+import time
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from .models import Post
+from .routers import PrimaryReplicaRouter, ReplicaMiddleware, PIN_COOKIE, \
+                     primary
+
+REPLICAS = ['replica1', 'replica2']
+
+@override_settings(STORY_REPLICAS=REPLICAS, STORY_REPLICA_PIN_SECONDS=5)
+class RouterTests(SimpleTestCase):
+  """
+  Safe requests read from the replicas until the client writes, after which
+  the client reads from the primary for a few seconds.
+  """
+  def setUp(self):
+    self.router = PrimaryReplicaRouter()
+    self.factory = RequestFactory()
+
+  def request(self, request, write=False):
+    """
+    Runs a view through the middleware, returning the database it read from
+    and the response.
+    """
+    databases = []
+
+    def view(request):
+      if write:
+        self.router.db_for_write(Post)
+      databases.append(self.router.db_for_read(Post))
+      return HttpResponse()
+
+    response = ReplicaMiddleware(view)(request)
+    return databases[0], response
+
+  def test_outside_request(self):
+    self.assertEqual(self.router.db_for_read(Post), 'default')
+    self.assertEqual(self.router.db_for_write(Post), 'default')
+
+  def test_read(self):
+    database, response = self.request(self.factory.get('/'))
+    self.assertIn(database, REPLICAS)
+    self.assertNotIn(PIN_COOKIE, response.cookies)
+    # The request is over, so reads go to the primary again.
+    self.assertEqual(self.router.db_for_read(Post), 'default')
+
+  def test_read_your_writes(self):
+    database, response = self.request(self.factory.get('/'), write=True)
+    self.assertEqual(database, 'default')
+    cookie = response.cookies[PIN_COOKIE]
+    self.assertEqual(cookie['max-age'], 5)
+
+    request = self.factory.get('/')
+    request.COOKIES[PIN_COOKIE] = cookie.value
+    self.assertEqual(self.request(request)[0], 'default')
+
+    request.COOKIES[PIN_COOKIE] = str(time.time() - 1)
+    self.assertIn(self.request(request)[0], REPLICAS)
+
+  def test_post(self):
+    database, response = self.request(self.factory.post('/'))
+    self.assertEqual(database, 'default')
+    self.assertIn(PIN_COOKIE, response.cookies)
+
+  def test_primary(self):
+    databases = []
+
+    def view(request):
+      with primary():
+        databases.append(self.router.db_for_read(Post))
+      databases.append(self.router.db_for_read(Post))
+      return HttpResponse()
+
+    ReplicaMiddleware(view)(self.factory.get('/'))
+    self.assertEqual(databases[0], 'default')
+    self.assertIn(databases[1], REPLICAS)
+
+  def test_allow_migrate(self):
+    self.assertIsNone(self.router.allow_migrate('default', 'story'))
+    self.assertFalse(self.router.allow_migrate('replica1', 'story'))
+
+  @override_settings(STORY_REPLICAS=[])
+  def test_no_replicas(self):
+    database, response = self.request(self.factory.post('/'), write=True)
+    self.assertEqual(database, 'default')
+    self.assertNotIn(PIN_COOKIE, response.cookies)
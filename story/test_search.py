@@ -0,0 +1,103 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .models import Post, Comment
+from .pagination import InvalidCursor
+from .search import search_posts, match_expression
+
+class SearchTests(TestCase):
+  """
+  Search finds the posts the user can view by their description or comments.
+  """
+  def setUp(self):
+    self.user = User.objects.create(username='user')
+    self.group1 = Group.objects.create(name='group1')
+    self.group1.user_set.add(self.user)
+    self.group2 = Group.objects.create(name='group2')
+
+  def add_post(self, description, viewers=None):
+    post = Post.objects.create(
+      description = description,
+      knower = self.group1,
+      viewed_by = 'some' if viewers else 'all',
+      date_posted = timezone.now(),
+    )
+    if viewers:
+      post.viewers.add(viewers)
+    return post
+
+  def test_match_expression(self):
+    self.assertEqual(match_expression('grand "mother" OR'), '"grand" "mother" "OR"')
+    self.assertEqual(match_expression('*'), '')
+
+  def test_description(self):
+    post = self.add_post('The river at night')
+    self.add_post('The mountain')
+    self.assertEqual(search_posts(self.user, 'river'), ([post], None))
+    self.assertEqual(search_posts(None, 'RIVER night'), ([post], None))
+    self.assertEqual(search_posts(self.user, 'sea'), ([], None))
+
+  def test_updates(self):
+    post = self.add_post('The river')
+    post.description = 'The sea'
+    post.save()
+    self.assertEqual(search_posts(self.user, 'river'), ([], None))
+    self.assertEqual(search_posts(self.user, 'sea'), ([post], None))
+
+    post.delete()
+    self.assertEqual(search_posts(self.user, 'sea'), ([], None))
+
+  def test_comments(self):
+    post = self.add_post('A story')
+    comment = Comment.objects.create(
+      post = post,
+      poster = self.user,
+      text = 'My grandmother told it too',
+      date_posted = timezone.now(),
+    )
+    self.assertEqual(search_posts(self.user, 'grandmother'), ([post], None))
+
+    comment.delete()
+    self.assertEqual(search_posts(self.user, 'grandmother'), ([], None))
+
+  def test_permissions(self):
+    mine = self.add_post('A secret', self.group1)
+    other = self.add_post('A secret', self.group2)
+    public = self.add_post('A secret')
+    self.assertEqual(
+      search_posts(self.user, 'secret'),
+      ([mine, public], None)
+    )
+    self.assertEqual(search_posts(None, 'secret'), ([public], None))
+    self.group1.user_set.remove(self.user)
+    self.user = User.objects.get(pk=self.user.pk)
+    self.assertEqual(search_posts(self.user, 'secret'), ([public], None))
+
+  def test_invalid_cursor(self):
+    self.add_post('river')
+    with self.assertRaises(InvalidCursor):
+      search_posts(self.user, 'river', after='invalid')
+    response = self.client.get(
+      reverse('story:search'),
+      {'q': 'river', 'after': 'invalid'}
+    )
+    self.assertEqual(response.status_code, 404)
+
+  def test_ranking_and_pages(self):
+    weak = self.add_post('river ' + 'words ' * 50)
+    strong = self.add_post('river river')
+    other = self.add_post('river and sea')
+
+    posts, cursor = search_posts(self.user, 'river', limit=2)
+    self.assertEqual(posts, [strong, other])
+    posts, cursor = search_posts(self.user, 'river', after=cursor, limit=2)
+    self.assertEqual(posts, [weak])
+    self.assertIsNone(cursor)
+
+  def test_view(self):
+    post = self.add_post('The river')
+    response = self.client.get(reverse('story:search'), {'q': 'river'})
+    self.assertEqual(response.context['results'], [post])
+    self.assertContains(response, 'The river')
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from django.contrib.auth.models import Group
+from .models import Post, Blob
+from .storage import blob_storage
+
+class ContentAddressedStorageTests(TransactionTestCase):
+  """
+  Uploaded files are stored once per distinct content and deleted with the
+  last post that uses them, once that is committed.
+  """
+  def setUp(self):
+    self.media_root = tempfile.mkdtemp()
+    self.settings = override_settings(MEDIA_ROOT=self.media_root)
+    self.settings.enable()
+    self.group = Group.objects.create(name='group')
+
+  def tearDown(self):
+    self.settings.disable()
+    shutil.rmtree(self.media_root)
+
+  def add_post(self, name, content):
+    post = Post(
+      date_posted = timezone.now(),
+      knower = self.group,
+      viewed_by = 'all',
+    )
+    post.file.save(name, ContentFile(content))
+    return post
+
+  def test_sharded_name(self):
+    post = self.add_post('story.txt', b'content')
+    digest = hashlib.sha256(b'content').hexdigest()
+    self.assertEqual(
+      post.file.name,
+      'blobs/%s/%s/%s.txt' % (digest[:2], digest[2:4], digest)
+    )
+    self.assertEqual(blob_storage.digest_of(post.file.name), digest)
+    with post.file.open('rb') as f:
+      self.assertEqual(f.read(), b'content')
+
+  def test_dedupe(self):
+    post1 = self.add_post('a.txt', b'same')
+    post2 = self.add_post('b.txt', b'same')
+    post3 = self.add_post('c.txt', b'different')
+
+    self.assertEqual(post1.file.name, post2.file.name)
+    self.assertNotEqual(post1.file.name, post3.file.name)
+    self.assertEqual(Blob.objects.get(name=post1.file.name).ref_count, 2)
+    self.assertEqual(Blob.objects.get(name=post3.file.name).ref_count, 1)
+
+    # Only the stored copies are left on disk.
+    tmp = os.path.join(self.media_root, 'blobs', 'tmp')
+    self.assertEqual(os.listdir(tmp), [])
+
+  def test_release(self):
+    post1 = self.add_post('a.txt', b'same')
+    post2 = self.add_post('b.txt', b'same')
+    name = post1.file.name
+
+    post1.delete()
+    self.assertTrue(blob_storage.exists(name))
+    self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+
+    # Replacing the file of a post releases the previous one.
+    post2.file.save('c.txt', ContentFile(b'different'))
+    self.assertFalse(blob_storage.exists(name))
+    self.assertFalse(Blob.objects.filter(name=name).exists())
+
+  def test_release_rolled_back(self):
+    post = self.add_post('a.txt', b'content')
+    name = post.file.name
+
+    class RolledBack(Exception):
+      pass
+    with self.assertRaises(RolledBack):
+      with transaction.atomic():
+        post.delete()
+        raise RolledBack()
+    self.assertTrue(blob_storage.exists(name))
+    self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+
+  def test_retain_after_release(self):
+    post = self.add_post('a.txt', b'content')
+    name = post.file.name
+    content = ContentFile(b'content')
+    self.assertEqual(blob_storage.save('b.txt', content), name)
+
+    # The last post using the file is deleted after the file was saved again
+    # for a new post, and before the new post counts its reference.
+    post.delete()
+    self.assertFalse(blob_storage.exists(name))
+    Blob.objects.retain(name, content)
+    self.assertTrue(blob_storage.exists(name))
+    self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
+    with blob_storage.open(name) as f:
+      self.assertEqual(f.read(), b'content')
+
+  def test_collect_after_retain(self):
+    post = self.add_post('a.txt', b'content')
+    name = post.file.name
+    with transaction.atomic():
+      post.delete()
+      # A reference counted before the release commits keeps the file.
+      Blob.objects.retain(name)
+    self.assertTrue(blob_storage.exists(name))
+    self.assertEqual(Blob.objects.get(name=name).ref_count, 1)
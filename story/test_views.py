@@ -1,17 +1,24 @@
+from django.core.cache import cache
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.db.utils import IntegrityError
 from django.http import HttpResponse, HttpResponseRedirect
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
 import datetime
 import mock
+import os
+import shutil
+import tempfile
 import time
 
 from .access import ObjectPermissionsBackend
 from django.contrib.auth.models import User, Group
-from .models import UserProfile, Post
+from .models import UserProfile, Post, Comment
+from .testing import QueryBudgetMixin
+from . import bus, instrumentation
 
 def login(client, user):
   client.force_login(user)
@@ -155,6 +162,7 @@ class IndexViewTest(TestCase):
   The user should have view permission to see each post.
   """
   def setUp(self):
+    cache.clear()
     self.url = reverse('story:index')
     self.user = User.objects.create(username='user')
     self.user2 = User.objects.create(username='user2')
@@ -218,12 +226,213 @@ class IndexViewTest(TestCase):
     posts = ObjectPermissionsBackend().get_viewable_posts(self.user2).order_by('-date_posted')[:5]
     self.assertEqual(str(posts), str(response_posts))
 
+  def test_pages(self):
+    posts = [self.add_post_viewed_by_some(i, self.group2) for i in range(7)]
+    login(self.client, self.user2)
+
+    response = self.client.get(self.url)
+    self.assertEqual(list(response.context['latest_post_list']), posts[:1:-1])
+    cursor = response.context['next_cursor']
+    self.assertIsNotNone(cursor)
+
+    response = self.client.get(self.url, {'before': cursor})
+    self.assertEqual(list(response.context['latest_post_list']), posts[1::-1])
+    self.assertIsNone(response.context['next_cursor'])
+
+  def test_invalid_cursor(self):
+    response = self.client.get(self.url, {'before': 'invalid'})
+    self.assertEqual(response.status_code, 404)
+
+  def test_feed_api(self):
+    posts = [self.add_post_viewed_by_all(i) for i in range(3)]
+    url = reverse('story:feed_api')
+
+    response = self.client.get(url, {'limit': 2})
+    data = response.json()
+    self.assertEqual([p['id'] for p in data['posts']], [posts[2].id, posts[1].id])
+
+    response = self.client.get(url, {'limit': 2, 'before': data['next']})
+    data = response.json()
+    self.assertEqual([p['id'] for p in data['posts']], [posts[0].id])
+    self.assertIsNone(data['next'])
+
+  def test_feed_api_limit(self):
+    posts = [self.add_post_viewed_by_all(i) for i in range(2)]
+    url = reverse('story:feed_api')
+
+    # Limits are clamped to at least one post.
+    for limit in (0, -3):
+      response = self.client.get(url, {'limit': limit})
+      self.assertEqual(response.status_code, 200)
+      data = response.json()
+      self.assertEqual([p['id'] for p in data['posts']], [posts[1].id])
+      self.assertIsNotNone(data['next'])
+
+    for limit in ('abc', '1.5', ''):
+      response = self.client.get(url, {'limit': limit})
+      self.assertEqual(response.status_code, 400)
+
+class FragmentCacheTest(TestCase):
+  """
+  Users with the same groups share the rendered feed and post pages until a
+  post they can see changes.
+  """
+  def setUp(self):
+    cache.clear()
+    self.url = reverse('story:index')
+    self.group1 = Group.objects.create(name='group1')
+    self.group2 = Group.objects.create(name='group2')
+    self.user1 = User.objects.create(username='user1')
+    self.user2 = User.objects.create(username='user2')
+    self.user3 = User.objects.create(username='user3')
+    self.group1.user_set.add(self.user1, self.user2)
+    self.group2.user_set.add(self.user3)
+    self.post = Post.objects.create(
+      description = 'Private story',
+      knower = self.group1,
+      viewed_by = 'some',
+      date_posted = timezone.now(),
+    )
+    self.post.viewers.add(self.group1)
+
+  def get_feed(self, user):
+    login(self.client, user)
+    return self.client.get(self.url)
+
+  def test_shared_by_audience(self):
+    response = self.get_feed(self.user1)
+    self.assertContains(response, 'Private story')
+
+    # The feed is not read again for a user in the same groups. The
+    # invalidation bus is caught up, so that the request does not check it.
+    login(self.client, self.user2)
+    bus.check(force=True)
+    with self.assertNumQueries(3):
+      response = self.client.get(self.url)
+    self.assertContains(response, 'Private story')
+
+    response = self.get_feed(self.user3)
+    self.assertNotContains(response, 'Private story')
+
+  def test_invalidated_by_post(self):
+    self.get_feed(self.user1)
+    self.post.description = 'Changed story'
+    self.post.save()
+    self.assertContains(self.get_feed(self.user1), 'Changed story')
+
+    Post.objects.create(
+      description = 'Public story',
+      knower = self.group2,
+      viewed_by = 'all',
+      date_posted = timezone.now(),
+    )
+    self.assertContains(self.get_feed(self.user1), 'Public story')
+
+    self.post.delete()
+    self.assertNotContains(self.get_feed(self.user1), 'Changed story')
+
+  def test_invalidated_by_viewers(self):
+    self.get_feed(self.user3)
+    self.post.viewers.add(self.group2)
+    self.assertContains(self.get_feed(self.user3), 'Private story')
+
+  def test_invalidated_by_membership(self):
+    self.get_feed(self.user3)
+    self.group1.user_set.add(self.user3)
+    self.assertContains(self.get_feed(self.user3), 'Private story')
+
+  def test_post_body(self):
+    url = reverse('story:post', kwargs={'pk':self.post.id})
+    login(self.client, self.user1)
+    self.client.get(url)
+    Comment.objects.create(
+      post = self.post,
+      poster = self.user1,
+      text = 'A new comment',
+      date_posted = timezone.now(),
+    )
+    self.assertContains(self.client.get(url), 'A new comment')
+
+class ConditionalGetTest(TestCase):
+  """
+  Repeat visits to the feed and post pages are answered with 304 Not Modified
+  until the page would change.
+  """
+  def setUp(self):
+    cache.clear()
+    self.group = Group.objects.create(name='group')
+    self.user1 = User.objects.create(username='user1')
+    self.user2 = User.objects.create(username='user2')
+    self.group.user_set.add(self.user1, self.user2)
+    self.post = Post.objects.create(
+      description = 'Private story',
+      knower = self.group,
+      viewed_by = 'some',
+      date_posted = timezone.now(),
+    )
+    self.post.viewers.add(self.group)
+    self.index_url = reverse('story:index')
+    self.post_url = reverse('story:post', kwargs={'pk':self.post.id})
+    login(self.client, self.user1)
+
+  def revalidate(self, url, response):
+    return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+  def test_feed(self):
+    response = self.client.get(self.index_url)
+    self.assertEqual(response.status_code, 200)
+    self.assertIn('no-cache', response['Cache-Control'])
+    self.assertIn('private', response['Cache-Control'])
+
+    # The session, the user and their groups are read, but not the feed.
+    # The invalidation bus is caught up, so that the request does not check it.
+    bus.check(force=True)
+    with self.assertNumQueries(3):
+      self.assertEqual(self.revalidate(self.index_url, response).status_code, 304)
+
+    self.post.description = 'Changed story'
+    self.post.save()
+    self.assertEqual(self.revalidate(self.index_url, response).status_code, 200)
+
+  def test_feed_per_user(self):
+    response = self.client.get(self.index_url)
+    login(self.client, self.user2)
+    self.assertEqual(self.revalidate(self.index_url, response).status_code, 200)
+
+  def test_post(self):
+    response = self.client.get(self.post_url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(self.revalidate(self.post_url, response).status_code, 304)
+
+    Comment.objects.create(
+      post = self.post,
+      poster = self.user1,
+      text = 'A new comment',
+      date_posted = timezone.now(),
+    )
+    response = self.revalidate(self.post_url, response)
+    self.assertContains(response, 'A new comment')
+
+    response = self.client.get(
+      self.post_url,
+      HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+    )
+    self.assertEqual(response.status_code, 304)
+
+  def test_post_groups_changed(self):
+    response = self.client.get(self.post_url)
+    self.group.user_set.remove(self.user1)
+    response = self.revalidate(self.post_url, response)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotContains(response, 'Private story')
+
 class PostViewTest(TestCase):
   """
   The user can view a post.
   Only users in the 'viewers' of a post can access this view.
   """
   def setUp(self):
+    cache.clear()
     self.url = reverse('story:post', kwargs={'pk':1})
     self.upload_url = reverse('story:upload_post')
     self.user = User.objects.create(username='user')
@@ -521,3 +730,334 @@ class UpdateProfileViewTest(TestCase):
 #     form = AddUserToGroupForm(initial={'user':request.user, 'group':group})
 #     context = {'form' : form, 'group' : group}
 #   return render(request, template_name, context)
+
+class DownloadPostFileViewTest(TestCase):
+  """
+  The file of a post can be downloaded by users that can view the post.
+  """
+  def setUp(self):
+    self.media_root = tempfile.mkdtemp()
+    self.settings = override_settings(MEDIA_ROOT=self.media_root)
+    self.settings.enable()
+
+    self.user = User.objects.create(username='user')
+    self.group1 = Group.objects.create(name='group1')
+    self.group1.user_set.add(self.user)
+    self.post = Post(
+      description = 'test_download',
+      knower = self.group1,
+      viewed_by = 'some',
+      date_posted = timezone.now()
+    )
+    self.post.file.save('story.mp3', ContentFile(b'0123456789'))
+    self.post.viewers.add(self.group1)
+    self.url = reverse('story:post_file', kwargs={'pk':self.post.id})
+
+  def tearDown(self):
+    self.settings.disable()
+    shutil.rmtree(self.media_root)
+
+  def test_unauthorised(self):
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 403)
+
+  def test_download(self):
+    login(self.client, self.user)
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+    self.assertEqual(response['Content-Type'], 'audio/mpeg')
+    self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    etag = response['ETag']
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, 304)
+
+  def test_range(self):
+    login(self.client, self.user)
+    response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(b''.join(response.streaming_content), b'2345')
+    self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+
+    response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+    self.assertEqual(b''.join(response.streaming_content), b'789')
+
+    response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+    self.assertEqual(response.status_code, 416)
+    self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    # A range for a different version of the file is ignored.
+    response = self.client.get(self.url, HTTP_RANGE='bytes=2-5',
+                               HTTP_IF_RANGE='"stale"')
+    self.assertEqual(response.status_code, 200)
+
+  def test_missing(self):
+    login(self.client, self.user)
+    os.remove(self.post.file.path)
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 404)
+
+  @override_settings(STORY_SENDFILE_HEADER='X-Accel-Redirect')
+  def test_sendfile(self):
+    login(self.client, self.user)
+    response = self.client.get(self.url)
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.content, b'')
+    self.assertEqual(
+      response['X-Accel-Redirect'],
+      '/protected/' + self.post.file.name
+    )
+
+class CommentViewTest(TestCase):
+  """
+  Users that can view a post can read and add comments on it.
+  """
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create(username='user')
+    self.group1 = Group.objects.create(name='group1')
+    self.group1.user_set.add(self.user)
+    self.post = Post.objects.create(
+      description = 'test_comments',
+      knower = self.group1,
+      viewed_by = 'some',
+      date_posted = timezone.now()
+    )
+    self.post.viewers.add(self.group1)
+    self.add_url = reverse('story:add_comment', kwargs={'pk':self.post.id})
+    self.api_url = reverse('story:comments_api', kwargs={'pk':self.post.id})
+
+  def test_add_comment(self):
+    login(self.client, self.user)
+    response = self.client.post(self.add_url, {'text': 'First.'})
+    self.assertEqual(response.status_code, HttpResponseRedirect.status_code)
+    self.assertEqual(response.url, reverse('story:post', kwargs={'pk':self.post.id}))
+
+    self.post.refresh_from_db()
+    self.assertEqual(self.post.comment_count, 1)
+    self.assertEqual(self.post.comments.get().text, 'First.')
+
+  def test_add_comment_unauthorised(self):
+    User.objects.create(username='user2')
+    login(self.client, User.objects.get(username='user2'))
+    self.client.post(self.add_url, {'text': 'First.'})
+    self.assertFalse(self.post.comments.exists())
+
+  def test_pages(self):
+    UserProfile.objects.create(
+      name = 'Name',
+      user = self.user,
+      dob = timezone.now(),
+      date_joined = timezone.now(),
+    )
+    for i in range(25):
+      Comment.objects.create(
+        post = self.post,
+        poster = self.user,
+        text = str(i),
+        date_posted = timezone.now(),
+      )
+    login(self.client, self.user)
+
+    response = self.client.get(reverse('story:post', kwargs={'pk':self.post.id}))
+    self.assertEqual(len(response.context['comments']), 20)
+    self.assertContains(response, 'Comments (25)')
+
+    # The session, user, the user's groups for the permission check and one
+    # query for the comments with their posters and profiles. The post comes
+    # from the object cache. The invalidation bus is caught up, so that the
+    # request does not check it.
+    bus.check(force=True)
+    with self.assertNumQueries(4):
+      response = self.client.get(self.api_url)
+    data = response.json()
+    self.assertEqual([c['text'] for c in data['comments']], [str(i) for i in range(20)])
+    self.assertEqual(data['comments'][0]['poster']['name'], 'Name')
+    self.assertEqual(data['count'], 25)
+
+    response = self.client.get(self.api_url, {'after': data['next']})
+    data = response.json()
+    self.assertEqual([c['text'] for c in data['comments']], [str(i) for i in range(20, 25)])
+    self.assertIsNone(data['next'])
+
+  def test_api_unauthorised(self):
+    response = self.client.get(self.api_url)
+    self.assertEqual(response.status_code, 403)
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+  """
+  The main views use a fixed number of queries however many posts, comments
+  and members they show.
+  """
+  budgets = {
+    'story:index': 4,
+    'story:post': 6,
+    'story:comments_api': 4,
+    'story:group_profile': 4,
+  }
+
+  def setUp(self):
+    cache.clear()
+    self.group = Group.objects.create(name='group')
+    self.user = User.objects.create(username='user')
+    for i in range(10):
+      member = User.objects.create(username='member%d' % i)
+      UserProfile.objects.create(
+        user = member,
+        name = 'Member %d' % i,
+        dob = timezone.now(),
+        date_joined = timezone.now(),
+      )
+      self.group.user_set.add(member)
+    self.group.user_set.add(self.user)
+    for i in range(10):
+      self.post = Post.objects.create(
+        description = 'Story %d' % i,
+        knower = self.group,
+        viewed_by = 'some',
+        date_posted = timezone.now(),
+      )
+      self.post.viewers.add(self.group)
+    for i in range(10):
+      Comment.objects.create(
+        post = self.post,
+        poster = self.user,
+        text = 'Comment %d' % i,
+        date_posted = timezone.now(),
+      )
+    login(self.client, self.user)
+
+  def get(self, view_name, **kwargs):
+    with self.assertQueryBudget(view_name, self.budgets[view_name]):
+      response = self.client.get(reverse(view_name, kwargs=kwargs))
+    self.assertEqual(response.status_code, 200)
+
+  def test_budgets(self):
+    self.get('story:index')
+    self.get('story:post', pk=self.post.id)
+    self.get('story:comments_api', pk=self.post.id)
+    self.get('story:group_profile', pk=self.group.id)
+
+  def test_over_budget(self):
+    with self.assertRaises(AssertionError):
+      with self.assertQueryBudget('story:index', 1):
+        self.client.get(reverse('story:index'))
+    with self.assertRaises(AssertionError):
+      with self.assertQueryBudget('story:index', 100):
+        pass
+
+  @override_settings(DEBUG=True)
+  def test_headers(self):
+    instrumentation.reset_totals()
+    response = self.client.get(reverse('story:index'))
+    self.assertIn('db;dur=', response['Server-Timing'])
+    self.assertIn('tpl;dur=', response['Server-Timing'])
+    totals = instrumentation.get_totals()['story:index']
+    self.assertEqual(totals['requests'], 1)
+    self.assertEqual(totals['queries'], int(response['X-Query-Count']))
+    self.assertGreater(totals['template_time'], 0)
+
+  def test_totals_api(self):
+    instrumentation.reset_totals()
+    self.client.get(reverse('story:index'))
+    url = reverse('story:instrumentation_api')
+    self.assertEqual(self.client.get(url).status_code, 403)
+
+    self.user.is_staff = True
+    self.user.save()
+    totals = self.client.get(url).json()['views']
+    self.assertEqual(totals['story:index']['requests'], 1)
+    # The requests to the endpoint are counted too.
+    self.assertEqual(totals['story:instrumentation_api']['requests'], 1)
+
+class GroupProfileViewTest(TestCase):
+  """
+  The members of a group are listed a page at a time, by name or newest
+  first.
+  """
+  def setUp(self):
+    self.group = Group.objects.create(name='group')
+    self.users = [
+      User.objects.create(username='user%02d' % i) for i in range(60)
+    ]
+    self.group.user_set.add(*self.users)
+    self.url = reverse('story:group_profile', kwargs={'pk': self.group.id})
+    login(self.client, self.users[0])
+
+  def usernames(self, response):
+    return [user.username for user in response.context['users']]
+
+  def test_pages(self):
+    response = self.client.get(self.url)
+    self.assertEqual(response.context['member_count'], 60)
+    self.assertEqual(self.usernames(response)[:2], ['user00', 'user01'])
+    self.assertEqual(len(response.context['users']), 50)
+
+    response = self.client.get(self.url, {
+      'after': response.context['next_cursor']
+    })
+    self.assertEqual(self.usernames(response)[0], 'user50')
+    self.assertIsNone(response.context['next_cursor'])
+
+  def test_newest(self):
+    response = self.client.get(self.url, {'sort': 'newest'})
+    self.assertEqual(self.usernames(response)[0], 'user59')
+    response = self.client.get(self.url, {
+      'sort': 'newest',
+      'after': response.context['next_cursor']
+    })
+    self.assertEqual(self.usernames(response)[-1], 'user00')
+
+  def test_invalid_cursor(self):
+    response = self.client.get(self.url, {'sort': 'newest', 'after': 'x'})
+    self.assertEqual(response.status_code, 404)
+    response = self.client.get(self.url, {'sort': 'other'})
+    self.assertEqual(response.status_code, 404)
+
+class AddGroupMemberViewTest(TestCase):
+  """
+  Users are found by the start of their username or name and added to a
+  group by id.
+  """
+  def setUp(self):
+    self.group = Group.objects.create(name='group')
+    self.user = User.objects.create(username='user')
+    self.group.user_set.add(self.user)
+    self.alice = User.objects.create(username='alice')
+    self.bob = User.objects.create(username='bob')
+    UserProfile.objects.create(
+      user = self.bob,
+      name = 'Alison',
+      dob = timezone.now(),
+      date_joined = timezone.now(),
+    )
+    self.albert = User.objects.create(username='Albert')
+    self.group.user_set.add(self.albert)
+    self.url = reverse('story:add_to_group', kwargs={'pk': self.group.id})
+    self.api_url = reverse('story:user_autocomplete',
+                           kwargs={'pk': self.group.id})
+    login(self.client, self.user)
+
+  def test_autocomplete(self):
+    response = self.client.get(self.api_url, {'q': 'Al'})
+    # Albert is already a member.
+    self.assertEqual(response.json(), {'users': [
+      {'id': self.alice.id, 'username': 'alice', 'name': 'alice'},
+      {'id': self.bob.id, 'username': 'bob', 'name': 'Alison'},
+    ]})
+    response = self.client.get(self.api_url, {'q': ''})
+    self.assertEqual(response.json(), {'users': []})
+
+  def test_add_member(self):
+    response = self.client.get(self.url)
+    self.assertNotContains(response, 'alice')
+
+    response = self.client.post(self.url, {'joining_user': self.alice.id})
+    self.assertEqual(response.status_code, HttpResponseRedirect.status_code)
+    self.assertIn(self.alice, self.group.user_set.all())
+
+    # Adding a member again shows the form with an error.
+    response = self.client.post(self.url, {'joining_user': self.alice.id})
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.context['form'].errors)
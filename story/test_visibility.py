@@ -0,0 +1,133 @@
+import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from django.contrib.auth.models import User, Group
+from .access import ObjectPermissionsBackend
+from .models import Post
+from .visibility import index, bitmap, BLOCK_BITS
+from .testing import notify_inline
+
+@notify_inline
+@override_settings(STORY_VISIBILITY_INDEX=True)
+class VisibilityIndexTests(TransactionTestCase):
+  """
+  The visibility index agrees with the SQL permission checks.
+
+  Changes reach the index when their transaction commits, so these tests
+  commit.
+  """
+  def setUp(self):
+    index.reset()
+    self.backend = ObjectPermissionsBackend()
+    self.user1 = User.objects.create(username='user1')
+    self.user2 = User.objects.create(username='user2')
+    self.group1 = Group.objects.create(name='group1')
+    self.group1.user_set.add(self.user1)
+    self.group2 = Group.objects.create(name='group2')
+    self.group2.user_set.add(self.user2)
+
+    self.public = self.add_post('all')
+    self.private = self.add_post('some', [self.group1])
+
+  def tearDown(self):
+    index.reset()
+
+  def add_post(self, viewed_by, viewers=()):
+    post = Post.objects.create(
+      date_posted = timezone.now(),
+      knower = self.group1,
+      viewed_by = viewed_by,
+    )
+    post.viewers.add(*viewers)
+    return post
+
+  def viewable(self, user):
+    user.__dict__.pop('_group_ids_cache', None)
+    return self.backend.filter_viewable(user, Post.objects.order_by('id'))
+
+  def test_bitmap(self):
+    self.assertEqual(bitmap([]).blocks, {})
+    self.assertEqual(bitmap([0, 3, 9]).blocks, {0: 0b1000001001})
+
+    # Only the blocks of the ids are kept.
+    high = 5 << BLOCK_BITS | 2
+    bits = bitmap([1, high])
+    self.assertEqual(bits.blocks, {0: 0b10, 5: 0b100})
+    self.assertIn(high, bits)
+    self.assertNotIn(high + 1, bits)
+    self.assertNotIn(3 << BLOCK_BITS, bits)
+
+    bits.discard(1)
+    self.assertEqual(bits.blocks, {5: 0b100})
+    bits.update(bitmap([high + 1]))
+    bits.difference_update(bitmap([high]))
+    self.assertEqual(bits, bitmap([high + 1]))
+
+  def test_load(self):
+    index.load()
+    self.assertTrue(index.warm)
+
+    # The posts and the user's groups are read, but not the viewers.
+    with self.assertNumQueries(2):
+      self.assertEqual(self.viewable(self.user1), [self.public, self.private])
+    self.assertEqual(self.viewable(self.user2), [self.public])
+
+  def test_cold(self):
+    # A cold index falls back to SQL and starts loading in the background.
+    self.assertFalse(index.warm)
+    with mock.patch.object(index, 'load_async') as load_async:
+      self.assertEqual(self.viewable(self.user2), [self.public])
+    load_async.assert_called_once_with()
+
+  def test_changed_while_loading(self):
+    # A load that races with a change is discarded.
+    original = Post.objects.filter
+    def filter(*args, **kwargs):
+      index.set_public(self.private.id, True)
+      return original(*args, **kwargs)
+    with mock.patch.object(Post.objects, 'filter', filter):
+      index.load()
+    self.assertFalse(index.warm)
+
+  def test_updates(self):
+    index.load()
+    self.private.viewers.add(self.group2)
+    self.assertEqual(self.viewable(self.user2), [self.public, self.private])
+
+    self.group2.views.clear()
+    self.assertEqual(self.viewable(self.user2), [self.public])
+
+    self.private.viewed_by = 'all'
+    self.private.save()
+    self.assertEqual(self.viewable(self.user2), [self.public, self.private])
+
+    post = self.add_post('some', [self.group2])
+    self.assertEqual(
+      self.viewable(self.user2),
+      [self.public, self.private, post]
+    )
+    post.delete()
+    self.group1.delete()
+    self.assertTrue(index.warm)
+    self.assertEqual(self.viewable(self.user2), [])
+
+  def test_rolled_back(self):
+    index.load()
+
+    class RolledBack(Exception):
+      pass
+    with self.assertRaises(RolledBack):
+      with transaction.atomic():
+        self.private.viewers.add(self.group2)
+        self.public.viewed_by = 'some'
+        self.public.save()
+        # Other requests do not see the change before it commits.
+        self.assertNotIn(self.private.id,
+                         index.viewable_mask([self.group2.id]))
+        raise RolledBack()
+
+    self.assertTrue(index.warm)
+    self.assertEqual(self.viewable(self.user2), [self.public])
@@ -0,0 +1,64 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import mock
+
+from . import instrumentation, notifications
+
+class QueryBudgetMixin:
+  """
+  A TestCase mixin that checks how many queries the requests to a view use,
+  as recorded by InstrumentationMiddleware.
+  """
+  @contextmanager
+  def assertQueryBudget(self, view_name, budget):
+    """
+    Fails if any request made to the view inside the block uses more than
+    budget queries, or if no request was made to it.
+    """
+    recorded = []
+
+    def listener(name, timings):
+      if name == view_name:
+        recorded.append(timings.queries)
+
+    instrumentation.listeners.append(listener)
+    try:
+      yield
+    finally:
+      instrumentation.listeners.remove(listener)
+
+    if not recorded:
+      self.fail('No request was made to %s.' % view_name)
+    for queries in recorded:
+      if queries > budget:
+        self.fail('%s used %d queries, over its budget of %d.'
+                  % (view_name, queries, budget))
+
+class InlineExecutor:
+  """
+  An executor that runs each function as it is submitted.
+  """
+  def submit(self, function, *args, **kwargs):
+    future = Future()
+    future.set_result(function(*args, **kwargs))
+    return future
+
+def notify_inline(test_case):
+  """
+  A TransactionTestCase decorator that notifies of private posts in the
+  thread of the test, rather than in the background thread.
+
+  The test database is SQLite shared in memory, where a query fails rather
+  than waits while another thread writes.
+  """
+  set_up = test_case.setUp
+
+  def setUp(self):
+    patcher = mock.patch.object(notifications, 'get_executor', InlineExecutor)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    set_up(self)
+
+  test_case.setUp = setUp
+  return test_case
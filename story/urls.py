@@ -5,13 +5,30 @@ from . import views
 app_name='story'
 urlpatterns = [
   path('', views.IndexView.as_view(), name='index'),
+  path('api/feed', views.feed_api, name='feed_api'),
+  path('api/live', views.live_feed, name='live_feed'),
   path('post/<int:pk>', views.PostView.as_view(), name='post'),
+  path('post/<int:pk>/comment', views.add_comment, name='add_comment'),
+  path('api/post/<int:pk>/comments', views.comments_api, name='comments_api'),
+  path('post/<int:pk>/file', views.download_post_file, name='post_file'),
+  path('post/<int:pk>/thumbnail', views.post_thumbnail, name='post_thumbnail'),
   path('upload_post/', views.edit_post, name='upload_post'),
   path('edit_post/<int:pk>', views.edit_post, name='edit_post'),
+  path('search', views.search, name='search'),
   path('register', views.register, name='register'),
   path('profile/<int:pk>', views.view_profile, name="profile"),
   path('update_profile', views.update_profile, name='update_profile'),
   path('register_group', views.register_group, name='register_group'),
   path('group/<int:pk>', views.GroupProfileView.as_view(), name='group_profile'),
+  path('group/<int:pk>/export', views.export_group, name='export_group'),
+  path('api/group/<int:pk>/users', views.user_autocomplete,
+       name='user_autocomplete'),
+  path('group/<int:pk>/members', views.bulk_group_members,
+       name='bulk_group_members'),
   path('add_to_group/<int:pk>', views.add_group_member, name='add_to_group'),
+  path('notifications', views.notifications_list, name='notifications'),
+  path('api/notifications/unread', views.unread_count_api,
+       name='unread_count_api'),
+  path('api/instrumentation', views.instrumentation_api,
+       name='instrumentation_api'),
 ]
@@ -1,42 +1,220 @@
+import hashlib
+import os
+
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User, Group
-from django.contrib.messages import error
+from django.contrib.messages import error, success, get_messages
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.core.files.storage import FileSystemStorage
-from django.http import HttpResponseRedirect, Http404
-from django.shortcuts import render, redirect
+from django.middleware.csrf import get_token
+from django.http import HttpResponseRedirect, Http404, JsonResponse, \
+                        StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
+from django.templatetags.static import static
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from .models import UserProfile, Post
-from .forms import PostForm, ProfileForm, GroupCreationForm, AddUserToGroupForm
+from .models import UserProfile, Post, GroupProfile
+from .forms import PostForm, ProfileForm, GroupCreationForm, \
+                   AddUserToGroupForm, CommentForm, BulkMembershipForm
 from .access import ObjectPermissionsBackend
+from . import autocomplete, caching, comments, derivatives, exports, \
+              instrumentation, live, members, membership, notifications, \
+              objects, routers
+from .downloads import serve_file
+from .feed import get_feed
+from .pagination import InvalidCursor, next_cursor
+from .search import search_posts
+
+def page_etag(request, *parts):
+  """
+  Returns an ETag for a page of the requesting user made from the given
+  parts, or None if the page must be rendered.
 
+  Pages show the user and carry their CSRF token, so both are part of the
+  tag. Pages are always rendered while messages are waiting to be shown.
+  """
+  if len(get_messages(request)):
+    return None
+  # Makes sure the CSRF cookie is set before it is read.
+  get_token(request)
+  parts = (request.user.pk, request.META['CSRF_COOKIE']) + parts
+  return hashlib.md5(repr(parts).encode()).hexdigest()
+
+def feed_etag(request, *args, **kwargs):
+  """
+  The feed of a user changes only when the version of their audience does,
+  which is read without loading any posts.
+  """
+  backend = ObjectPermissionsBackend()
+  audience = caching.audience_key(backend.get_group_ids(request.user))
+  return page_etag(request, audience, request.GET.get('before'))
+
+def get_cached_post(request, pk):
+  """
+  Returns a post from the object cache, read once per request for the
+  conditional request checks, the view and its permission checks, or None if
+  there is no such post.
+  """
+  post = getattr(request, '_cached_post', None)
+  if post is None or post.pk != int(pk):
+    post = objects.get_post(pk)
+    request._cached_post = post
+  return post
+
+def get_cached_post_or_404(request, pk):
+  post = get_cached_post(request, pk)
+  if post is None:
+    raise Http404('No post found matching the query.')
+  return post
+
+def post_last_modified(request, pk):
+  if len(get_messages(request)):
+    return None
+  post = get_cached_post(request, pk)
+  return post.date_modified if post else None
+
+def post_etag(request, pk):
+  """
+  A post page changes with the post and its comments, and with the groups of
+  the user, which decide whether they can view and change it.
+  """
+  date_modified = post_last_modified(request, pk)
+  if date_modified is None:
+    return None
+  backend = ObjectPermissionsBackend()
+  audience = caching.audience_key(backend.get_group_ids(request.user))
+  return page_etag(request, audience, date_modified.isoformat(),
+                   request.GET.get('comments_after'))
+
+# Pages are private to the user and revalidated on every visit, which costs
+# a 304 when nothing has changed.
+revalidate = cache_control(private=True, no_cache=True)
+
+@method_decorator([revalidate, condition(etag_func=feed_etag)], name='get')
 class IndexView(generic.ListView):
   """
   The index page displays the 5 most recent posts.
+
+  Older posts are paged through with the 'before' cursor of the last post on
+  the previous page. Conditional requests are answered with 304 Not Modified
+  while the feed of the user's audience is unchanged.
+
+  Returns:
+  context{
+    latest_post_list: the posts on this page,
+    feed: the rendered posts on this page,
+    next_cursor: the cursor of the next page, or None on the last page,
+    live_url: the URL of the live feed, or None unless STORY_LIVE_FEED is on
+  }
   """
   template_name = 'story/index.html'
   context_object_name = 'latest_post_list'
+  page_size = 5
 
   def get_queryset(self):
-    posts = ObjectPermissionsBackend().get_viewable_posts(self.request.user)
-    return posts.order_by('-date_posted')[:5]
+    try:
+      posts = get_feed(self.request.user, self.request.GET.get('before'))
+    except InvalidCursor:
+      raise Http404('Invalid cursor.')
+    return posts[:self.page_size]
+
+  def get_context_data(self, **kwargs):
+    context = super(IndexView, self).get_context_data(**kwargs)
+    # Users with the same groups see the same feed, so the rendered feed is
+    # cached for their audience and the posts are only read on a miss.
+    backend = ObjectPermissionsBackend()
+    audience = caching.audience_key(backend.get_group_ids(self.request.user))
+    key = caching.feed_key(audience, self.request.GET.get('before'))
+    cached = cache.get(key)
+    if cached is None:
+      with routers.primary():
+        posts = self.object_list
+        changeable = backend.filter_changeable(self.request.user, posts)
+        cursor = next_cursor(posts, self.page_size)
+        feed = render_to_string('story/feed.html', {
+          'latest_post_list': posts,
+          'changeable_post_ids': set(post.id for post in changeable),
+          'thumbnail_post_ids': set(
+            post.id for post in posts
+            if post.thumbnail or derivatives.has_thumbnail(post)
+          ),
+          'placeholder': derivatives.PLACEHOLDER,
+          'next_cursor': cursor,
+        })
+      cached = (feed, cursor)
+      cache.set(key, cached, caching.get_timeout())
+    context['feed'], context['next_cursor'] = cached
+    context['live_url'] = reverse('story:live_feed') if live.is_enabled() \
+                          else None
+    return context
 
+def feed_api(request):
+  """
+  Returns a page of the posts the requesting user can view as JSON.
+
+  Arguments:
+  before : (GET) the cursor of the previous page
+  limit : (GET) the number of posts to return, from 1 to 50
+
+  Returns:
+  {
+    posts: [{id, description, date_posted, url}],
+    next: the cursor of the next page, or null on the last page
+  }
+  """
+  try:
+    limit = int(request.GET.get('limit', 20))
+  except ValueError:
+    return JsonResponse({'error': 'Invalid limit.'}, status=400)
+  limit = max(1, min(limit, 50))
+  try:
+    posts = get_feed(request.user, request.GET.get('before'))
+  except InvalidCursor:
+    return JsonResponse({'error': 'Invalid request.'}, status=400)
+
+  posts = list(posts[:limit])
+  return JsonResponse({
+    'posts': [{
+        'id': post.id,
+        'description': post.description,
+        'date_posted': post.date_posted.isoformat(),
+        'url': reverse('story:post', kwargs={'pk': post.id}),
+      } for post in posts],
+    'next': next_cursor(posts, limit),
+  })
+
+@method_decorator([revalidate, condition(
+  etag_func=post_etag,
+  last_modified_func=post_last_modified
+)], name='get')
 class PostView(generic.DetailView):
   """
   Displays a post if the requesting user has permission.
 
+  Conditional requests are answered with 304 Not Modified while the post, its
+  comments and the groups of the user are unchanged.
+
   Arguments:
   pk : the id of the post to be displayed
 
   Returns:
   context{
-    post: the post to be displayed
+    post: the post to be displayed,
+    can_change: whether the user can edit the post,
+    post_body: the rendered post with a page of its comments,
+    comment_form: the CommentForm for adding a comment
   }
   """
   model = Post;
@@ -46,12 +224,176 @@ class PostView(generic.DetailView):
   }
 
   def get_object(self, queryset=None):
-    obj = super(PostView, self).get_object(queryset=queryset)
+    obj = get_cached_post_or_404(self.request, self.kwargs['pk'])
     if not self.request.user.has_perm('story.view_post', obj):
         error(self.request, self.error_message['unauthorised'])
         return None
     return obj
 
+  def get_context_data(self, **kwargs):
+    context = super(PostView, self).get_context_data(**kwargs)
+    if self.object:
+      context['can_change'] = self.request.user.has_perm(
+        'story.change_post',
+        self.object
+      )
+      context['post_body'] = self.get_post_body()
+      context['comment_form'] = CommentForm()
+    return context
+
+  def get_post_body(self):
+    """
+    Returns the rendered post with a page of its comments, from the cache if
+    the post has not changed since it was rendered.
+    """
+    cursor = self.request.GET.get('comments_after')
+    key = caching.post_key(self.object.id, cursor)
+    body = cache.get(key)
+    if body is None:
+      with routers.primary():
+        try:
+          page = comments.get_comments(self.object, cursor)
+        except InvalidCursor:
+          raise Http404('Invalid cursor.')
+        page = list(page[:comments.PAGE_SIZE])
+        body = render_to_string('story/post_body.html', {
+          'post': self.object,
+          'comments': page,
+          'next_comments_cursor': next_cursor(page, comments.PAGE_SIZE),
+        })
+      cache.set(key, body, caching.get_timeout())
+    return body
+
+def comments_api(request, pk):
+  """
+  Returns a page of the comments on a post as JSON, if the requesting user
+  has permission to view the post.
+
+  Arguments:
+  pk : the id of the post
+  after : (GET) the cursor of the previous page
+
+  Returns:
+  {
+    comments: [{id, text, date_posted, poster: {id, name}}],
+    next: the cursor of the next page, or null on the last page
+  }
+  """
+  post = get_cached_post_or_404(request, pk)
+  if not request.user.has_perm('story.view_post', post):
+    raise PermissionDenied(PostView.error_message['unauthorised'])
+  try:
+    page = comments.get_comments(post, request.GET.get('after'))
+  except InvalidCursor:
+    return JsonResponse({'error': 'Invalid request.'}, status=400)
+
+  page = list(page[:comments.PAGE_SIZE])
+  return JsonResponse({
+    'comments': [{
+        'id': comment.id,
+        'text': comment.text,
+        'date_posted': comment.date_posted.isoformat(),
+        'poster': {
+          'id': comment.poster_id,
+          'name': comments.poster_name(comment),
+        },
+      } for comment in page],
+    'next': next_cursor(page, comments.PAGE_SIZE),
+    'count': post.comment_count,
+  })
+
+def live_feed(request):
+  """
+  Streams the ids of new posts that the requesting user can view as
+  Server-Sent Events, with a heartbeat comment while there are none.
+
+  The stream holds a thread until the client disconnects,
+  STORY_LIVE_MAX_SECONDS pass, or the user's groups change. Under ASGI,
+  live.LiveApplication serves the same path without a thread per connection.
+  Only served when STORY_LIVE_FEED is on.
+
+  Returns:
+  'post' events with data {id}, or a 'reload' event if the client fell too
+  far behind
+  """
+  if not live.is_enabled():
+    raise Http404('The live feed is off.')
+  subscription = live.hub.subscribe(
+    live.get_group_ids(request.user),
+    user_id=request.user.id
+  )
+  if subscription is None:
+    return JsonResponse({'error': 'Too many connections.'}, status=503)
+  response = StreamingHttpResponse(
+    live.stream(subscription),
+    content_type='text/event-stream'
+  )
+  response['Cache-Control'] = 'no-cache'
+  response['X-Accel-Buffering'] = 'no'
+  return response
+
+@login_required
+def add_comment(request, pk):
+  """
+  Adds a comment to a post, if the requesting user has permission to view
+  the post.
+
+  Arguments:
+  pk : the id of the post
+
+  Form contains the text of the comment.
+  """
+  error_message = "Access not authorised."
+  redirect_to = 'story:post'
+  post = get_object_or_404(Post, pk=pk)
+
+  if not request.user.has_perm('story.view_post', post):
+    error(request, error_message)
+    return redirect('story:index')
+
+  if request.method == 'POST':
+    form = CommentForm(request.POST)
+    if form.is_valid():
+      comments.add_comment(post, request.user, form.cleaned_data['text'])
+    else:
+      error(request, "The comment could not be added.")
+  return redirect(redirect_to, pk=pk)
+
+def download_post_file(request, pk):
+  """
+  Sends the file of a post if the requesting user has permission to view
+  the post.
+
+  Arguments:
+  pk : the id of the post whose file is sent
+
+  Supports single byte Range requests and conditional requests with the
+  ETag of the file.
+  """
+  post = get_cached_post_or_404(request, pk)
+  if not post.file:
+    raise Http404('This post has no file.')
+  if not request.user.has_perm('story.view_post', post):
+    raise PermissionDenied(PostView.error_message['unauthorised'])
+  return serve_file(request, post.file)
+
+def post_thumbnail(request, pk):
+  """
+  Sends the thumbnail of a post if the requesting user has permission to
+  view the post.
+
+  Redirects to a placeholder image until the thumbnail is ready. The redirect
+  is cached briefly so that pages showing many posts stay cheap.
+  """
+  post = get_cached_post_or_404(request, pk)
+  if not request.user.has_perm('story.view_post', post):
+    raise PermissionDenied(PostView.error_message['unauthorised'])
+  if not post.thumbnail:
+    response = redirect(static(derivatives.PLACEHOLDER))
+    patch_cache_control(response, private=True, max_age=60)
+    return response
+  return serve_file(request, post.thumbnail)
+
 @login_required
 def edit_post(request, pk=None):
   """
@@ -66,7 +408,12 @@ def edit_post(request, pk=None):
   redirect_to = 'story:index'
 
   if pk:
-    post = Post.objects.get(pk=pk)
+    if request.method == 'POST':
+      # Saved from the primary copy, so that fields outside the form are
+      # never written back from the cache.
+      post = get_object_or_404(Post, pk=pk)
+    else:
+      post = get_cached_post_or_404(request, pk)
     template_name = 'story/edit_post.html'
 
     if not request.user.has_perm('story.change_post', post):
@@ -88,14 +435,48 @@ def edit_post(request, pk=None):
       if not post:
         p.date_posted = timezone.now()
         p.poster =  request.user
+      if 'file' in form.changed_data:
+        p.thumbnail = ''
+        p.thumbnail_width = p.thumbnail_height = None
       p.save()
       form.save_m2m()
+      if 'file' in form.changed_data:
+        derivatives.schedule(p)
       return redirect(redirect_to)
   else:
     form = PostForm(instance=post)
   context = {'form': form, 'post':post}
   return render(request,  template_name, context)
 
+def search(request):
+  """
+  Searches the descriptions and comments of the posts the requesting user
+  can view.
+
+  Arguments:
+  q : (GET) the words to search for
+  after : (GET) the cursor of the previous page
+
+  Returns:
+  context{
+    query: the words searched for,
+    results: the matching posts, best match first,
+    next_cursor: the cursor of the next page, or None on the last page
+  }
+  """
+  template_name = 'story/search.html'
+  query = request.GET.get('q', '')
+  try:
+    results, cursor = search_posts(
+      request.user,
+      query,
+      request.GET.get('after')
+    )
+  except InvalidCursor:
+    raise Http404('Invalid cursor.')
+  context = {'query': query, 'results': results, 'next_cursor': cursor}
+  return render(request, template_name, context)
+
 def register(request):
   """
   A new user is registered and logged in.
@@ -182,27 +563,81 @@ def update_profile(request):
 
 class GroupProfileView(generic.DetailView):
   """
-  Displays the profile for the given group and the users that belong to the
-  group.
+  Displays the profile for the given group and a page of the users that
+  belong to the group.
 
   Arguments:
   pk : the id of the group to be displayed
+  sort : (GET) 'name' to list members by username, or 'newest' for the
+         newest users first
+  after : (GET) the cursor of the previous page of members
 
   Returns:
   context{
     group: the group to be displayed,
-    users: the users that belong to the group
+    member_count: the number of members of the group,
+    users: the members on this page,
+    sort: the order of the members,
+    next_cursor: the cursor of the next page, or None on the last page
   }
   """
   model = Group;
   template_name = 'story/group_profile.html'
+  queryset = Group.objects.select_related('profile')
 
   def get_context_data(self, **kwargs):
     context = super(GroupProfileView, self).get_context_data(**kwargs)
-    users = self.object.user_set.all()
+    sort = self.request.GET.get('sort', 'name')
+    try:
+      users = members.get_members(
+        self.object,
+        sort,
+        self.request.GET.get('after')
+      )
+    except InvalidCursor:
+      raise Http404('Invalid cursor.')
+    users = list(users[:members.PAGE_SIZE])
+    try:
+      context['member_count'] = self.object.profile.member_count
+    except GroupProfile.DoesNotExist:
+      context['member_count'] = self.object.user_set.count()
     context['users'] = users
+    context['sort'] = sort
+    context['next_cursor'] = members.next_cursor(users, members.PAGE_SIZE, sort)
     return context
 
+@login_required
+def export_group(request, pk):
+  """
+  Streams the posts known by a group that the requesting user can view, with
+  their comments.
+
+  Arguments:
+  pk : the id of the group
+  format : (GET) 'ndjson' for the posts only, or 'zip' for the posts and
+           their files
+  """
+  group = get_object_or_404(Group, pk=pk)
+  posts = exports.group_posts(group, request.user)
+  export_format = request.GET.get('format', 'ndjson')
+  if export_format == 'ndjson':
+    response = StreamingHttpResponse(
+      exports.export_ndjson(posts),
+      content_type='application/x-ndjson'
+    )
+  elif export_format == 'zip':
+    response = StreamingHttpResponse(
+      exports.export_zip(posts),
+      content_type='application/zip'
+    )
+  else:
+    raise Http404('Unknown export format.')
+  response['Content-Disposition'] = 'attachment; filename="group-%d.%s"' % (
+    group.id,
+    export_format
+  )
+  return response
+
 @login_required
 def register_group(request):
   """
@@ -222,6 +657,31 @@ def register_group(request):
   context = {'form' : form}
   return render(request, template_name, context)
 
+@login_required
+def user_autocomplete(request, pk):
+  """
+  Returns the users whose username or name starts with the query and who are
+  not members of a group, as JSON.
+
+  Arguments:
+  pk : the id of the group
+  q : (GET) the start of the username or name
+
+  Returns:
+  {
+    users: [{id, username, name}]
+  }
+  """
+  group = get_object_or_404(Group, pk=pk)
+  users = autocomplete.find_users(request.GET.get('q', ''), group)
+  return JsonResponse({
+    'users': [{
+        'id': user.id,
+        'username': user.username,
+        'name': autocomplete.display_name(user),
+      } for user in users],
+  })
+
 @login_required
 def add_group_member(request, pk):
   """
@@ -234,15 +694,113 @@ def add_group_member(request, pk):
   """
   template_name = 'story/add_to_group.html'
   redirect_to = '/group/' + str(pk)
-  group = Group.objects.get(pk=pk)
+  group = get_object_or_404(Group, pk=pk)
 
   if request.method == 'POST':
-    form = AddUserToGroupForm(request.POST)
+    form = AddUserToGroupForm(request.POST, group=group)
     if form.is_valid():
         user = form.cleaned_data['joining_user']
         group.user_set.add(user)
         return redirect(redirect_to)
   else:
-    form = AddUserToGroupForm(initial={'user':request.user, 'group':group})
-    context = {'form' : form, 'group' : group}
+    form = AddUserToGroupForm(group=group)
+  context = {'form' : form, 'group' : group}
   return render(request, template_name, context)
+
+GROUP_PERMISSION_ERROR = 'Only members of a group can change its members.'
+
+@login_required
+def bulk_group_members(request, pk):
+  """
+  Adds or removes many users to or from a group at once.
+
+  Arguments:
+  pk: The id of the group.
+
+  Form contains the action, and the users as text or a CSV file.
+  """
+  template_name = 'story/bulk_members.html'
+  group = get_object_or_404(Group, pk=pk)
+  if not request.user.has_perm('auth.change_group', group):
+    raise PermissionDenied(GROUP_PERMISSION_ERROR)
+
+  if request.method == 'POST':
+    form = BulkMembershipForm(request.POST, request.FILES)
+    if form.is_valid():
+      user_ids = form.cleaned_data['user_ids']
+      if form.cleaned_data['action'] == 'add':
+        changed = membership.add_members(group, user_ids)
+        success(request, 'Added %d users.' % len(changed))
+      else:
+        changed = membership.remove_members(group, user_ids)
+        success(request, 'Removed %d users.' % len(changed))
+      return redirect('story:group_profile', pk=pk)
+  else:
+    form = BulkMembershipForm()
+  context = {'form' : form, 'group' : group}
+  return render(request, template_name, context)
+
+@login_required
+def notifications_list(request):
+  """
+  Lists the latest notifications of the requesting user. Posting marks them
+  all as read.
+
+  Returns:
+  context{
+    notifications: the notifications of posts the user can still view, with
+                   whether each is unread
+  }
+  """
+  template_name = 'story/notifications.html'
+  if request.method == 'POST':
+    notifications.mark_read(request.user)
+    return redirect('story:notifications')
+
+  latest = notifications.get_notifications(request.user)
+  viewable = ObjectPermissionsBackend().filter_viewable(
+    request.user,
+    [notification.post for notification in latest]
+  )
+  viewable = set(post.id for post in viewable)
+  context = {
+    'notifications': [n for n in latest if n.post_id in viewable],
+  }
+  return render(request, template_name, context)
+
+@cache_control(private=True, no_cache=True)
+def unread_count_api(request):
+  """
+  Returns the number of unread notifications of the requesting user as JSON.
+  It reads a single row, so that clients can poll it often.
+
+  Returns:
+  {
+    unread: the number of unread notifications, 0 when logged out
+  }
+  """
+  return JsonResponse({
+    'unread': notifications.get_unread_count(request.user),
+  })
+
+@cache_control(private=True, no_cache=True)
+def instrumentation_api(request):
+  """
+  Returns the counters of each view recorded by InstrumentationMiddleware in
+  the process serving the request, since it started, as JSON. Only staff
+  can read them.
+
+  Returns:
+  {
+    pid: the id of the process,
+    views: {view name: {requests, queries, db_time, template_time,
+                        wall_time}}, with times in seconds
+  }
+  """
+  if not request.user.is_staff:
+    raise PermissionDenied('Only staff can read the instrumentation.')
+  totals = instrumentation.get_totals()
+  return JsonResponse({
+    'pid': os.getpid(),
+    'views': dict((name or '', total) for name, total in totals.items()),
+  })
@@ -0,0 +1,287 @@
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+from .models import Post
+from . import bus
+
+# Changes to more posts sent by other processes make the index load again.
+MAX_REFRESH = 500
+
+class VisibilityIndex:
+  """
+  An in-memory index of which posts each group can view.
+
+  The index keeps one bitset of the public posts and one bitset per group of
+  the private posts it views. The posts a user can view are then the union
+  of the public bitset and the bitsets of the user's groups.
+
+  The index is cold until it has been loaded. Changes made while it loads
+  leave it cold, so that callers keep using SQL until a clean load.
+  """
+  def __init__(self):
+    self.lock = threading.RLock()
+    self.warm = False
+    self.loading = False
+    self.changed = False
+    self.public = Bitset()
+    self.groups = {}
+
+  def load(self):
+    """
+    Loads the bitsets from the database.
+    """
+    with self.lock:
+      if self.loading:
+        return
+      self.loading = True
+      self.changed = False
+
+    try:
+      public = bitmap(
+        Post.objects.filter(viewed_by__exact='all')
+            .values_list('id', flat=True)
+      )
+      viewers = Post.viewers.through.objects.order_by('group_id')
+      groups = {}
+      group_id, post_ids = None, []
+      for row in viewers.values_list('group_id', 'post_id').iterator():
+        if row[0] != group_id:
+          if post_ids:
+            groups[group_id] = bitmap(post_ids)
+          group_id, post_ids = row[0], []
+        post_ids.append(row[1])
+      if post_ids:
+        groups[group_id] = bitmap(post_ids)
+    except Exception:
+      with self.lock:
+        self.loading = False
+      raise
+
+    with self.lock:
+      self.loading = False
+      if not self.changed:
+        self.public, self.groups = public, groups
+        self.warm = True
+
+  def load_async(self):
+    """
+    Loads the bitsets in a background thread.
+    """
+    with self.lock:
+      if self.warm or self.loading:
+        return
+    threading.Thread(target=self._load_and_close, daemon=True).start()
+
+  def _load_and_close(self):
+    try:
+      self.load()
+    finally:
+      connection.close()
+
+  def reset(self):
+    with self.lock:
+      self.changed = True
+      self.warm = False
+      self.public = Bitset()
+      self.groups = {}
+
+  def viewable_mask(self, group_ids):
+    """
+    Returns the bitset of the posts viewable by members of the given groups.
+    """
+    with self.lock:
+      mask = self.public.copy()
+      for group_id in group_ids:
+        if group_id in self.groups:
+          mask.update(self.groups[group_id])
+      return mask
+
+  def filter_viewable(self, group_ids, posts):
+    """
+    Returns the posts viewable by members of the given groups, in order.
+    """
+    mask = self.viewable_mask(group_ids)
+    return [post for post in posts if post.id in mask]
+
+  def set_public(self, post_id, public):
+    with self.lock:
+      self.changed = True
+      if public:
+        self.public.add(post_id)
+      else:
+        self.public.discard(post_id)
+
+  def add_viewers(self, post_ids, group_ids):
+    with self.lock:
+      self.changed = True
+      bits = bitmap(post_ids)
+      for group_id in group_ids:
+        self.groups.setdefault(group_id, Bitset()).update(bits)
+
+  def remove_viewers(self, post_ids, group_ids):
+    with self.lock:
+      self.changed = True
+      bits = bitmap(post_ids)
+      for group_id in group_ids:
+        if group_id in self.groups:
+          self.groups[group_id].difference_update(bits)
+
+  def remove_post(self, post_id):
+    with self.lock:
+      self.changed = True
+      self.public.discard(post_id)
+      for bits in self.groups.values():
+        bits.discard(post_id)
+
+  def refresh(self, post_ids):
+    """
+    Sets the bits of the given posts from the database, whatever changes to
+    them were applied before.
+    """
+    posts = Post.objects.using(DEFAULT_DB_ALIAS).filter(id__in=post_ids)
+    public = bitmap(
+      posts.filter(viewed_by__exact='all').values_list('id', flat=True)
+    )
+    viewers = Post.viewers.through.objects.using(DEFAULT_DB_ALIAS) \
+                  .filter(post_id__in=post_ids)
+    viewers = list(viewers.values_list('group_id', 'post_id'))
+    with self.lock:
+      self.changed = True
+      bits = bitmap(post_ids)
+      self.public.difference_update(bits)
+      self.public.update(public)
+      for group_bits in self.groups.values():
+        group_bits.difference_update(bits)
+      for group_id, post_id in viewers:
+        self.groups.setdefault(group_id, Bitset()).add(post_id)
+
+  def remove_group(self, group_id):
+    with self.lock:
+      self.changed = True
+      self.groups.pop(group_id, None)
+
+# Bitsets are split in blocks of 2 ** BLOCK_BITS ids.
+BLOCK_BITS = 16
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+class Bitset:
+  """
+  A set of ids, kept as blocks of bits keyed by id >> BLOCK_BITS, where bit n
+  of a block is set if id (key << BLOCK_BITS) + n is in the set.
+
+  Each block is a Python int of at most 2 ** BLOCK_BITS bits, and blocks
+  without ids are not kept, so that a set takes space for the ranges of ids
+  it holds rather than up to its highest id, and changing an id rewrites one
+  block.
+  """
+  __slots__ = ('blocks',)
+
+  def __init__(self, blocks=None):
+    self.blocks = blocks or {}
+
+  def __contains__(self, pk):
+    return bool(self.blocks.get(pk >> BLOCK_BITS, 0) >> (pk & BLOCK_MASK) & 1)
+
+  def __eq__(self, other):
+    return isinstance(other, Bitset) and self.blocks == other.blocks
+
+  def __repr__(self):
+    return 'Bitset(%r)' % self.blocks
+
+  def copy(self):
+    return Bitset(dict(self.blocks))
+
+  def add(self, pk):
+    key = pk >> BLOCK_BITS
+    self.blocks[key] = self.blocks.get(key, 0) | 1 << (pk & BLOCK_MASK)
+
+  def discard(self, pk):
+    key = pk >> BLOCK_BITS
+    if key in self.blocks:
+      self.set_block(key, self.blocks[key] & ~(1 << (pk & BLOCK_MASK)))
+
+  def update(self, other):
+    for key, block in other.blocks.items():
+      self.blocks[key] = self.blocks.get(key, 0) | block
+
+  def difference_update(self, other):
+    for key, block in other.blocks.items():
+      if key in self.blocks:
+        self.set_block(key, self.blocks[key] & ~block)
+
+  def set_block(self, key, block):
+    if block:
+      self.blocks[key] = block
+    else:
+      del self.blocks[key]
+
+def bitmap(ids):
+  """
+  Returns a bitset of the given ids.
+  """
+  blocks = {}
+  for pk in ids:
+    key = pk >> BLOCK_BITS
+    bits = blocks.get(key)
+    if bits is None:
+      bits = blocks[key] = bytearray(1 << BLOCK_BITS >> 3)
+    offset = pk & BLOCK_MASK
+    bits[offset >> 3] |= 1 << (offset & 7)
+  return Bitset(dict(
+    (key, int.from_bytes(bits, 'little')) for key, bits in blocks.items()
+  ))
+
+index = VisibilityIndex()
+
+def get_visibility_index():
+  """
+  Returns the visibility index, or None if STORY_VISIBILITY_INDEX is off.
+  """
+  if getattr(settings, 'STORY_VISIBILITY_INDEX', False):
+    return index
+  return None
+
+def update(method, *args):
+  """
+  Applies a change to the index of this process, and through the
+  invalidation bus to the indexes of the others.
+
+  The change is applied and sent once the current transaction commits, so
+  that a change that is rolled back never reaches the indexes.
+
+  Arguments:
+  method : the name of the VisibilityIndex method that makes the change
+  args : its arguments, which must be JSON serializable
+  """
+  index = get_visibility_index()
+  if index is None:
+    return
+  transaction.on_commit(lambda: getattr(index, method)(*args))
+  bus.send('visibility', method=method, args=args)
+
+def replay(method, args):
+  """
+  Applies a change sent by another process.
+
+  Changes to posts can arrive in another order than they were committed, so
+  the posts are read again rather than the change applied.
+  """
+  index = get_visibility_index()
+  if index is None:
+    return
+  if method in ('set_public', 'remove_post'):
+    post_ids = [args[0]]
+  elif method in ('add_viewers', 'remove_viewers'):
+    post_ids = args[0]
+  else:
+    getattr(index, method)(*args)
+    return
+  if len(post_ids) > MAX_REFRESH:
+    index.reset()
+  else:
+    index.refresh(post_ids)
+
+bus.register('visibility', replay)
+bus.on_reset(index.reset)
@@ -0,0 +1,27 @@
+"""
+ASGI config for yarns project.
+
+Serves the live feed of new posts without a thread per connection. Other
+requests are passed to the WSGI application through asgiref, which must be
+installed.
+"""
+
+import os
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.core.wsgi import get_wsgi_application
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImproperlyConfigured(
+        'Serving yarns over ASGI requires asgiref (pip install asgiref).'
+    )
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yarns.settings')
+django.setup()
+
+from story.live import LiveApplication
+
+application = LiveApplication(WsgiToAsgi(get_wsgi_application()))
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'story.bus.InvalidationMiddleware',
+    'story.instrumentation.InstrumentationMiddleware',
+    'story.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,7 +61,7 @@ ROOT_URLCONF = 'yarns.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'story.instrumentation.TimedTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -85,6 +88,23 @@ DATABASES = {
     }
 }
 
+# Read replicas of the default database. Set YARNS_SQLITE_REPLICAS to use
+# local SQLite copies, refreshed with `manage.py sync_replicas`.
+STORY_REPLICAS = []
+for i in range(int(os.environ.get('YARNS_SQLITE_REPLICAS', 0))):
+    alias = 'replica%d' % (i + 1)
+    DATABASES[alias] = {
+        'NAME': os.path.join(BASE_DIR, 'db.%s.sqlite3' % alias),
+        'ENGINE': 'django.db.backends.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+    STORY_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['story.routers.PrimaryReplicaRouter']
+
+# Seconds that a client reads from the default database after writing.
+STORY_REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -130,3 +150,34 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
     'story.access.ObjectPermissionsBackend'
 ]
+
+# Run feed fan-out and thumbnail rendering as jobs of `manage.py run_workers`
+# rather than during the request.
+STORY_BACKGROUND_JOBS = os.environ.get('YARNS_BACKGROUND_JOBS') == '1'
+
+# Seconds without a heartbeat from its worker after which a running job is
+# presumed lost and queued again. Workers record one every quarter of this.
+STORY_JOB_TIMEOUT = 600
+
+# Open the live feed of new posts from the index page. Over WSGI each open
+# page holds a worker thread, so turn it on when serving with yarns.asgi.
+STORY_LIVE_FEED = os.environ.get('YARNS_LIVE_FEED') == '1'
+
+# Live feed connections: seconds between heartbeats, events kept for a slow
+# client, open connections per process and seconds before a client
+# reconnects.
+STORY_LIVE_HEARTBEAT = 15
+STORY_LIVE_QUEUE_SIZE = 100
+STORY_LIVE_MAX_CONNECTIONS = 1000
+STORY_LIVE_MAX_SECONDS = 300
+
+# Record cache invalidations in the database so that every process drops its
+# own copies, checking for those of other processes at most every
+# STORY_INVALIDATION_INTERVAL seconds. Changes are kept for
+# STORY_INVALIDATION_RETENTION seconds. Each check reads again the changes of
+# the last STORY_INVALIDATION_WINDOW seconds, for those that committed after
+# changes with higher ids.
+STORY_INVALIDATION_BUS = True
+STORY_INVALIDATION_INTERVAL = 1
+STORY_INVALIDATION_RETENTION = 3600
+STORY_INVALIDATION_WINDOW = 10